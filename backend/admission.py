@@ -0,0 +1,151 @@
+"""
+Admission control for chat turns.
+
+At most CHAT_MAX_IN_FLIGHT turns run at once per process. Up to
+CHAT_MAX_QUEUE more wait for a slot, first come first served, for at most
+CHAT_QUEUE_TIMEOUT seconds; anything beyond that is shed immediately with
+Overloaded, which the API turns into a 503 with Retry-After. A spike then
+costs a few fast rejections instead of a pile of requests that all wait
+for Bedrock to throttle them, and queueing delay stays bounded by the
+timeout.
+
+Waiters are plain futures rather than an asyncio.Semaphore, so one
+controller works across event loops (Mangum runs a loop per invocation).
+"""
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from lifecycle import register_after_fork
+
+CHAT_MAX_IN_FLIGHT = int(os.getenv("CHAT_MAX_IN_FLIGHT", "8"))
+CHAT_MAX_QUEUE = int(os.getenv("CHAT_MAX_QUEUE", "16"))
+CHAT_QUEUE_TIMEOUT = float(os.getenv("CHAT_QUEUE_TIMEOUT", "2"))
+# Waits kept for the percentiles in stats()
+WAIT_SAMPLES = 1024
+
+
+class Overloaded(Exception):
+    """Raised when a request is shed instead of admitted"""
+
+    def __init__(self, reason: str, retry_after: int):
+        super().__init__(f"Shed ({reason}); retry after {retry_after}s")
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class AdmissionController:
+    """Bounded concurrency with a bounded, deadline-limited wait queue"""
+
+    def __init__(self, max_in_flight: int = CHAT_MAX_IN_FLIGHT, max_queue: int = CHAT_MAX_QUEUE,
+                 queue_timeout: float = CHAT_QUEUE_TIMEOUT):
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        # (loop, future) per waiting request, oldest first
+        self._waiters: deque = deque()
+        self._waits_ms: deque = deque(maxlen=WAIT_SAMPLES)
+        self.admitted = 0
+        self.shed = {"queue_full": 0, "timeout": 0}
+        self.peak_queue = 0
+
+    def retry_after(self) -> int:
+        """Seconds a shed client should wait: long enough for the current queue to drain"""
+        return max(1, math.ceil(self.queue_timeout * (1 + len(self._waiters) / max(1, self.max_in_flight))))
+
+    def _shed(self, reason: str) -> Overloaded:
+        self.shed[reason] += 1
+        return Overloaded(reason, self.retry_after())
+
+    async def acquire(self):
+        started = time.perf_counter()
+        with self._lock:
+            if self._in_flight < self.max_in_flight and not self._waiters:
+                self._in_flight += 1
+                self.admitted += 1
+                self._waits_ms.append(0.0)
+                return
+            if len(self._waiters) >= self.max_queue:
+                raise self._shed("queue_full")
+            loop = asyncio.get_running_loop()
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+            self.peak_queue = max(self.peak_queue, len(self._waiters))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter[1]), self.queue_timeout)
+        except (asyncio.TimeoutError, asyncio.CancelledError) as e:
+            with self._lock:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                else:
+                    # Granted a slot just as the deadline passed; hand it on
+                    self._release_locked()
+                if isinstance(e, asyncio.CancelledError):
+                    raise
+                raise self._shed("timeout")
+
+        with self._lock:
+            self.admitted += 1
+            self._waits_ms.append((time.perf_counter() - started) * 1000)
+
+    def _grant(self, waiter):
+        loop, future = waiter
+        loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+    def _release_locked(self):
+        if self._waiters:
+            # The slot passes straight to the oldest waiter; in-flight count is unchanged
+            waiter = self._waiters.popleft()
+            self._grant(waiter)
+        else:
+            self._in_flight -= 1
+
+    def release(self):
+        with self._lock:
+            self._release_locked()
+
+    @asynccontextmanager
+    async def slot(self):
+        """Hold one in-flight slot for the block; raises Overloaded if none comes free in time"""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            waits = sorted(self._waits_ms)
+            queued = len(self._waiters)
+            in_flight = self._in_flight
+
+        def percentile(q: float):
+            return round(waits[max(0, math.ceil(q / 100 * len(waits)) - 1)], 3) if waits else None
+
+        return {
+            "in_flight": in_flight,
+            "queued": queued,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "peak_queue": self.peak_queue,
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "wait_ms": {"p50": percentile(50), "p99": percentile(99), "max": waits[-1] if waits else None},
+        }
+
+
+chat_admission = AdmissionController()
+
+# Limits are per worker process, so each worker starts with its own empty queue
+register_after_fork(chat_admission.reset)
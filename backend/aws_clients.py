@@ -0,0 +1,107 @@
+"""
+One place to build AWS clients.
+
+Every client comes from a single boto3 session, so credentials are
+resolved once and shared, and is cached per (service, region, endpoint),
+so modules asking for the same service get the same client and connection
+pool. Clients are instrumented for tracing.
+
+Settings (per-service ones take the service name upper-cased with - as _,
+e.g. AWS_READ_TIMEOUT_BEDROCK_RUNTIME):
+
+    DEFAULT_AWS_REGION          region for every client (us-east-2)
+    AWS_MAX_POOL_CONNECTIONS    connections per client; defaults to the 40
+                                threads run_in_threadpool can have in flight
+    AWS_CONNECT_TIMEOUT         seconds (3)
+    AWS_READ_TIMEOUT[_SERVICE]  seconds; Bedrock gets 120 for long generations
+    AWS_RETRY_MODE              standard | adaptive | legacy (standard)
+    AWS_MAX_ATTEMPTS[_SERVICE]  including the first call (3)
+    AWS_TCP_KEEPALIVE           keep idle pooled connections alive (true)
+"""
+import os
+import threading
+from typing import Dict, Optional
+
+import boto3
+from botocore.config import Config
+
+from lifecycle import register_after_fork
+from tracing import instrument_client
+
+AWS_REGION = os.getenv("DEFAULT_AWS_REGION", "us-east-2")
+AWS_MAX_POOL_CONNECTIONS = int(os.getenv("AWS_MAX_POOL_CONNECTIONS", "40"))
+AWS_CONNECT_TIMEOUT = float(os.getenv("AWS_CONNECT_TIMEOUT", "3"))
+AWS_RETRY_MODE = os.getenv("AWS_RETRY_MODE", "standard")
+AWS_TCP_KEEPALIVE = os.getenv("AWS_TCP_KEEPALIVE", "true").lower() == "true"
+
+# Defaults per service, before env overrides
+READ_TIMEOUTS = {"bedrock-runtime": 120, "s3": 10, "dynamodb": 3, "apigatewaymanagementapi": 5}
+MAX_ATTEMPTS = {"dynamodb": 2, "apigatewaymanagementapi": 2}
+SERVICE_CONFIG = {
+    # Virtual-hosted, SigV4 URLs; presigned resume links depend on this
+    "s3": Config(signature_version="s3v4", s3={"addressing_style": "virtual"}),
+}
+
+_session: Optional[boto3.session.Session] = None
+_clients: Dict[tuple, object] = {}
+_lock = threading.Lock()
+
+
+def _setting(name: str, service: str, default):
+    value = os.getenv(f"{name}_{service.upper().replace('-', '_')}") or os.getenv(name)
+    return type(default)(value) if value else default
+
+
+def client_config(service: str) -> Config:
+    """The tuned botocore Config a service's clients are built with"""
+    config = Config(
+        connect_timeout=AWS_CONNECT_TIMEOUT,
+        read_timeout=_setting("AWS_READ_TIMEOUT", service, float(READ_TIMEOUTS.get(service, 30))),
+        max_pool_connections=AWS_MAX_POOL_CONNECTIONS,
+        tcp_keepalive=AWS_TCP_KEEPALIVE,
+        retries={"mode": AWS_RETRY_MODE, "total_max_attempts": _setting("AWS_MAX_ATTEMPTS", service, MAX_ATTEMPTS.get(service, 3))},
+    )
+    if service in SERVICE_CONFIG:
+        config = config.merge(SERVICE_CONFIG[service])
+    return config
+
+
+def session() -> boto3.session.Session:
+    global _session
+    with _lock:
+        if _session is None:
+            _session = boto3.session.Session()
+        return _session
+
+
+def client(service: str, region_name: Optional[str] = None, endpoint_url: Optional[str] = None):
+    """The shared, instrumented client for a service (and endpoint, e.g. a WebSocket API stage)"""
+    region_name = region_name or AWS_REGION
+    key = (service, region_name, endpoint_url)
+    existing = _clients.get(key)
+    if existing is not None:
+        return existing
+    shared = session()
+    with _lock:
+        # boto3 sessions aren't thread-safe while creating clients
+        if key not in _clients:
+            _clients[key] = instrument_client(shared.client(
+                service, region_name=region_name, endpoint_url=endpoint_url, config=client_config(service)
+            ))
+        return _clients[key]
+
+
+def close_connections():
+    """Drop every client's pooled connections; they reconnect on next use"""
+    for aws_client in list(_clients.values()):
+        aws_client._endpoint.http_session.close()
+
+
+def _reset_after_fork():
+    global _lock
+    _lock = threading.Lock()
+    # Sockets opened before the fork are shared with the parent; never reuse them
+    close_connections()
+
+
+register_after_fork(_reset_after_fork)
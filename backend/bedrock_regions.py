@@ -0,0 +1,264 @@
+"""
+Latency-aware routing of Bedrock calls across regions.
+
+With BEDROCK_REGIONS set to more than one region (e.g.
+"us-east-2,us-east-1,us-west-2"), call_bedrock and stream_bedrock go
+through a RegionRouter instead of the single regional client. For each
+region the router tracks:
+
+    latency     an exponentially weighted average (BEDROCK_REGION_EWMA_ALPHA)
+                of converse time, or time to the first event for streams
+    error rate  share of failed calls among the last BEDROCK_REGION_WINDOW
+    cooldown    BEDROCK_REGION_COOLDOWN_SECONDS out of rotation after a
+                throttle or an unavailable/timeout error
+
+Each call goes to the available region with the lowest latency, scaled up
+by (1 + BEDROCK_REGION_ERROR_PENALTY * error rate). Regions not tried
+yet go first, and regions that have only ever failed go last, by error
+rate. A BEDROCK_REGION_EXPLORE share of calls goes to a
+random other region, so the estimates stay current. Throttles and
+5xx-type errors fail over to the next region, and a stream fails over
+only before its first event. Validation and access errors are raised
+as-is. BEDROCK_REGION_MODEL_IDS maps regions to their own model or
+inference profile IDs ("eu-west-1=eu.amazon.nova-lite-v1:0,..."), since
+a "global." profile already does its own routing.
+
+The SDK's own retries delay failover, so consider
+AWS_MAX_ATTEMPTS_BEDROCK_RUNTIME=1 (see aws_clients.py) when routing.
+Regions are plain transports and time comes from the clock passed in, so
+routing can be exercised offline with ReplayTransport(simulate_latency=True)
+per region or any stand-in with converse/converse_stream. stats() shows
+every region's figures and how calls were routed.
+"""
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from botocore.exceptions import BotoCoreError, ClientError
+
+import aws_clients
+import tracing
+from bedrock_transport import LiveTransport
+from lifecycle import register_after_fork
+
+BEDROCK_REGIONS = [r.strip() for r in os.getenv("BEDROCK_REGIONS", "").split(",") if r.strip()]
+BEDROCK_REGION_MODEL_IDS = dict(
+    item.strip().split("=", 1) for item in os.getenv("BEDROCK_REGION_MODEL_IDS", "").split(",") if "=" in item
+)
+BEDROCK_REGION_EWMA_ALPHA = float(os.getenv("BEDROCK_REGION_EWMA_ALPHA", "0.3"))
+BEDROCK_REGION_WINDOW = int(os.getenv("BEDROCK_REGION_WINDOW", "50"))
+BEDROCK_REGION_ERROR_PENALTY = float(os.getenv("BEDROCK_REGION_ERROR_PENALTY", "4"))
+BEDROCK_REGION_COOLDOWN_SECONDS = float(os.getenv("BEDROCK_REGION_COOLDOWN_SECONDS", "30"))
+BEDROCK_REGION_EXPLORE = float(os.getenv("BEDROCK_REGION_EXPLORE", "0.05"))
+
+THROTTLE_CODES = {"ThrottlingException", "TooManyRequestsException", "ServiceQuotaExceededException"}
+# Worth trying another region for; anything else is about the request itself
+FAILOVER_CODES = THROTTLE_CODES | {
+    "ServiceUnavailableException", "InternalServerException", "ModelNotReadyException", "ModelTimeoutException",
+}
+
+
+def error_code(e: BaseException) -> Optional[str]:
+    """The code a region failed with if another region might succeed, else None"""
+    if isinstance(e, ClientError):
+        code = e.response.get("Error", {}).get("Code")
+        return code if code in FAILOVER_CODES else None
+    if isinstance(e, BotoCoreError):
+        # Connection failures, read timeouts
+        return type(e).__name__
+    return None
+
+
+class RegionStats:
+    """Rolling latency and error figures for one region"""
+
+    def __init__(self, region: str):
+        self.region = region
+        self.latency_ms: Optional[float] = None
+        self.outcomes: deque = deque(maxlen=BEDROCK_REGION_WINDOW)
+        self.cooldown_until = 0.0
+        self.attempts = 0
+        self.calls = 0
+        self.errors = 0
+        self.throttles = 0
+        self.selected = 0
+        self.failovers = 0
+
+    def error_rate(self) -> float:
+        return sum(self.outcomes) / len(self.outcomes) if self.outcomes else 0.0
+
+    def rank(self) -> Tuple[int, float]:
+        """Sort key: untried regions first, then measured ones by penalised latency, then ones that only failed"""
+        if self.attempts == 0:
+            return 0, 0.0
+        if self.latency_ms is None:
+            return 2, self.error_rate()
+        return 1, self.latency_ms * (1 + BEDROCK_REGION_ERROR_PENALTY * self.error_rate())
+
+
+class RegionRouter:
+    """A Bedrock transport spreading calls over regional transports by measured latency and errors"""
+
+    def __init__(self, transports: Dict[str, object], model_ids: Optional[Dict[str, str]] = None,
+                 clock: Callable[[], float] = time.monotonic, rng: Optional[random.Random] = None):
+        if not transports:
+            raise ValueError("RegionRouter needs at least one region")
+        self.transports = dict(transports)
+        self.model_ids = dict(model_ids or {})
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self.regions = {region: RegionStats(region) for region in self.transports}
+        self.decisions = 0
+        self.explorations = 0
+
+    def order(self) -> List[str]:
+        """Regions to try for the next call, best first; regions cooling down go last"""
+        now = self.clock()
+        with self._lock:
+            available = sorted((s for s in self.regions.values() if s.cooldown_until <= now), key=RegionStats.rank)
+            cooling = sorted((s for s in self.regions.values() if s.cooldown_until > now), key=lambda s: s.cooldown_until)
+            order = [s.region for s in available + cooling]
+            available = [s.region for s in available]
+            if len(available) > 1 and self.rng.random() < BEDROCK_REGION_EXPLORE:
+                explored = self.rng.choice(available[1:])
+                order.remove(explored)
+                order.insert(0, explored)
+                self.explorations += 1
+            self.decisions += 1
+            self.regions[order[0]].selected += 1
+        return order
+
+    def _attempt(self, region: str):
+        tracing.current_span().set_attribute("bedrock.region", region)
+        with self._lock:
+            self.regions[region].attempts += 1
+
+    def record(self, region: str, latency_ms: Optional[float] = None, failure: Optional[str] = None):
+        """One finished call: its latency if it got that far, and its failure code if it failed"""
+        with self._lock:
+            stats = self.regions[region]
+            stats.calls += 1
+            stats.outcomes.append(failure is not None)
+            if failure is not None:
+                stats.errors += 1
+                if failure in THROTTLE_CODES:
+                    stats.throttles += 1
+                stats.cooldown_until = self.clock() + BEDROCK_REGION_COOLDOWN_SECONDS
+            if latency_ms is not None:
+                self._observe_latency(stats, latency_ms)
+
+    def record_latency(self, region: str, latency_ms: float):
+        """Latency of a call still in progress, such as a stream's first event; record() counts it when it ends"""
+        with self._lock:
+            self._observe_latency(self.regions[region], latency_ms)
+
+    @staticmethod
+    def _observe_latency(stats: RegionStats, latency_ms: float):
+        alpha = BEDROCK_REGION_EWMA_ALPHA
+        stats.latency_ms = latency_ms if stats.latency_ms is None else alpha * latency_ms + (1 - alpha) * stats.latency_ms
+
+    def _failed_over(self, region: str, code: str):
+        with self._lock:
+            self.regions[region].failovers += 1
+        print(f"Bedrock {code} in {region}; failing over")
+
+    def _request(self, region: str, request: Dict) -> Dict:
+        if region in self.model_ids:
+            return dict(request, modelId=self.model_ids[region])
+        return request
+
+    def converse(self, **request) -> Dict:
+        order = self.order()
+        for attempt, region in enumerate(order):
+            self._attempt(region)
+            started = self.clock()
+            try:
+                response = self.transports[region].converse(**self._request(region, request))
+            except Exception as e:
+                code = error_code(e)
+                if code is None:
+                    raise
+                self.record(region, failure=code)
+                if attempt == len(order) - 1:
+                    raise
+                self._failed_over(region, code)
+                continue
+            self.record(region, (self.clock() - started) * 1000)
+            return response
+
+    def converse_stream(self, **request) -> Iterator[Dict]:
+        order = self.order()
+        for attempt, region in enumerate(order):
+            self._attempt(region)
+            started = self.clock()
+            try:
+                events = iter(self.transports[region].converse_stream(**self._request(region, request)))
+                first = next(events, None)
+            except Exception as e:
+                code = error_code(e)
+                if code is None:
+                    raise
+                self.record(region, failure=code)
+                if attempt == len(order) - 1:
+                    raise
+                self._failed_over(region, code)
+                continue
+            # Time to first event is what a visitor waits on
+            self.record_latency(region, (self.clock() - started) * 1000)
+            break
+        else:
+            return
+        failure = None
+        try:
+            if first is not None:
+                yield first
+                yield from events
+        except Exception as e:
+            # Too late to fail over, but it still counts against the region
+            failure = error_code(e)
+            raise
+        finally:
+            self.record(region, failure=failure)
+
+    def stats(self) -> Dict:
+        now = self.clock()
+        with self._lock:
+            return {
+                "decisions": self.decisions,
+                "explorations": self.explorations,
+                "regions": {
+                    s.region: {
+                        "latency_ms": round(s.latency_ms, 1) if s.latency_ms is not None else None,
+                        "error_rate": round(s.error_rate(), 3),
+                        "cooldown_seconds": round(max(0.0, s.cooldown_until - now), 1),
+                        "model_id": self.model_ids.get(s.region),
+                        "attempts": s.attempts,
+                        "calls": s.calls,
+                        "errors": s.errors,
+                        "throttles": s.throttles,
+                        "selected": s.selected,
+                        "failovers": s.failovers,
+                    }
+                    for s in self.regions.values()
+                },
+            }
+
+
+def create_router(regions: Optional[List[str]] = None) -> Optional[RegionRouter]:
+    """A router over live clients for BEDROCK_REGIONS, or None when there's only one region to use"""
+    regions = BEDROCK_REGIONS if regions is None else regions
+    if len(regions) < 2:
+        return None
+    router = RegionRouter(
+        {region: LiveTransport(aws_clients.client("bedrock-runtime", region_name=region)) for region in regions},
+        model_ids=BEDROCK_REGION_MODEL_IDS,
+    )
+    register_after_fork(router.reset)
+    return router
@@ -0,0 +1,246 @@
+"""
+Pluggable transports behind call_bedrock.
+
+- live:   forwards to the boto3 bedrock-runtime client (default)
+- record: forwards to the live client and appends every request/response
+          pair, with usage and latency, to a JSONL cassette
+- replay: serves responses from a cassette without any AWS access,
+          optionally sleeping for the recorded latency and streaming
+          tokens at the recorded pace
+
+Select with BEDROCK_TRANSPORT=live|record|replay and BEDROCK_CASSETTE=path.
+"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+BEDROCK_TRANSPORT = os.getenv("BEDROCK_TRANSPORT", "live").lower()
+BEDROCK_CASSETTE = os.getenv("BEDROCK_CASSETTE", "./recordings/bedrock.jsonl")
+BEDROCK_REPLAY_LATENCY = os.getenv("BEDROCK_REPLAY_LATENCY", "false").lower() == "true"
+BEDROCK_REPLAY_LATENCY_SCALE = float(os.getenv("BEDROCK_REPLAY_LATENCY_SCALE", "1.0"))
+BEDROCK_REPLAY_STRICT = os.getenv("BEDROCK_REPLAY_STRICT", "false").lower() == "true"
+
+SYSTEM_PROMPT_PLACEHOLDER = "<system-prompt>"
+
+
+class CassetteMissError(Exception):
+    """Raised in strict replay mode when no recording matches a request"""
+
+
+def normalize_request(request: Dict) -> Dict:
+    """
+    Strip the parts of a converse request that change between runs.
+
+    The first message carries the rendered system prompt, which embeds the
+    current time, so it is replaced by a placeholder plus its length.
+    """
+    normalized = copy.deepcopy(request)
+    messages = normalized.get("messages") or []
+    if messages:
+        text = messages[0]["content"][0].get("text", "")
+        messages[0] = {"role": messages[0]["role"], "content": [{"text": SYSTEM_PROMPT_PLACEHOLDER}],
+                       "length": len(text)}
+    return normalized
+
+
+def request_key(request: Dict) -> str:
+    """Stable match key for a converse request"""
+    normalized = normalize_request(request)
+    if normalized.get("messages"):
+        normalized["messages"][0].pop("length", None)
+    return hashlib.sha256(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def response_text(response: Dict) -> str:
+    return response["output"]["message"]["content"][0]["text"]
+
+
+class LiveTransport:
+    """Send requests straight to a bedrock-runtime client"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def converse(self, **request) -> Dict:
+        return self.client.converse(**request)
+
+    def converse_stream(self, **request) -> Iterator[Dict]:
+        return iter(self.client.converse_stream(**request)["stream"])
+
+
+class RecordingTransport:
+    """Forward to another transport and append each exchange to a cassette"""
+
+    def __init__(self, inner, cassette_path: str):
+        self.inner = inner
+        self.cassette_path = cassette_path
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(cassette_path)), exist_ok=True)
+
+    def _append(self, record: Dict):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            with open(self.cassette_path, "a", encoding="utf-8") as f:
+                f.write(line + "\n")
+
+    def converse(self, **request) -> Dict:
+        started = time.perf_counter()
+        response = self.inner.converse(**request)
+        latency_ms = (time.perf_counter() - started) * 1000
+
+        self._append({
+            "operation": "converse",
+            "key": request_key(request),
+            "request": normalize_request(request),
+            "response": {k: v for k, v in response.items() if k != "ResponseMetadata"},
+            "latency_ms": round(latency_ms, 3),
+            "recorded_at": datetime.now().isoformat(),
+        })
+        return response
+
+    def converse_stream(self, **request) -> Iterator[Dict]:
+        started = time.perf_counter()
+        events = []
+        for event in self.inner.converse_stream(**request):
+            events.append({"offset_ms": round((time.perf_counter() - started) * 1000, 3), "event": event})
+            yield event
+
+        self._append({
+            "operation": "converse_stream",
+            "key": request_key(request),
+            "request": normalize_request(request),
+            "events": events,
+            "latency_ms": round((time.perf_counter() - started) * 1000, 3),
+            "recorded_at": datetime.now().isoformat(),
+        })
+
+
+class ReplayTransport:
+    """
+    Serve recorded responses offline.
+
+    Requests are matched on their normalized key; repeated requests cycle
+    through every recording of that key. Unmatched requests fall back to
+    cycling through all recordings unless strict is set.
+    """
+
+    def __init__(self, records: List[Dict], simulate_latency: bool = False,
+                 latency_scale: float = 1.0, strict: bool = False):
+        if not records:
+            raise ValueError("Replay cassette contains no recordings")
+        self.records = records
+        self.simulate_latency = simulate_latency
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._by_key = defaultdict(list)
+        for record in records:
+            self._by_key[record["key"]].append(record)
+        self._positions = defaultdict(int)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_file(cls, cassette_path: str, **kwargs) -> "ReplayTransport":
+        with open(cassette_path, "r", encoding="utf-8") as f:
+            records = [json.loads(line) for line in f if line.strip()]
+        return cls(records, **kwargs)
+
+    def _next_record(self, request: Dict) -> Dict:
+        key = request_key(request)
+        candidates = self._by_key.get(key)
+        if not candidates:
+            if self.strict:
+                raise CassetteMissError(f"No recorded Bedrock response for request {key[:12]}")
+            key, candidates = "*", self.records
+        with self._lock:
+            position = self._positions[key]
+            self._positions[key] = position + 1
+        return candidates[position % len(candidates)]
+
+    def _sleep(self, milliseconds: float):
+        if self.simulate_latency and milliseconds > 0:
+            time.sleep(milliseconds * self.latency_scale / 1000)
+
+    def converse(self, **request) -> Dict:
+        record = self._next_record(request)
+        self._sleep(record.get("latency_ms", 0))
+        if record["operation"] == "converse":
+            return copy.deepcopy(record["response"])
+        return response_from_events([e["event"] for e in record["events"]])
+
+    def converse_stream(self, **request) -> Iterator[Dict]:
+        record = self._next_record(request)
+        if record["operation"] == "converse_stream":
+            timed_events = record["events"]
+        else:
+            timed_events = events_from_response(record["response"], record.get("latency_ms", 0))
+
+        elapsed_ms = 0.0
+        for timed in timed_events:
+            self._sleep(timed["offset_ms"] - elapsed_ms)
+            elapsed_ms = timed["offset_ms"]
+            yield copy.deepcopy(timed["event"])
+
+
+def events_from_response(response: Dict, latency_ms: float) -> List[Dict]:
+    """Split a recorded converse response into evenly paced stream events"""
+    text = response_text(response)
+    tokens = [word + " " for word in text.split(" ")]
+    tokens[-1] = tokens[-1][:-1]
+    step = latency_ms / max(len(tokens), 1)
+
+    events = [{"offset_ms": 0.0, "event": {"messageStart": {"role": "assistant"}}}]
+    for i, token in enumerate(tokens, start=1):
+        events.append({"offset_ms": step * i,
+                       "event": {"contentBlockDelta": {"delta": {"text": token}, "contentBlockIndex": 0}}})
+    events.append({"offset_ms": latency_ms, "event": {"contentBlockStop": {"contentBlockIndex": 0}}})
+    events.append({"offset_ms": latency_ms,
+                   "event": {"messageStop": {"stopReason": response.get("stopReason", "end_turn")}}})
+    events.append({"offset_ms": latency_ms, "event": {"metadata": {
+        "usage": response.get("usage", {}),
+        "metrics": response.get("metrics", {"latencyMs": latency_ms}),
+    }}})
+    return events
+
+
+def response_from_events(events: List[Dict]) -> Dict:
+    """Assemble a converse-shaped response from stream events"""
+    text = ""
+    response = {"stopReason": "end_turn", "usage": {}, "metrics": {}}
+    for event in events:
+        if "contentBlockDelta" in event:
+            text += event["contentBlockDelta"]["delta"].get("text", "")
+        elif "messageStop" in event:
+            response["stopReason"] = event["messageStop"].get("stopReason", "end_turn")
+        elif "metadata" in event:
+            response["usage"] = event["metadata"].get("usage", {})
+            response["metrics"] = event["metadata"].get("metrics", {})
+    response["output"] = {"message": {"role": "assistant", "content": [{"text": text}]}}
+    return response
+
+
+def create_transport(client, mode: Optional[str] = None, cassette_path: Optional[str] = None, live=None):
+    """Build the transport selected by BEDROCK_TRANSPORT; live stands in for the client (e.g. a RegionRouter)"""
+    mode = (mode or BEDROCK_TRANSPORT).lower()
+    cassette_path = cassette_path or BEDROCK_CASSETTE
+    live = live or LiveTransport(client)
+
+    if mode == "live":
+        return live
+    if mode == "record":
+        print(f"Recording Bedrock traffic to {cassette_path}")
+        return RecordingTransport(live, cassette_path)
+    if mode == "replay":
+        print(f"Replaying Bedrock traffic from {cassette_path}")
+        return ReplayTransport.from_file(
+            cassette_path,
+            simulate_latency=BEDROCK_REPLAY_LATENCY,
+            latency_scale=BEDROCK_REPLAY_LATENCY_SCALE,
+            strict=BEDROCK_REPLAY_STRICT,
+        )
+    raise ValueError(f"Unknown BEDROCK_TRANSPORT: {mode}")
@@ -0,0 +1,9 @@
+"""
+Offline microbenchmarks for the per-request hot paths.
+
+Run from the backend directory:
+
+    python -m benchmarks run --save benchmarks/baselines/baseline.json
+    python -m benchmarks run --compare benchmarks/baselines/baseline.json
+    python -m benchmarks compare baseline.json current.json --threshold 10
+"""
@@ -0,0 +1,61 @@
+import argparse
+import importlib
+import os
+import sys
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Benchmark modules registered with the harness
+BENCHMARK_MODULES = [
+    "benchmarks.bench_hot_paths",
+    "benchmarks.bench_storage_format",
+    "benchmarks.bench_json",
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Hot path microbenchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    run_parser = subparsers.add_parser("run", help="Run benchmarks")
+    run_parser.add_argument("-k", "--filter", help="Only run benchmarks matching this glob, e.g. 'load_*'")
+    run_parser.add_argument("--save", help="Write results as a JSON baseline to this path")
+    run_parser.add_argument("--compare", help="Compare results against this JSON baseline")
+    run_parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    run_parser.add_argument("--min-rounds", type=int, default=5)
+    run_parser.add_argument("--max-time", type=float, default=1.0, help="Seconds to spend per benchmark")
+
+    compare_parser = subparsers.add_parser("compare", help="Compare two saved results")
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("current")
+    compare_parser.add_argument("--threshold", type=float, default=10.0, help="Regression threshold in percent")
+    compare_parser.add_argument("--metric", default="median", choices=["min", "mean", "median"])
+
+    args = parser.parse_args()
+
+    # The app reads its knowledge files relative to the backend directory
+    os.chdir(BACKEND_DIR)
+    sys.path.insert(0, BACKEND_DIR)
+    from benchmarks import harness
+
+    if args.command == "compare":
+        rows = harness.compare_reports(harness.load_report(args.baseline), harness.load_report(args.current),
+                                       args.threshold, args.metric)
+        sys.exit(1 if harness.print_comparison(rows, args.threshold) else 0)
+
+    for module in BENCHMARK_MODULES:
+        importlib.import_module(module)
+
+    report = harness.run_benchmarks(args.filter, args.min_rounds, args.max_time)
+    if args.save:
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        harness.save_report(report, args.save)
+        print(f"✓ Saved results to {args.save}")
+    if args.compare:
+        print()
+        rows = harness.compare_reports(harness.load_report(args.compare), report, args.threshold)
+        sys.exit(1 if harness.print_comparison(rows, args.threshold) else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+import sys
+
+from starlette.responses import JSONResponse
+
+import json_codec
+from conversation_codec import encode_compact, decode_compact
+from json_codec import FastJSONResponse
+
+from benchmarks.harness import benchmark
+from benchmarks.bench_hot_paths import make_conversation
+
+# stdlib json is the "before"
+BACKENDS = ["json", "orjson"]
+if not json_codec.HAVE_ORJSON:
+    # Rather than report stdlib numbers under the orjson label
+    BACKENDS.remove("orjson")
+    print("orjson isn't installed; skipping the orjson JSON benchmarks", file=sys.stderr)
+SIZES = [100, 1000, 10000]
+CASES = [f"{backend}-{size}" for size in SIZES for backend in BACKENDS]
+
+
+def select(case: str):
+    backend, size = case.rsplit("-", 1)
+    return json_codec.use_backend(backend), int(size)
+
+
+@benchmark("conversation_response", params=[f"starlette-{size}" for size in SIZES] + CASES)
+def bench_conversation_response(case):
+    """Render a /conversation page body with FastAPI's default class or the app's"""
+    if case.startswith("starlette-"):
+        backend, response_class = "starlette", JSONResponse
+        size = int(case.rsplit("-", 1)[1])
+    else:
+        (backend, size), response_class = select(case), FastJSONResponse
+    page = {"session_id": "bench", "messages": make_conversation(size), "has_more": False, "next_cursor": None}
+    run = lambda: response_class(page)
+    run.extra_info = {"backend": backend}
+    return run
+
+
+@benchmark("conversation_json_roundtrip", params=CASES)
+def bench_conversation_roundtrip(case):
+    """Uncompressed compact encode + decode, i.e. the JSON share of a save and a load"""
+    backend, size = select(case)
+    messages = make_conversation(size)
+    run = lambda: decode_compact(encode_compact(messages, "none"))
+    run.extra_info = {"backend": backend}
+    return run
+
+
+@benchmark("log_entry", params=BACKENDS)
+def bench_log_entry(requested):
+    backend = json_codec.use_backend(requested)
+    entry = {
+        "timestamp": "2025-01-01T12:00:00.000000", "name": "Ada", "email": "ada@example.com",
+        "ip": "203.0.113.7", "captcha_score": 0.9, "status": "sent", "user_agent": "Mozilla/5.0",
+    }
+    run = lambda: json_codec.dumps_str(entry)
+    run.extra_info = {"backend": backend}
+    return run
@@ -0,0 +1,41 @@
+import sys
+
+import conversation_codec
+from conversation_codec import encode_compact, encode_legacy, decode_conversation
+
+from benchmarks.harness import benchmark
+from benchmarks.bench_hot_paths import make_conversation
+
+# legacy, or compact with the given compression, at several session sizes
+FORMATS = ["legacy", "compact-none", "compact-gzip", "compact-zstd"]
+if conversation_codec.zstandard is None:
+    # Rather than report gzip numbers under the zstd label
+    FORMATS.remove("compact-zstd")
+    print("zstandard isn't installed; skipping the compact-zstd storage format benchmarks", file=sys.stderr)
+CASES = [f"{fmt}-{size}" for size in (10, 1000, 10000) for fmt in FORMATS]
+
+
+def encoder(case: str):
+    fmt, size = case.rsplit("-", 1)
+    if fmt == "legacy":
+        return encode_legacy, int(size)
+    compression = fmt.split("-", 1)[1]
+    return (lambda messages: encode_compact(messages, compression)), int(size)
+
+
+@benchmark("encode_conversation", params=CASES)
+def bench_encode(case):
+    encode, size = encoder(case)
+    messages = make_conversation(size)
+    run = lambda: encode(messages)
+    run.extra_info = {"bytes": len(encode(messages))}
+    return run
+
+
+@benchmark("decode_conversation", params=CASES)
+def bench_decode(case):
+    encode, size = encoder(case)
+    data = encode(make_conversation(size))
+    run = lambda: decode_conversation(data)
+    run.extra_info = {"bytes": len(data)}
+    return run
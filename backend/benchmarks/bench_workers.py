@@ -0,0 +1,135 @@
+"""
+Throughput of the pre-fork server as the worker count grows.
+
+    python -m benchmarks.bench_workers --workers 1 2 4 --duration 10
+
+Each run starts serve.py against a replayed Bedrock cassette (so no AWS
+access is needed) and drives /chat from a pool of client threads.
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def write_cassette(path: str, latency_ms: float):
+    record = {
+        "operation": "converse",
+        "key": "*",
+        "response": {
+            "output": {"message": {"role": "assistant", "content": [{"text": "I build AI products on AWS."}]}},
+            "usage": {"inputTokens": 2100, "outputTokens": 8, "totalTokens": 2108},
+            "stopReason": "end_turn",
+        },
+        "latency_ms": latency_ms,
+    }
+    with open(path, "w") as f:
+        f.write(json.dumps(record) + "\n")
+
+
+def wait_until_ready(url: str, timeout: float = 30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if requests.get(f"{url}/health", timeout=1).ok:
+                return
+        except requests.exceptions.ConnectionError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"Server at {url} did not become ready")
+
+
+def drive(url: str, clients: int, duration: float) -> dict:
+    """Send /chat requests from several threads for duration seconds"""
+    completed = []
+    errors = []
+    stop_at = time.monotonic() + duration
+
+    def client():
+        session = requests.Session()
+        done = failed = 0
+        while time.monotonic() < stop_at:
+            try:
+                response = session.post(f"{url}/chat", json={"message": "What do you do?"}, timeout=30)
+                if response.ok:
+                    done += 1
+                else:
+                    failed += 1
+            except requests.exceptions.RequestException:
+                failed += 1
+        completed.append(done)
+        errors.append(failed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return {"requests": sum(completed), "errors": sum(errors), "rps": sum(completed) / duration}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure /chat throughput per worker count")
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--clients", type=int, default=32, help="Concurrent client threads")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds per run")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Simulated Bedrock latency")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="twin-bench-workers-")
+    cassette = os.path.join(workdir, "bedrock.jsonl")
+    write_cassette(cassette, args.latency_ms)
+    env = dict(
+        os.environ,
+        BEDROCK_TRANSPORT="replay",
+        BEDROCK_CASSETTE=cassette,
+        BEDROCK_REPLAY_LATENCY="true" if args.latency_ms else "false",
+        USE_S3="false",
+        MEMORY_DIR=os.path.join(workdir, "memory"),
+        # Every client shares 127.0.0.1, and load shedding would turn the overload into errors;
+        # neither limit is what's being measured
+        TOKEN_BUDGET_PER_IP="0",
+        CHAT_MAX_IN_FLIGHT=str(args.clients),
+        CHAT_MAX_QUEUE=str(args.clients),
+    )
+    url = f"http://127.0.0.1:{args.port}"
+
+    print(f"{os.cpu_count()} CPUs, {args.clients} clients, {args.duration:.0f}s per run\n")
+    baseline = None
+    failed_runs = 0
+    for workers in args.workers:
+        process = subprocess.Popen(
+            [sys.executable, "serve.py", "--workers", str(workers), "--host", "127.0.0.1", "--port", str(args.port)],
+            cwd=BACKEND_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_until_ready(url)
+            result = drive(url, args.clients, args.duration)
+        finally:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+
+        if result["errors"]:
+            # Failed requests finish fast and skew the rate, so there's no fair ratio to show
+            failed_runs += 1
+            print(f"workers {workers:>2}: {result['rps']:8.1f} req/s  (no ratio)  {result['errors']} errors")
+            continue
+        baseline = baseline or result["rps"]
+        print(f"workers {workers:>2}: {result['rps']:8.1f} req/s  (x{result['rps'] / baseline:.2f})  0 errors")
+
+    if failed_runs:
+        sys.exit(f"\n{failed_runs} run(s) had failed requests; their throughput isn't comparable")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import json
+import platform
+import statistics
+import sys
+import time
+from datetime import datetime
+from fnmatch import fnmatch
+from typing import Callable, Dict, List, Optional
+
+# Registry of benchmark factories: name -> (factory, params)
+BENCHMARKS: Dict[str, tuple] = {}
+
+
+def benchmark(name: str, params: Optional[List] = None):
+    """
+    Register a benchmark factory.
+
+    The decorated function does its setup and returns a zero-argument
+    callable that is timed. With params, the factory receives each param
+    and is registered as name[param]. An extra_info dict set on the
+    callable is reported alongside its timings.
+    """
+    def decorator(factory: Callable):
+        BENCHMARKS[name] = (factory, params)
+        return factory
+    return decorator
+
+
+def _calibrate(fn: Callable, min_round_time: float) -> int:
+    """Find how many calls are needed for one round to take min_round_time"""
+    iterations = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_round_time or iterations >= 1_000_000:
+            return iterations
+        iterations *= 10 if elapsed < min_round_time / 10 else 2
+
+
+def measure(fn: Callable, min_rounds: int = 5, max_time: float = 1.0,
+            min_round_time: float = 0.0005) -> Dict:
+    """Time fn over several rounds and return per-call statistics in seconds"""
+    iterations = _calibrate(fn, min_round_time)
+    timings = []
+    deadline = time.perf_counter() + max_time
+    while len(timings) < min_rounds or time.perf_counter() < deadline:
+        start = time.perf_counter()
+        for _ in range(iterations):
+            fn()
+        timings.append((time.perf_counter() - start) / iterations)
+        if len(timings) >= 10_000:
+            break
+
+    return {
+        "min": min(timings),
+        "max": max(timings),
+        "mean": statistics.fmean(timings),
+        "median": statistics.median(timings),
+        "stddev": statistics.stdev(timings) if len(timings) > 1 else 0.0,
+        "rounds": len(timings),
+        "iterations": iterations,
+    }
+
+
+def expand_benchmarks(pattern: Optional[str] = None):
+    """Yield (full_name, factory, param) for every registered benchmark"""
+    for name, (factory, params) in BENCHMARKS.items():
+        for param in params if params is not None else [None]:
+            full_name = name if param is None else f"{name}[{param}]"
+            if pattern and not fnmatch(full_name, pattern):
+                continue
+            yield full_name, factory, param
+
+
+def run_benchmarks(pattern: Optional[str] = None, min_rounds: int = 5, max_time: float = 1.0) -> Dict:
+    """Run the registered benchmarks and return a pytest-benchmark style report"""
+    results = []
+    for full_name, factory, param in expand_benchmarks(pattern):
+        fn = factory() if param is None else factory(param)
+        stats = measure(fn, min_rounds=min_rounds, max_time=max_time)
+        extra_info = getattr(fn, "extra_info", {})
+        print(f"{full_name:<48} median {format_time(stats['median']):>10}  "
+              f"mean {format_time(stats['mean']):>10}  rounds {stats['rounds']}"
+              + "".join(f"  {k} {v}" for k, v in extra_info.items()))
+        results.append({"name": full_name, "stats": stats, "extra_info": extra_info})
+
+    return {
+        "machine_info": {
+            "python_version": platform.python_version(),
+            "python_implementation": platform.python_implementation(),
+            "machine": platform.machine(),
+            "system": platform.system(),
+        },
+        "datetime": datetime.now().isoformat(),
+        "benchmarks": results,
+    }
+
+
+def format_time(seconds: float) -> str:
+    """Format a duration with a readable unit"""
+    if seconds >= 1:
+        return f"{seconds:.3f}s"
+    if seconds >= 1e-3:
+        return f"{seconds * 1e3:.3f}ms"
+    if seconds >= 1e-6:
+        return f"{seconds * 1e6:.3f}us"
+    return f"{seconds * 1e9:.1f}ns"
+
+
+def save_report(report: Dict, path: str):
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+
+
+def load_report(path: str) -> Dict:
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def compare_reports(baseline: Dict, current: Dict, threshold: float = 10.0,
+                    metric: str = "median") -> List[Dict]:
+    """
+    Compare two reports benchmark by benchmark.
+
+    A benchmark regresses when its metric is more than threshold percent
+    slower than in the baseline.
+    """
+    base_stats = {b["name"]: b["stats"] for b in baseline["benchmarks"]}
+    rows = []
+    for bench in current["benchmarks"]:
+        base = base_stats.get(bench["name"])
+        if base is None:
+            rows.append({"name": bench["name"], "baseline": None, "current": bench["stats"][metric],
+                         "change_pct": None, "regression": False})
+            continue
+        change = (bench["stats"][metric] - base[metric]) / base[metric] * 100 if base[metric] else 0.0
+        rows.append({
+            "name": bench["name"],
+            "baseline": base[metric],
+            "current": bench["stats"][metric],
+            "change_pct": change,
+            "regression": change > threshold,
+        })
+    return rows
+
+
+def print_comparison(rows: List[Dict], threshold: float) -> int:
+    """Print a comparison table and return the number of regressions"""
+    regressions = 0
+    for row in rows:
+        if row["baseline"] is None:
+            print(f"{row['name']:<48} {'(new)':>10} {format_time(row['current']):>10}")
+            continue
+        flag = "REGRESSION" if row["regression"] else ""
+        regressions += row["regression"]
+        print(f"{row['name']:<48} {format_time(row['baseline']):>10} {format_time(row['current']):>10} "
+              f"{row['change_pct']:>+8.1f}% {flag}")
+    print(f"\n{regressions} regression(s) beyond {threshold:.1f}%", file=sys.stderr if regressions else sys.stdout)
+    return regressions
@@ -0,0 +1,191 @@
+"""
+Circuit breakers for the services a request waits on (Bedrock, Brevo, reCAPTCHA).
+
+A breaker keeps the outcomes of calls made in the last
+CIRCUIT_WINDOW_SECONDS. Once at least CIRCUIT_MINIMUM_CALLS have been seen
+and the share of failures reaches CIRCUIT_FAILURE_RATE it opens, and calls
+fail immediately with CircuitOpen instead of waiting on a service that is
+down. After CIRCUIT_OPEN_SECONDS it lets CIRCUIT_HALF_OPEN_CALLS trial
+calls through: if they all succeed it closes again, if one fails it
+re-opens for another CIRCUIT_OPEN_SECONDS.
+
+State is per process, like the rest of the in-memory state here, so each
+worker or Lambda container trips on what it has seen itself.
+"""
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Callable, Dict, Optional
+
+from lifecycle import register_after_fork
+
+CIRCUIT_FAILURE_RATE = float(os.getenv("CIRCUIT_FAILURE_RATE", "0.5"))
+CIRCUIT_MINIMUM_CALLS = int(os.getenv("CIRCUIT_MINIMUM_CALLS", "5"))
+CIRCUIT_WINDOW_SECONDS = float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60"))
+CIRCUIT_OPEN_SECONDS = float(os.getenv("CIRCUIT_OPEN_SECONDS", "30"))
+CIRCUIT_HALF_OPEN_CALLS = int(os.getenv("CIRCUIT_HALF_OPEN_CALLS", "1"))
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpen(Exception):
+    """Raised instead of calling a service whose breaker is open"""
+
+    def __init__(self, name: str, retry_after: float):
+        super().__init__(f"{name} is unavailable; retry in {retry_after:.0f}s")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Error-rate breaker with a rolling time window and half-open trial calls"""
+
+    def __init__(self, name: str, failure_rate: float = CIRCUIT_FAILURE_RATE,
+                 minimum_calls: int = CIRCUIT_MINIMUM_CALLS, window_seconds: float = CIRCUIT_WINDOW_SECONDS,
+                 open_seconds: float = CIRCUIT_OPEN_SECONDS, half_open_calls: int = CIRCUIT_HALF_OPEN_CALLS):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.minimum_calls = minimum_calls
+        self.window_seconds = window_seconds
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        # (monotonic time, failed) per call in the window
+        self._outcomes: deque = deque()
+        self._state = CLOSED
+        self._opened_at = 0.0
+        self._trials = 0
+        self._trial_successes = 0
+        self.times_opened = 0
+
+    def _prune(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.window_seconds:
+            self._outcomes.popleft()
+
+    def _current_state(self, now: float) -> str:
+        if self._state == OPEN and now - self._opened_at >= self.open_seconds:
+            self._state, self._trials, self._trial_successes = HALF_OPEN, 0, 0
+        return self._state
+
+    def _open(self, now: float):
+        self._state, self._opened_at = OPEN, now
+        self._outcomes.clear()
+        self.times_opened += 1
+        print(f"Circuit {self.name} opened for {self.open_seconds:.0f}s")
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._current_state(time.monotonic())
+
+    def is_open(self) -> bool:
+        """True while calls would be rejected; unlike allow() this never takes a trial slot"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            return state == OPEN or (state == HALF_OPEN and self._trials >= self.half_open_calls)
+
+    def retry_after(self) -> float:
+        with self._lock:
+            return max(0.0, self._opened_at + self.open_seconds - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go ahead; in half-open state this claims one of the trial calls"""
+        with self._lock:
+            state = self._current_state(time.monotonic())
+            if state == CLOSED:
+                return True
+            if state == HALF_OPEN and self._trials < self.half_open_calls:
+                self._trials += 1
+                return True
+            return False
+
+    def record(self, failed: bool):
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            if state == HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._trial_successes += 1
+                    if self._trial_successes >= self.half_open_calls:
+                        self._state = CLOSED
+                        print(f"Circuit {self.name} closed")
+                return
+            if state == OPEN:
+                # A call admitted before the breaker opened; its outcome is stale
+                return
+
+            self._outcomes.append((now, failed))
+            self._prune(now)
+            if failed and len(self._outcomes) >= self.minimum_calls:
+                failures = sum(1 for _, f in self._outcomes if f)
+                if failures / len(self._outcomes) >= self.failure_rate:
+                    self._open(now)
+
+    @contextmanager
+    def guard(self, is_failure: Optional[Callable[[BaseException], bool]] = None):
+        """
+        Run the block under the breaker: raises CircuitOpen if it is open,
+        otherwise records whether the block raised. is_failure decides which
+        exceptions count against the service (default: all of them).
+        """
+        if not self.allow():
+            raise CircuitOpen(self.name, self.retry_after())
+        try:
+            yield
+        except BaseException as e:
+            self.record(is_failure(e) if is_failure else True)
+            raise
+        self.record(False)
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            now = time.monotonic()
+            state = self._current_state(now)
+            self._prune(now)
+            snapshot = {
+                "state": state,
+                "calls": len(self._outcomes),
+                "failures": sum(1 for _, f in self._outcomes if f),
+                "times_opened": self.times_opened,
+            }
+            if state == OPEN:
+                snapshot["retry_after"] = round(self._opened_at + self.open_seconds - now, 1)
+            return snapshot
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def breaker(name: str, **settings) -> CircuitBreaker:
+    """The process-wide breaker for a service, created with the env defaults on first use"""
+    with _breakers_lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **settings)
+        return _breakers[name]
+
+
+def states() -> Dict[str, Dict]:
+    """Snapshot of every breaker, for /health"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {b.name: b.snapshot() for b in breakers}
+
+
+def _reset_after_fork():
+    # Workers judge the services from their own calls
+    for b in _breakers.values():
+        b._lock = threading.Lock()
+        b.reset()
+
+
+register_after_fork(_reset_after_fork)
@@ -1,13 +1,20 @@
 from resources import linkedin, summary, facts, style
 from datetime import datetime
+from typing import Dict, Tuple
 
 
 full_name = facts["full_name"]
 name = facts["name"]
 
 
-def prompt():
-    return f"""
+def compile_prompt(knowledge: Dict) -> Tuple[str, str]:
+    """Render everything in the prompt except the timestamp: (text before it, text after it)"""
+    facts, summary, linkedin, style = (knowledge["facts"], knowledge["summary"],
+                                       knowledge["linkedin"], knowledge["style"])
+    full_name = facts["full_name"]
+    name = facts["name"]
+
+    head = f"""
 # Your Role
 
 You are an AI Agent that is acting as a digital twin of {full_name}, who goes by {name}.
@@ -31,7 +38,9 @@ Here are some notes from {name} about their communications style:
 
 
 For reference, here is the current date and time:
-{datetime.now().strftime("%Y-%m-%d %H:%M:%S")}
+"""
+
+    tail = f"""
 
 ## Your task
 
@@ -55,4 +64,16 @@ There are 3 critical rules that you must follow:
 
 Please engage with the user.
 Avoid responding in a way that feels like a chatbot or AI assistant, and don't end every message with a question; channel a smart conversation with an engaging person, a true reflection of {name}.
-"""
\ No newline at end of file
+"""
+    return head, tail
+
+
+# Everything except the timestamp is rendered once at import, so the prompt is
+# built before any server workers fork and shared between them.
+_PROMPT_HEAD, _PROMPT_TAIL = compile_prompt(
+    {"facts": facts, "summary": summary, "linkedin": linkedin, "style": style}
+)
+
+
+def prompt():
+    return f"{_PROMPT_HEAD}{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{_PROMPT_TAIL}"
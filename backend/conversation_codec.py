@@ -0,0 +1,174 @@
+"""
+At-rest encoding for stored conversations.
+
+Legacy objects are the indented JSON list written by earlier releases.
+Compact objects start with a 5-byte header:
+
+    b"TWC" | format version | compression (0 none, 1 gzip, 2 zstd)
+
+followed by minified JSON of the form {"m": [[role, timestamp, content], ...]}
+where role is a small integer code and timestamp is the stored string as-is.
+Rows with other keys carry them in a fourth element, flagged by "x": 1.
+Version 1 stored timestamps as integer microseconds since 1970-01-01, but
+formatting them back per message made decoding slower than legacy JSON;
+version 1 objects are still read. Values that don't fit the compact shape are
+kept verbatim, so decoding always returns the original messages.
+"""
+import gzip
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import json_codec
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+CONVERSATION_FORMAT = os.getenv("CONVERSATION_FORMAT", "compact").lower()
+# gzip shrinks objects several times over but decodes a little slower than legacy
+# JSON; uncompressed compact objects are ~35% smaller and decode faster. gzip or
+# zstd are worth it where S3 storage matters more than load latency
+CONVERSATION_COMPRESSION = os.getenv("CONVERSATION_COMPRESSION", "none").lower()
+# Payloads smaller than this are stored uncompressed
+COMPRESS_MIN_PAYLOAD = int(os.getenv("CONVERSATION_COMPRESS_MIN_BYTES", "512"))
+
+MAGIC = b"TWC"
+FORMAT_VERSION = 2
+COMPRESSION_CODES = {"none": 0, "gzip": 1, "zstd": 2}
+COMPRESSION_NAMES = {code: name for name, code in COMPRESSION_CODES.items()}
+
+ROLE_CODES = {"user": 0, "assistant": 1, "system": 2}
+ROLE_NAMES = {code: role for role, code in ROLE_CODES.items()}
+
+LEGACY_CONTENT_TYPE = "application/json"
+COMPACT_CONTENT_TYPE = "application/x-twin-conversation"
+
+_EPOCH = datetime(1970, 1, 1)
+
+
+class ConversationFormatError(ValueError):
+    """Raised when stored bytes are neither legacy JSON nor a known compact version"""
+
+
+# Minute number -> "YYYY-MM-DDTHH:MM:" prefix, for version 1 timestamps
+_MINUTE_PREFIXES: Dict[int, str] = {}
+_MINUTE_PREFIX_CACHE_SIZE = 4096
+_MICROS_PER_MINUTE = 60_000_000
+
+
+def _decode_timestamp(value):
+    """Format version 1 integer microseconds exactly like datetime.isoformat() would"""
+    if not isinstance(value, int):
+        return value
+    minute, micros = divmod(value, _MICROS_PER_MINUTE)
+    prefix = _MINUTE_PREFIXES.get(minute)
+    if prefix is None:
+        if len(_MINUTE_PREFIXES) >= _MINUTE_PREFIX_CACHE_SIZE:
+            _MINUTE_PREFIXES.clear()
+        prefix = (_EPOCH + timedelta(minutes=minute)).isoformat()[:17]
+        _MINUTE_PREFIXES[minute] = prefix
+    seconds, micros = divmod(micros, 1_000_000)
+    if micros:
+        return f"{prefix}{seconds:02d}.{micros:06d}"
+    return f"{prefix}{seconds:02d}"
+
+
+def _compress(payload: bytes, compression: str) -> Tuple[bytes, int]:
+    if compression == "none" or len(payload) < COMPRESS_MIN_PAYLOAD:
+        return payload, COMPRESSION_CODES["none"]
+    if compression == "zstd":
+        if zstandard is not None:
+            return zstandard.ZstdCompressor(level=3).compress(payload), COMPRESSION_CODES["zstd"]
+        print("zstandard not installed, falling back to gzip")
+        compression = "gzip"
+    if compression == "gzip":
+        return gzip.compress(payload, compresslevel=5), COMPRESSION_CODES["gzip"]
+    raise ValueError(f"Unknown conversation compression: {compression}")
+
+
+def _decompress(payload: bytes, code: int) -> bytes:
+    name = COMPRESSION_NAMES.get(code)
+    if name == "none":
+        return payload
+    if name == "gzip":
+        return gzip.decompress(payload)
+    if name == "zstd":
+        if zstandard is None:
+            raise ConversationFormatError("Conversation is zstd-compressed but zstandard is not installed")
+        return zstandard.ZstdDecompressor().decompress(payload)
+    raise ConversationFormatError(f"Unknown compression code: {code}")
+
+
+def encode_compact(messages: List[Dict], compression: str = None) -> bytes:
+    """Encode messages in the compact at-rest format"""
+    rows = []
+    has_extra = False
+    for msg in messages:
+        role = msg.get("role")
+        row = [ROLE_CODES.get(role, role), msg.get("timestamp"), msg.get("content")]
+        extra = {k: v for k, v in msg.items() if k not in ("role", "timestamp", "content")}
+        if extra:
+            row.append(extra)
+            has_extra = True
+        rows.append(row)
+
+    # "x" marks that some rows carry extra keys, so decoding can skip looking for them
+    payload = json_codec.dumps({"m": rows, "x": 1} if has_extra else {"m": rows})
+    body, code = _compress(payload, compression or CONVERSATION_COMPRESSION)
+    return MAGIC + bytes([FORMAT_VERSION, code]) + body
+
+
+def decode_compact(data: bytes) -> List[Dict]:
+    """Decode bytes written by encode_compact"""
+    version, code = data[3], data[4]
+    if version not in (1, FORMAT_VERSION):
+        raise ConversationFormatError(f"Unsupported conversation format version: {version}")
+
+    body = json_codec.loads(_decompress(data[5:], code))
+    rows = body["m"]
+    roles = ROLE_NAMES
+    if version == 1:
+        messages = [
+            {"role": roles.get(row[0], row[0]), "content": row[2], "timestamp": _decode_timestamp(row[1])}
+            for row in rows
+        ]
+    else:
+        messages = [{"role": roles.get(row[0], row[0]), "content": row[2], "timestamp": row[1]} for row in rows]
+    if version == 1 or body.get("x"):
+        for msg, row in zip(messages, rows):
+            if len(row) > 3:
+                msg.update(row[3])
+    return messages
+
+
+def encode_legacy(messages: List[Dict]) -> bytes:
+    """Encode messages as the original indented JSON list"""
+    return json_codec.dumps(messages, indent=True)
+
+
+def is_compact(data: bytes) -> bool:
+    return data[:3] == MAGIC
+
+
+def decode_conversation(data: bytes) -> List[Dict]:
+    """Decode stored bytes in either the compact or the legacy format"""
+    if is_compact(data):
+        return decode_compact(data)
+    stripped = data.lstrip()
+    if not stripped:
+        return []
+    if stripped[:1] != b"[":
+        raise ConversationFormatError("Stored conversation is not in a recognized format")
+    return json_codec.loads(data)
+
+
+def encode_conversation(messages: List[Dict], fmt: str = None) -> Tuple[bytes, str]:
+    """Encode messages in the configured format, returning (body, content type)"""
+    fmt = fmt or CONVERSATION_FORMAT
+    if fmt == "legacy":
+        return encode_legacy(messages), LEGACY_CONTENT_TYPE
+    if fmt == "compact":
+        return encode_compact(messages), COMPACT_CONTENT_TYPE
+    raise ValueError(f"Unknown conversation format: {fmt}")
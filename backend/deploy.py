@@ -1,26 +1,44 @@
+import argparse
+import compileall
+import json
 import os
+import re
 import shutil
-import zipfile
 import subprocess
+import sys
+import zipfile
+from collections import defaultdict
+from modulefinder import ModuleFinder
 
+# Application code shipped in the function package
+APP_FILES = ["server.py", "lambda_handler.py", "context.py", "resources.py", "bedrock_transport.py",
+             "http_cache.py", "memory_store.py", "conversation_codec.py", "lifecycle.py",
+             "tracing.py", "json_codec.py", "personas.py",
+             "knowledge.py", "circuit_breaker.py", "admission.py",
+             "token_budget.py", "event_log.py", "aws_clients.py",
+             "prefilter.py", "lambda_streaming.py", "lambda_streaming_bootstrap",
+             "idempotency.py", "bedrock_regions.py"]
+APP_DIRS = ["data", "email_services"]
 
-def main():
-    print("Creating Lambda deployment package...")
+# Only needed to run the API outside Lambda; never imported by the handler at runtime
+RUNTIME_EXCLUDES = ["serve", "uvicorn", "benchmarks", "testing", "dotenv.cli", "click"]
 
-    # Clean up
-    if os.path.exists("lambda-package"):
-        shutil.rmtree("lambda-package")
-    if os.path.exists("lambda-deployment.zip"):
-        os.remove("lambda-deployment.zip")
+# Imported dynamically, so the import graph can't see them
+ALWAYS_KEEP = {"email_validator", "dns", "idna", "certifi", "pydantic_core", "annotated_types",
+               "typing_extensions", "typing_inspection"}
 
-    # Create package directory
-    os.makedirs("lambda-package")
+# botocore/boto3 service models to keep; everything else under data/ is dropped
+BOTOCORE_SERVICES = os.getenv("BOTOCORE_SERVICES", "s3,bedrock-runtime,sts,apigatewaymanagementapi,dynamodb").split(",")
 
-    # Install dependencies using Docker with Lambda runtime image
-    print("Installing dependencies for Lambda runtime...")
+# dist-info files importlib.metadata may read at runtime
+KEEP_METADATA = {"METADATA", "entry_points.txt", "top_level.txt"}
 
-    # Use the official AWS Lambda Python 3.12 image
-    # This ensures compatibility with Lambda's runtime environment
+LAMBDA_IMAGE = "public.ecr.aws/lambda/python:3.12"
+LAMBDA_PYTHON = (3, 12)
+
+
+def run_in_lambda_image(command: str):
+    """Run a shell command inside the Lambda Python image with the backend mounted at /var/task"""
     subprocess.run(
         [
             "docker",
@@ -32,41 +50,285 @@ def main():
             "linux/amd64",  # Force x86_64 architecture
             "--entrypoint",
             "",  # Override the default entrypoint
-            "public.ecr.aws/lambda/python:3.12",
+            LAMBDA_IMAGE,
             "/bin/sh",
             "-c",
-            "pip install --target /var/task/lambda-package -r /var/task/requirements.txt --platform manylinux2014_x86_64 --only-binary=:all: --upgrade",
+            command,
         ],
         check=True,
     )
 
-    # Copy application files
+
+def install_dependencies(target: str, use_docker: bool):
+    print("Installing dependencies for Lambda runtime...")
+    pip_args = f"--target {target} -r requirements.txt --platform manylinux2014_x86_64 --only-binary=:all: --upgrade"
+    if use_docker:
+        # Use the official AWS Lambda Python 3.12 image
+        # This ensures compatibility with Lambda's runtime environment
+        run_in_lambda_image(f"cd /var/task && pip install {pip_args}")
+    else:
+        subprocess.run([sys.executable, "-m", "pip", "install", *pip_args.split()], check=True)
+
+
+class ImportGraphFinder(ModuleFinder):
+    """ModuleFinder that records namespace packages instead of crashing on them"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.namespace_packages = set()
+
+    def find_module(self, name, path, parent=None):
+        try:
+            return super().find_module(name, path, parent)
+        except AttributeError:
+            # Namespace packages have no loader for ModuleFinder to inspect
+            self.namespace_packages.add(parent.__name__.split(".")[0] if parent else name)
+            raise ImportError(name)
+
+
+def reachable_modules(package_dir: str) -> set:
+    """Top-level module names reachable from the handler's import graph"""
+    finder = ImportGraphFinder(path=[os.getcwd(), package_dir], excludes=RUNTIME_EXCLUDES)
+    finder.run_script("lambda_handler.py")
+    return {name.split(".")[0] for name in finder.modules} | finder.namespace_packages
+
+
+def distribution_top_levels(package_dir: str) -> dict:
+    """Map each installed dist-info directory to the top-level names it installed"""
+    distributions = {}
+    for entry in os.listdir(package_dir):
+        if not entry.endswith(".dist-info"):
+            continue
+        names = set()
+        record = os.path.join(package_dir, entry, "RECORD")
+        if os.path.exists(record):
+            with open(record, encoding="utf-8") as f:
+                for line in f:
+                    path = line.split(",", 1)[0]
+                    top = path.split("/", 1)[0]
+                    if top.endswith(".dist-info") or top == "..":
+                        continue
+                    names.add(top[:-3] if top.endswith(".py") else top)
+        distributions[entry] = names
+    return distributions
+
+
+def remove_path(path: str):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def prune_unused_distributions(package_dir: str) -> list:
+    """Drop installed distributions the handler never imports"""
+    reachable = reachable_modules(package_dir) | ALWAYS_KEEP
+    removed = []
+    for dist_info, top_levels in distribution_top_levels(package_dir).items():
+        if not top_levels or top_levels & reachable:
+            continue
+        for name in top_levels:
+            remove_path(os.path.join(package_dir, name))
+            remove_path(os.path.join(package_dir, f"{name}.py"))
+        remove_path(os.path.join(package_dir, dist_info))
+        removed.append(dist_info.rsplit("-", 1)[0])
+    return removed
+
+
+def strip_package(package_dir: str):
+    """Remove tests, caches, type stubs, unused service models and install-only metadata"""
+    for root, dirs, files in os.walk(package_dir, topdown=True):
+        for d in list(dirs):
+            if d in ("__pycache__", "tests", "test") or (root == package_dir and d == "bin"):
+                shutil.rmtree(os.path.join(root, d))
+                dirs.remove(d)
+            elif d.endswith(".dist-info"):
+                dist_dir = os.path.join(root, d)
+                for item in os.listdir(dist_dir):
+                    if item not in KEEP_METADATA:
+                        remove_path(os.path.join(dist_dir, item))
+                dirs.remove(d)
+        for file in files:
+            if file.endswith((".pyi", ".pyc")):
+                os.remove(os.path.join(root, file))
+
+    for data_dir in (os.path.join(package_dir, "botocore", "data"), os.path.join(package_dir, "boto3", "data")):
+        if not os.path.isdir(data_dir):
+            continue
+        for service in os.listdir(data_dir):
+            if os.path.isdir(os.path.join(data_dir, service)) and service not in BOTOCORE_SERVICES:
+                shutil.rmtree(os.path.join(data_dir, service))
+
+
+def copy_application(package_dir: str):
     print("Copying application files...")
-    for file in ["server.py", "lambda_handler.py", "context.py", "resources.py"]:
+    for file in APP_FILES:
         if os.path.exists(file):
-            shutil.copy2(file, "lambda-package/")
-    
-    # Copy data directory
-    if os.path.exists("data"):
-        shutil.copytree("data", "lambda-package/data")
+            shutil.copy2(file, package_dir)
+    for directory in APP_DIRS:
+        if os.path.exists(directory):
+            shutil.copytree(directory, os.path.join(package_dir, directory),
+                            ignore=shutil.ignore_patterns("__pycache__", "*.pyc"))
 
-    # Copy email services directory
-    if os.path.exists("email_services"):
-        shutil.copytree("email_services", "lambda-package/email_services")
 
-    # Create zip
-    print("Creating zip file...")
-    with zipfile.ZipFile("lambda-deployment.zip", "w", zipfile.ZIP_DEFLATED) as zipf:
-        for root, dirs, files in os.walk("lambda-package"):
-            for file in files:
+def precompile(package_dirs: list, use_docker: bool):
+    """
+    Write .pyc files next to the sources in __pycache__.
+
+    Lambda's filesystem is read-only, so without these every cold start
+    compiles every imported module again. unchecked-hash pycs skip the
+    source timestamp check at import time.
+    """
+    print("Precompiling bytecode...")
+    if use_docker or sys.version_info[:2] != LAMBDA_PYTHON:
+        dirs = " ".join(f"/var/task/{d}" for d in package_dirs)
+        run_in_lambda_image(f"python -m compileall -q -j 0 --invalidation-mode unchecked-hash {dirs}")
+        return
+    import py_compile
+    for package_dir in package_dirs:
+        compileall.compile_dir(package_dir, quiet=1, workers=0,
+                               invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+
+
+def create_zip(source_dir: str, zip_path: str, prefix: str = ""):
+    with zipfile.ZipFile(zip_path, "w", zipfile.ZIP_DEFLATED, compresslevel=9) as zipf:
+        for root, dirs, files in os.walk(source_dir):
+            dirs.sort()
+            for file in sorted(files):
                 file_path = os.path.join(root, file)
-                arcname = os.path.relpath(file_path, "lambda-package")
+                arcname = os.path.join(prefix, os.path.relpath(file_path, source_dir))
                 zipf.write(file_path, arcname)
 
+
+def size_report(zip_paths: list) -> dict:
+    """Uncompressed and compressed bytes per top-level package across the artifacts"""
+    packages = defaultdict(lambda: {"files": 0, "bytes": 0, "compressed_bytes": 0})
+    for zip_path in zip_paths:
+        with zipfile.ZipFile(zip_path) as zipf:
+            for info in zipf.infolist():
+                parts = info.filename.split("/")
+                if parts[0] == "python" and len(parts) > 1:
+                    parts = parts[1:]
+                top = parts[0]
+                if top.endswith(".dist-info"):
+                    top = "(dist-info)"
+                elif top.endswith((".py", ".so")) and len(parts) == 1:
+                    top = top.split(".")[0]
+                entry = packages[top]
+                entry["files"] += 1
+                entry["bytes"] += info.file_size
+                entry["compressed_bytes"] += info.compress_size
+    return dict(sorted(packages.items(), key=lambda item: -item[1]["bytes"]))
+
+
+def import_time_report(package_dirs: list, use_docker: bool) -> dict:
+    """Cumulative import time per top-level module for 'import lambda_handler', in ms"""
+    python_path = ":".join(f"/var/task/{d}" for d in package_dirs)
+    command = f'cd /var/task/{package_dirs[0]} && PYTHONPATH={python_path} LAMBDA_PRIME=false python -X importtime -c "import lambda_handler" 2>&1'
+    try:
+        if use_docker:
+            output = subprocess.run(
+                ["docker", "run", "--rm", "-v", f"{os.getcwd()}:/var/task", "--platform", "linux/amd64",
+                 "--entrypoint", "", LAMBDA_IMAGE, "/bin/sh", "-c", command],
+                check=True, capture_output=True, text=True,
+            ).stdout
+        else:
+            env = dict(os.environ, PYTHONPATH=os.pathsep.join(os.path.abspath(d) for d in package_dirs),
+                       LAMBDA_PRIME="false")
+            output = subprocess.run([sys.executable, "-X", "importtime", "-c", "import lambda_handler"],
+                                    cwd=package_dirs[0], env=env, capture_output=True, text=True).stderr
+    except (subprocess.CalledProcessError, FileNotFoundError) as e:
+        print(f"⚠️  Import time measurement failed: {e}")
+        return {}
+
+    # Lines look like: "import time:  self [us] | cumulative | imported package"
+    self_times = defaultdict(int)
+    total_us = 0
+    for line in output.splitlines():
+        match = re.match(r"import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)", line)
+        if not match:
+            continue
+        self_us, name = int(match.group(1)), match.group(4)
+        self_times[name.split(".")[0]] += self_us
+        total_us += self_us
+    report = {name: round(us / 1000, 2) for name, us in sorted(self_times.items(), key=lambda item: -item[1])}
+    return {"total_ms": round(total_us / 1000, 2), "by_package_ms": report}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the Lambda deployment package")
+    parser.add_argument("--layer", action="store_true",
+                        help="Put dependencies in lambda-layer.zip and only app code in lambda-deployment.zip")
+    parser.add_argument("--no-prune", action="store_true", help="Ship every installed dependency")
+    parser.add_argument("--no-docker", action="store_true",
+                        help="Install and compile with the host Python (must match the Lambda runtime)")
+    parser.add_argument("--no-import-time", action="store_true", help="Skip the import time measurement")
+    args = parser.parse_args()
+    use_docker = not args.no_docker
+
+    print("Creating Lambda deployment package...")
+
+    # Clean up
+    for path in ("lambda-package", "lambda-layer", "lambda-deployment.zip", "lambda-layer.zip",
+                 "lambda-package-report.json"):
+        remove_path(path)
+
+    # Create package directories
+    os.makedirs("lambda-package")
+    deps_dir = "lambda-layer/python" if args.layer else "lambda-package"
+    os.makedirs(deps_dir, exist_ok=True)
+
+    install_dependencies(deps_dir, use_docker)
+    copy_application("lambda-package")
+
+    removed = []
+    if not args.no_prune:
+        print("Pruning dependencies the handler never imports...")
+        if args.layer:
+            # The import graph has to see the app and its dependencies together
+            for entry in os.listdir("lambda-package"):
+                shutil.move(os.path.join("lambda-package", entry), deps_dir)
+            removed = prune_unused_distributions(deps_dir)
+            for file in APP_FILES + APP_DIRS:
+                if os.path.exists(os.path.join(deps_dir, file)):
+                    shutil.move(os.path.join(deps_dir, file), "lambda-package")
+        else:
+            removed = prune_unused_distributions(deps_dir)
+        print(f"  Removed: {', '.join(removed) if removed else 'nothing'}")
+    strip_package(deps_dir)
+
+    package_dirs = ["lambda-package"] + (["lambda-layer/python"] if args.layer else [])
+    precompile(package_dirs, use_docker)
+
+    # Create zip
+    print("Creating zip file...")
+    create_zip("lambda-package", "lambda-deployment.zip")
+    zip_paths = ["lambda-deployment.zip"]
+    if args.layer:
+        create_zip("lambda-layer/python", "lambda-layer.zip", prefix="python")
+        zip_paths.append("lambda-layer.zip")
+
+    report = {
+        "artifacts": {path: os.path.getsize(path) for path in zip_paths},
+        "removed_distributions": removed,
+        "packages": size_report(zip_paths),
+    }
+    if not args.no_import_time:
+        report["import_time"] = import_time_report(package_dirs, use_docker)
+    with open("lambda-package-report.json", "w") as f:
+        json.dump(report, f, indent=2)
+
     # Show package size
-    size_mb = os.path.getsize("lambda-deployment.zip") / (1024 * 1024)
-    print(f"✓ Created lambda-deployment.zip ({size_mb:.2f} MB)")
+    for path in zip_paths:
+        size_mb = os.path.getsize(path) / (1024 * 1024)
+        print(f"✓ Created {path} ({size_mb:.2f} MB)")
+    print("  Largest packages (uncompressed):")
+    for name, entry in list(report["packages"].items())[:8]:
+        print(f"    {name:<24} {entry['bytes'] / 1024:>9.0f} KB")
+    if report.get("import_time"):
+        print(f"  Import time for lambda_handler: {report['import_time']['total_ms']:.0f} ms")
+    print("✓ Wrote lambda-package-report.json")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
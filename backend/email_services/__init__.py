@@ -1,5 +1,6 @@
 from .send_email import send_email_brevo
-from .secure_resume import SecureResumeRequest, verify_recaptcha, check_rate_limit, get_client_ip, send_admin_notification, send_resume_to_user, log_request, check_honeypot
+from .prevalidation import ResumePrevalidationMiddleware
+from .secure_resume import SecureResumeRequest, verify_recaptcha, check_rate_limit, get_client_ip, send_admin_notification, send_resume_to_user, log_request, check_honeypot, recaptcha_breaker, brevo_breaker
 
 __all__ = [ "send_email_brevo",
             "SecureResumeRequest",
@@ -9,5 +10,8 @@ __all__ = [ "send_email_brevo",
             "send_admin_notification",
             "send_resume_to_user",
             "log_request",
-            "check_honeypot"
+            "check_honeypot",
+            "recaptcha_breaker",
+            "brevo_breaker",
+            "ResumePrevalidationMiddleware"
 ]
\ No newline at end of file
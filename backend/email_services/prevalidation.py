@@ -0,0 +1,192 @@
+"""
+Cheap checks for the resume endpoint, run before FastAPI parses the body.
+
+Bots flooding /send-resume-request-secure used to cost a full pydantic
+validation (EmailStr included) before check_honeypot turned them away.
+ResumePrevalidationMiddleware applies the checks that need little or no
+parsing first, cheapest first, and drops a request at the first one it
+fails:
+
+    content_length  declared body larger than RESUME_MAX_BODY_BYTES (413)
+    denylist        client IP in RESUME_IP_DENYLIST, IPs or CIDRs (403)
+    headers         no User-Agent, one matching RESUME_BLOCKED_AGENTS, a
+                    non-JSON Content-Type or a foreign Origin (403/415)
+    body            body turns out larger than the limit while read (413)
+    parse           not a JSON object (400)
+    honeypot        honeypot fields filled, no JS, form filled too fast
+                    or too slowly (403, logged with log_bot_attempt)
+
+Requests that pass are handed on with their body replayed, and still get
+the endpoint's full validation. stats() counts rejections per stage.
+"""
+import ipaddress
+import os
+import re
+import threading
+from typing import Dict, Iterable, Optional
+
+import json_codec
+from lifecycle import register_after_fork
+
+from .secure_resume import HONEYPOT_FIELDS, MAX_FORM_TIME, MIN_FORM_TIME, client_ip_from_scope, log_bot_attempt
+
+RESUME_PATH = "/send-resume-request-secure"
+RESUME_MAX_BODY_BYTES = int(os.getenv("RESUME_MAX_BODY_BYTES", "8192"))
+RESUME_IP_DENYLIST = os.getenv("RESUME_IP_DENYLIST", "")
+RESUME_BLOCKED_AGENTS = os.getenv(
+    "RESUME_BLOCKED_AGENTS",
+    r"curl/|wget/|python-requests|python-urllib|aiohttp|httpx|go-http-client|java/|libwww-perl|scrapy|headlesschrome"
+)
+
+STAGES = ("content_length", "denylist", "headers", "body", "parse", "honeypot")
+
+# Same wording as the endpoint, so a rejection doesn't reveal which check fired
+GENERIC_DETAIL = "Request validation failed. Please try again."
+
+
+_stats_lock = threading.Lock()
+_stats: Dict = {}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(checked=0, passed=0, rejected=dict.fromkeys(STAGES, 0))
+
+
+def stats() -> Dict:
+    """Requests checked, passed on and rejected per stage in this process, for /metrics"""
+    with _stats_lock:
+        return {"checked": _stats["checked"], "passed": _stats["passed"], "rejected": dict(_stats["rejected"])}
+
+
+reset_stats()
+register_after_fork(reset_stats)
+
+
+class Rejected(Exception):
+    """A request dropped by one of the pipeline stages"""
+
+    def __init__(self, stage: str, status: int, detail: str = GENERIC_DETAIL):
+        self.stage = stage
+        self.status = status
+        self.detail = detail
+
+
+def parse_networks(value: str):
+    return [ipaddress.ip_network(item.strip(), strict=False) for item in value.split(",") if item.strip()]
+
+
+class ResumePrevalidationMiddleware:
+    """ASGI middleware running the ordered pre-validation pipeline for the resume endpoint"""
+
+    def __init__(self, app, allowed_origins: Iterable[str] = (), max_body_bytes: int = RESUME_MAX_BODY_BYTES,
+                 denylist: str = RESUME_IP_DENYLIST, blocked_agents: str = RESUME_BLOCKED_AGENTS):
+        self.app = app
+        self.allowed_origins = set(allowed_origins)
+        self.max_body_bytes = max_body_bytes
+        self.denylist = parse_networks(denylist)
+        self.blocked_agents = re.compile(blocked_agents, re.IGNORECASE) if blocked_agents else None
+
+    def _check_headers(self, headers: Dict[bytes, bytes], client_ip: Optional[str]):
+        length = headers.get(b"content-length")
+        if length is not None and (not length.isdigit() or int(length) > self.max_body_bytes):
+            raise Rejected("content_length", 413, "Request body too large")
+
+        if self.denylist and client_ip:
+            try:
+                address = ipaddress.ip_address(client_ip)
+            except ValueError:
+                address = None
+            if address is not None and any(address in network for network in self.denylist):
+                raise Rejected("denylist", 403)
+
+        user_agent = headers.get(b"user-agent", b"").decode("latin-1").strip()
+        if not user_agent or (self.blocked_agents and self.blocked_agents.search(user_agent)):
+            raise Rejected("headers", 403)
+        if not headers.get(b"content-type", b"").lower().startswith(b"application/json"):
+            raise Rejected("headers", 415, "Expected application/json")
+        origin = headers.get(b"origin")
+        if origin is not None and self.allowed_origins and origin.decode("latin-1") not in self.allowed_origins:
+            raise Rejected("headers", 403)
+
+    async def _read_body(self, receive) -> bytes:
+        chunks, size = [], 0
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                raise Rejected("body", 400, "Client disconnected")
+            chunk = message.get("body", b"")
+            size += len(chunk)
+            if size > self.max_body_bytes:
+                raise Rejected("body", 413, "Request body too large")
+            chunks.append(chunk)
+            if not message.get("more_body", False):
+                return b"".join(chunks)
+
+    def _check_fields(self, body: bytes, client_ip: Optional[str], user_agent: str):
+        try:
+            fields = json_codec.loads(body)
+        except ValueError:
+            raise Rejected("parse", 400, "Invalid JSON body")
+        if not isinstance(fields, dict):
+            raise Rejected("parse", 400, "Invalid JSON body")
+
+        reason = None
+        if any(fields.get(name) for name in HONEYPOT_FIELDS):
+            reason = "honeypot_filled"
+        elif fields.get("js_enabled") != "true":
+            reason = "no_javascript"
+        else:
+            form_time = fields.get("form_time", 0)
+            # Wrong types are left for the endpoint's own validation to report
+            if isinstance(form_time, int) and not isinstance(form_time, bool):
+                if form_time < MIN_FORM_TIME:
+                    reason = "too_fast"
+                elif form_time > MAX_FORM_TIME:
+                    reason = "stale_form"
+        if reason is not None:
+            log_bot_attempt(client_ip, user_agent, reason, {"stage": "prevalidation"})
+            raise Rejected("honeypot", 403)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] != RESUME_PATH:
+            await self.app(scope, receive, send)
+            return
+
+        with _stats_lock:
+            _stats["checked"] += 1
+        headers = dict(scope.get("headers", []))
+        client_ip = client_ip_from_scope(scope)
+        try:
+            self._check_headers(headers, client_ip)
+            body = await self._read_body(receive)
+            self._check_fields(body, client_ip, headers.get(b"user-agent", b"").decode("latin-1"))
+        except Rejected as rejected:
+            with _stats_lock:
+                _stats["rejected"][rejected.stage] += 1
+            await self._reject(send, rejected)
+            return
+
+        with _stats_lock:
+            _stats["passed"] += 1
+
+        # Hand the already-read body to the app, then pass through anything after it
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+    @staticmethod
+    async def _reject(send, rejected: Rejected):
+        body = json_codec.dumps({"detail": rejected.detail})
+        await send({"type": "http.response.start", "status": rejected.status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
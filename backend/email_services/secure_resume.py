@@ -5,7 +5,6 @@ import requests
 from datetime import datetime, timedelta
 from typing import Optional, Dict
 import hashlib
-import json
 
 # Request model with CAPTCHA
 class SecureResumeRequest(BaseModel):
@@ -29,17 +28,49 @@ BREVO_API_KEY = os.getenv("BREVO_API_KEY", "")
 SENDER_EMAIL = os.getenv("SENDER_EMAIL",  "")
 BREVO_API_URL = os.getenv("BREVO_API_URL","")
 SENDER_NAME = os.getenv("SENDER_NAME", "")
+BREVO_TIMEOUT = float(os.getenv("BREVO_TIMEOUT", "10"))
+# X-Forwarded-For entries appended by proxies we run in front of the app; anything to
+# their left came from the client. 0 ignores the header and uses the connection's
+# address, which under Lambda is API Gateway's (or the function URL's) sourceIp
+TRUSTED_PROXY_HOPS = int(os.getenv("TRUSTED_PROXY_HOPS", "0"))
+
+# Honeypot inputs hidden from humans, and the plausible time to fill in the form
+HONEYPOT_FIELDS = ("website", "phone", "company")
+MIN_FORM_TIME = 3  # seconds
+MAX_FORM_TIME = 3600  # 1 hour
 
 
 # In-memory rate limiting (use DynamoDB in production)
 from collections import defaultdict
+from lifecycle import register_after_fork
+from tracing import log_context
+from circuit_breaker import CircuitOpen, breaker
+import event_log
+import json_codec
 rate_limit_tracker = defaultdict(list)
 
+# Each pre-forked server worker keeps its own tracker, starting empty
+register_after_fork(rate_limit_tracker.clear)
+
+# Stop calling reCAPTCHA or Brevo while they are failing (see circuit_breaker.py)
+recaptcha_breaker = breaker("recaptcha")
+brevo_breaker = breaker("brevo")
+
+
+def _post_checked(service_breaker, url: str, timeout: float, **kwargs) -> requests.Response:
+    """POST under a breaker; timeouts, connection errors, 429s and 5xx count as failures"""
+    with service_breaker.guard():
+        response = requests.post(url, timeout=timeout, **kwargs)
+        if response.status_code == 429 or response.status_code >= 500:
+            raise requests.HTTPError(f"{response.status_code} from {url}", response=response)
+    return response
+
 
 def verify_recaptcha(token: str, remote_ip: str) -> tuple[bool, float]:
     """Verify reCAPTCHA v3 token"""
     try:
-        response = requests.post(
+        response = _post_checked(
+            recaptcha_breaker,
             RECAPTCHA_VERIFY_URL,
             data={
                 'secret': RECAPTCHA_SECRET,
@@ -54,6 +85,9 @@ def verify_recaptcha(token: str, remote_ip: str) -> tuple[bool, float]:
         score = result.get('score', 0)
         
         return success, score
+    except CircuitOpen:
+        # An outage, not a bot; the endpoint answers 503 with Retry-After
+        raise
     except Exception as e:
         print(f"reCAPTCHA verification error: {e}")
         return False, 0.0
@@ -82,13 +116,25 @@ def check_rate_limit(email: str, ip: str) -> tuple[bool, str]:
     return True, "OK"
 
 
+def client_ip_from_scope(scope) -> Optional[str]:
+    """Client IP of an ASGI request, from the X-Forwarded-For hop our own proxy added, never one the client sent"""
+    if TRUSTED_PROXY_HOPS > 0:
+        forwarded = [
+            entry.strip()
+            for name, value in scope.get("headers", [])
+            if name == b"x-forwarded-for"
+            for entry in value.decode("latin-1").split(",")
+            if entry.strip()
+        ]
+        if len(forwarded) >= TRUSTED_PROXY_HOPS:
+            return forwarded[-TRUSTED_PROXY_HOPS]
+    client = scope.get("client")
+    return client[0] if client else None
+
+
 def get_client_ip(request: Request) -> str:
     """Extract client IP from request"""
-    # Check for forwarded IP (from CloudFront/proxy)
-    forwarded = request.headers.get("X-Forwarded-For")
-    if forwarded:
-        return forwarded.split(",")[0].strip()
-    return request.client.host
+    return client_ip_from_scope(request.scope)
 
 # HONEYPOT VALIDATION FUNCTION
 def check_honeypot(request: SecureResumeRequest, client_ip: str, user_agent: str) -> tuple[bool, str]:
@@ -116,9 +162,6 @@ def check_honeypot(request: SecureResumeRequest, client_ip: str, user_agent: str
         return False, "Bot detected: JavaScript not enabled"
     
     # 3. Check form submission time (humans typically take 5+ seconds)
-    MIN_FORM_TIME = 3  # seconds
-    MAX_FORM_TIME = 3600  # 1 hour
-    
     if request.form_time < MIN_FORM_TIME:
         log_bot_attempt(client_ip, user_agent, "too_fast", {
             "form_time": request.form_time,
@@ -146,10 +189,12 @@ def log_bot_attempt(ip: str, user_agent: str, reason: str, details: dict):
         "user_agent": user_agent,
         "reason": reason,
         "details": details,
-        "type": "bot_attempt"
+        "type": "bot_attempt",
+        **log_context()
     }
-    print(f"🤖 Bot attempt blocked: {json.dumps(log_entry)}")
-    # In production, save to DynamoDB/CloudWatch for analysis   
+    print(f"🤖 Bot attempt blocked: {json_codec.dumps_str(log_entry)}")
+    # Kept for export_analytics.py
+    event_log.record("bot_attempts", log_entry)
 
 def send_admin_notification(request_data: Dict):
     """Send notification to admin about resume request"""
@@ -217,7 +262,7 @@ def send_admin_notification(request_data: Dict):
        
         print(f"Sending File to Admin: {SENDER_EMAIL}")
         
-        response = requests.post(BREVO_API_URL, json=payload, headers=headers)
+        response = _post_checked(brevo_breaker, BREVO_API_URL, json=payload, headers=headers, timeout=BREVO_TIMEOUT)
         return response.status_code == 201
     except Exception as e:
         print(f"Error sending resume: {e}")
@@ -225,9 +270,9 @@ def send_admin_notification(request_data: Dict):
 
 
 
-def send_resume_to_user(name: str, email: str, pre_assigned_url: str) -> bool:
-    """Send resume PDF to the requester"""
-    html_content = f"""
+def render_resume_email(name: str, pre_assigned_url: str) -> str:
+    """Render the HTML body of the resume email"""
+    return f"""
     <html>
     <head>
         <style>
@@ -262,7 +307,12 @@ def send_resume_to_user(name: str, email: str, pre_assigned_url: str) -> bool:
     </body>
     </html>
     """
-    
+
+
+def send_resume_to_user(name: str, email: str, pre_assigned_url: str) -> bool:
+    """Send resume PDF to the requester"""
+    html_content = render_resume_email(name, pre_assigned_url)
+
     try:
         # Send via Brevo
         payload = {
@@ -277,7 +327,7 @@ def send_resume_to_user(name: str, email: str, pre_assigned_url: str) -> bool:
             "Content-Type": "application/json"
         }
         
-        response = requests.post(BREVO_API_URL, json=payload, headers=headers)
+        response = _post_checked(brevo_breaker, BREVO_API_URL, json=payload, headers=headers, timeout=BREVO_TIMEOUT)
 
         return response.status_code in (200, 201, 202)
     except Exception as e:
@@ -294,16 +344,12 @@ def log_request(request_data: Dict):
         "ip": request_data.get("ip"),
         "captcha_score": request_data.get("captcha_score"),
         "status": request_data.get("status"),
-        "user_agent": request_data.get("user_agent")
+        "user_agent": request_data.get("user_agent"),
+        **log_context()
     }
     
-    print(f"Resume request log: {json.dumps(log_entry)}")
-    
-    # In production, save to S3:
-    # s3_client.put_object(
-    #     Bucket=LOGS_BUCKET,
-    #     Key=f"resume-requests/{datetime.now().date()}/{uuid.uuid4()}.json",
-    #     Body=json.dumps(log_entry)
-    # )
+    print(f"Resume request log: {json_codec.dumps_str(log_entry)}")
+    # Kept for export_analytics.py
+    event_log.record("resume_requests", log_entry)
 
 
@@ -0,0 +1,288 @@
+"""
+Compare Bedrock models on real visitor questions.
+
+    uv run evaluate_models.py export-corpus                        # stored conversations -> corpus
+    uv run evaluate_models.py run --model amazon.nova-micro-v1:0 --model amazon.nova-lite-v1:0
+    uv run evaluate_models.py run --model us.amazon.nova-pro-v1:0 \\
+        --config default='{"maxTokens": 256, "temperature": 0.7}' --config short='{"maxTokens": 96}'
+    uv run evaluate_models.py run --transport replay --cassette ./recordings/bedrock.jsonl  # offline / CI
+    uv run evaluate_models.py report ./recordings/model-report.json
+
+Every model is run with every --config through call_bedrock's request
+path (same prompt, history window and error handling as /chat) with
+bounded concurrency. The report has latency percentiles, token usage,
+estimated cost and failures per variant. The corpus holds visitor text,
+so it is written under recordings/, which is not committed.
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+DEFAULT_CORPUS = "./recordings/corpus.jsonl"
+DEFAULT_REPORT = "./recordings/model-report.json"
+
+# On-demand USD per 1K tokens (input, output); check current Bedrock pricing and override with --prices
+MODEL_PRICES = {
+    "amazon.nova-micro-v1:0": (0.000035, 0.00014),
+    "amazon.nova-lite-v1:0": (0.00006, 0.00024),
+    "amazon.nova-pro-v1:0": (0.0008, 0.0032),
+    "amazon.nova-2-lite-v1:0": (0.0003, 0.0025),
+}
+
+
+def price_for(model_id: str, prices: Dict) -> Optional[tuple]:
+    """Prices by base model ID, ignoring cross-region prefixes such as us. or global."""
+    for base, price in prices.items():
+        if model_id == base or model_id.endswith("." + base):
+            return tuple(price)
+    return None
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, math.ceil(q / 100 * len(sorted_values)) - 1)]
+
+
+# Corpus
+
+def export_corpus(output: str, limit: Optional[int], history: int, min_length: int) -> int:
+    """Write one record per stored visitor question, with the history that preceded it"""
+    import memory_store
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    written = 0
+    with open(output, "w", encoding="utf-8") as f:
+        for session_id in memory_store.iter_session_ids():
+            conversation = memory_store.load_conversation(session_id)
+            for i, msg in enumerate(conversation):
+                if msg.get("role") != "user" or len(msg.get("content", "")) < min_length:
+                    continue
+                record = {
+                    "session_id": session_id,
+                    "history": [{"role": m["role"], "content": m["content"]} for m in conversation[max(0, i - history):i]],
+                    "question": msg["content"],
+                }
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+                written += 1
+                if limit and written >= limit:
+                    return written
+    return written
+
+
+def load_corpus(path: str, limit: Optional[int] = None) -> List[Dict]:
+    with open(path, encoding="utf-8") as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    return records[:limit] if limit else records
+
+
+# Evaluation
+
+def parse_config(value: str) -> tuple:
+    """'name=<json>' or '<json>' -> (name, inference config)"""
+    name, sep, body = value.partition("=")
+    if not sep or name.lstrip().startswith("{"):
+        name, body = None, value
+    config = json.loads(body)
+    if not isinstance(config, dict):
+        raise argparse.ArgumentTypeError(f"Inference config must be a JSON object: {value}")
+    return name or json.dumps(config, separators=(",", ":"), sort_keys=True), config
+
+
+def ask(server, model_id: str, config: Dict, record: Dict) -> Dict:
+    """Send one corpus question and time it"""
+    from fastapi import HTTPException
+
+    started = time.perf_counter()
+    result = {"question": record["question"][:80]}
+    try:
+        response = server.converse_bedrock(record["history"], record["question"],
+                                           model_id=model_id, inference_config=config)
+        usage = response.get("usage", {})
+        result.update(ok=True, input_tokens=usage.get("inputTokens", 0), output_tokens=usage.get("outputTokens", 0),
+                      stop_reason=response.get("stopReason"))
+    except HTTPException as e:
+        result.update(ok=False, error=f"HTTP {e.status_code}: {e.detail}"[:120])
+    except Exception as e:
+        result.update(ok=False, error=f"{type(e).__name__}: {e}"[:120])
+    result["latency_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return result
+
+
+def summarize(label: str, model_id: str, config: Dict, results: List[Dict], wall_seconds: float,
+              prices: Dict) -> Dict:
+    ok = [r for r in results if r["ok"]]
+    latencies = sorted(r["latency_ms"] for r in ok)
+    input_tokens = sum(r["input_tokens"] for r in ok)
+    output_tokens = sum(r["output_tokens"] for r in ok)
+
+    price = price_for(model_id, prices)
+    cost = None
+    if price is not None:
+        cost = input_tokens / 1000 * price[0] + output_tokens / 1000 * price[1]
+
+    return {
+        "label": label,
+        "model_id": model_id,
+        "inference_config": config,
+        "requests": len(results),
+        "ok": len(ok),
+        "failures": dict(Counter(r["error"] for r in results if not r["ok"])),
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies), 3) if latencies else None,
+            "p50": percentile(latencies, 50),
+            "p90": percentile(latencies, 90),
+            "p99": percentile(latencies, 99),
+            "max": latencies[-1] if latencies else None,
+        },
+        "tokens": {
+            "input": input_tokens,
+            "output": output_tokens,
+            "mean_output": round(output_tokens / len(ok), 1) if ok else None,
+        },
+        "cost_usd": {
+            "total": round(cost, 6) if cost is not None else None,
+            "per_1k_requests": round(cost / len(ok) * 1000, 4) if cost is not None and ok else None,
+        },
+        "throughput_rps": round(len(results) / wall_seconds, 2) if wall_seconds else None,
+    }
+
+
+def evaluate(corpus: List[Dict], variants: List[tuple], concurrency: int, repeat: int, prices: Dict) -> List[Dict]:
+    import server
+
+    summaries = []
+    for label, model_id, config in variants:
+        print(f"Running {label} ({len(corpus) * repeat} requests, concurrency {concurrency})...")
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(lambda record: ask(server, model_id, config, record), corpus * repeat))
+        summary = summarize(label, model_id, config, results, time.perf_counter() - started, prices)
+        summary["results"] = results
+        summaries.append(summary)
+    return summaries
+
+
+def _fmt(value, spec: str = ".1f") -> str:
+    return "-" if value is None else format(value, spec)
+
+
+def print_report(report: Dict):
+    variants = report["variants"]
+    print(f"\n{report['questions']} question(s) x {report['repeat']} via {report['transport']} "
+          f"transport, concurrency {report['concurrency']}")
+    print(f"{'variant':<48} {'ok':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} "
+          f"{'out tok':>8} {'$/1k req':>9} {'vs base':>8}")
+    baseline = variants[0] if variants else None
+    for v in variants:
+        relative = ""
+        if baseline is not v and baseline["latency_ms"]["p50"] and v["latency_ms"]["p50"]:
+            relative = f"{v['latency_ms']['p50'] / baseline['latency_ms']['p50']:.2f}x"
+        print(f"{v['label'][:48]:<48} {v['ok']:>3}/{v['requests']:<3} {_fmt(v['latency_ms']['p50']):>9} "
+              f"{_fmt(v['latency_ms']['p90']):>9} {_fmt(v['latency_ms']['p99']):>9} "
+              f"{_fmt(v['tokens']['mean_output']):>8} {_fmt(v['cost_usd']['per_1k_requests'], '.4f'):>9} {relative:>8}")
+    for v in variants:
+        for error, count in v["failures"].items():
+            print(f"  {v['label']}: {count} x {error}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate Bedrock models on stored visitor questions")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    export = sub.add_parser("export-corpus", help="Extract visitor questions from stored conversations")
+    export.add_argument("--output", default=DEFAULT_CORPUS)
+    export.add_argument("--limit", type=int, help="Stop after N questions")
+    export.add_argument("--history", type=int, default=10, help="Preceding messages kept per question")
+    export.add_argument("--min-length", type=int, default=2, help="Skip questions shorter than this")
+
+    run = sub.add_parser("run", help="Replay the corpus against one or more models")
+    run.add_argument("--corpus", default=DEFAULT_CORPUS)
+    run.add_argument("--model", action="append", dest="models",
+                     help="Model ID to evaluate (repeatable; default: BEDROCK_MODEL_ID)")
+    run.add_argument("--config", action="append", dest="configs", type=parse_config,
+                     help="Inference config as JSON or name=JSON (repeatable; default: the server's)")
+    run.add_argument("--concurrency", type=int, default=4, help="Requests in flight per model")
+    run.add_argument("--repeat", type=int, default=1, help="Send every question this many times")
+    run.add_argument("--limit", type=int, help="Use only the first N questions")
+    run.add_argument("--transport", choices=["live", "record", "replay"],
+                     help="Bedrock transport (default: BEDROCK_TRANSPORT)")
+    run.add_argument("--cassette", help="Cassette for record/replay (default: BEDROCK_CASSETTE)")
+    run.add_argument("--simulate-latency", action="store_true", help="Replay: sleep for the recorded latency")
+    run.add_argument("--prices", help="JSON file of {model_id: [input, output]} USD per 1K tokens")
+    run.add_argument("--output", default=DEFAULT_REPORT, help="Where to save the JSON report")
+
+    show = sub.add_parser("report", help="Print a saved report")
+    show.add_argument("path", nargs="?", default=DEFAULT_REPORT)
+
+    args = parser.parse_args()
+
+    if args.command == "export-corpus":
+        written = export_corpus(args.output, args.limit, args.history, args.min_length)
+        print(f"✓ Wrote {written} question(s) to {args.output}")
+        return 0
+
+    if args.command == "report":
+        with open(args.path, encoding="utf-8") as f:
+            print_report(json.load(f))
+        return 0
+
+    import bedrock_transport
+    import server
+
+    corpus = load_corpus(args.corpus, args.limit)
+    if not corpus:
+        print(f"❌ No questions in {args.corpus}; run export-corpus first")
+        return 1
+
+    transport = (args.transport or bedrock_transport.BEDROCK_TRANSPORT).lower()
+    if transport == "replay":
+        server.bedrock_transport = bedrock_transport.ReplayTransport.from_file(
+            args.cassette or bedrock_transport.BEDROCK_CASSETTE, simulate_latency=args.simulate_latency,
+        )
+    elif args.transport or args.cassette:
+        server.bedrock_transport = bedrock_transport.create_transport(server.bedrock_client, transport, args.cassette)
+
+    prices = dict(MODEL_PRICES)
+    if args.prices:
+        with open(args.prices, encoding="utf-8") as f:
+            prices.update(json.load(f))
+
+    configs = args.configs or [("default", server.BEDROCK_INFERENCE_CONFIG)]
+    variants = [
+        (model if len(configs) == 1 else f"{model} [{name}]", model, config)
+        for model in (args.models or [server.BEDROCK_MODEL_ID])
+        for name, config in configs
+    ]
+
+    report = {
+        "created_at": datetime.now().isoformat(),
+        "corpus": args.corpus,
+        "questions": len(corpus),
+        "repeat": args.repeat,
+        "concurrency": args.concurrency,
+        "transport": transport,
+        "variants": evaluate(corpus, variants, args.concurrency, args.repeat, prices),
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print_report(report)
+    print(f"\n✓ Saved report to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,154 @@
+"""
+Append-only event streams for analytics (resume requests, bot attempts).
+
+Entries are still printed to the log as before, and unless
+EVENTS_ENABLED=false they are also buffered and written as immutable JSON
+Lines segments next to the conversations:
+
+    <EVENTS_PREFIX><stream>/date=YYYY-MM-DD/<epoch ms>-<random>.jsonl
+
+in S3_BUCKET when USE_S3 is on, under MEMORY_DIR otherwise. Segment names
+sort by write time, which is what export_analytics.py checkpoints on.
+A segment is written once EVENTS_BATCH_SIZE entries or EVENTS_FLUSH_SECONDS
+have built up (in a background thread, so a request never waits on it),
+at shutdown, and at the end of each Lambda invocation.
+"""
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterator, List, Optional
+
+import json_codec
+import memory_store
+from lifecycle import register_after_fork, register_shutdown_hook
+
+EVENTS_ENABLED = os.getenv("EVENTS_ENABLED", "true").lower() == "true"
+EVENTS_PREFIX = os.getenv("EVENTS_PREFIX", "events/")
+EVENTS_BATCH_SIZE = int(os.getenv("EVENTS_BATCH_SIZE", "100"))
+EVENTS_FLUSH_SECONDS = float(os.getenv("EVENTS_FLUSH_SECONDS", "60"))
+
+SEGMENT_SUFFIX = ".jsonl"
+
+# stream -> encoded lines waiting to be written
+_buffer: Dict[str, List[bytes]] = {}
+_buffer_lock = threading.Lock()
+_oldest_buffered_at: Optional[float] = None
+_flushing = threading.Event()
+
+
+def segment_key(stream: str, written_at: float) -> str:
+    day = datetime.fromtimestamp(written_at, timezone.utc).strftime("%Y-%m-%d")
+    return f"{EVENTS_PREFIX}{stream}/date={day}/{int(written_at * 1000):013d}-{uuid.uuid4().hex[:8]}{SEGMENT_SUFFIX}"
+
+
+def segment_time(key: str) -> float:
+    """Write time encoded in a segment name, in epoch seconds"""
+    return int(key.rsplit("/", 1)[-1].split("-", 1)[0]) / 1000
+
+
+def _write_segment(key: str, body: bytes):
+    if memory_store.USE_S3:
+        memory_store.s3_client.put_object(
+            Bucket=memory_store.S3_BUCKET, Key=key, Body=body, ContentType="application/x-ndjson"
+        )
+    else:
+        path = os.path.join(memory_store.MEMORY_DIR, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(body)
+        os.replace(tmp_path, path)
+
+
+def record(stream: str, entry: Dict):
+    """Buffer one entry for the stream; never raises"""
+    global _oldest_buffered_at
+    if not EVENTS_ENABLED:
+        return
+    try:
+        line = json_codec.dumps(entry) + b"\n"
+    except Exception as e:
+        print(f"Event for {stream} not recorded: {e}")
+        return
+    with _buffer_lock:
+        _buffer.setdefault(stream, []).append(line)
+        if _oldest_buffered_at is None:
+            _oldest_buffered_at = time.monotonic()
+        due = (sum(len(lines) for lines in _buffer.values()) >= EVENTS_BATCH_SIZE
+               or time.monotonic() - _oldest_buffered_at >= EVENTS_FLUSH_SECONDS)
+    if due and not _flushing.is_set():
+        _flushing.set()
+        threading.Thread(target=_background_flush, name="event-log-flush", daemon=True).start()
+
+
+def _background_flush():
+    try:
+        flush()
+    finally:
+        _flushing.clear()
+
+
+def flush():
+    """Write every buffered stream as a new segment (end of a Lambda invocation, shutdown)"""
+    global _oldest_buffered_at
+    with _buffer_lock:
+        pending = {stream: lines for stream, lines in _buffer.items() if lines}
+        _buffer.clear()
+        _oldest_buffered_at = None
+    for stream, lines in pending.items():
+        try:
+            _write_segment(segment_key(stream, time.time()), b"".join(lines))
+        except Exception as e:
+            print(f"Dropped {len(lines)} {stream} event(s): {e}")
+
+
+def _reset_after_fork():
+    global _oldest_buffered_at
+    # Entries buffered by the parent belong to the parent
+    with _buffer_lock:
+        _buffer.clear()
+        _oldest_buffered_at = None
+    _flushing.clear()
+
+
+register_after_fork(_reset_after_fork)
+register_shutdown_hook(flush)
+
+
+def iter_segments(stream: str, start_after: Optional[str] = None) -> Iterator[str]:
+    """Keys of a stream's segments in write order, after start_after if given"""
+    prefix = f"{EVENTS_PREFIX}{stream}/"
+    if memory_store.USE_S3:
+        paginator = memory_store.s3_client.get_paginator("list_objects_v2")
+        kwargs = {"StartAfter": start_after} if start_after else {}
+        for page in paginator.paginate(Bucket=memory_store.S3_BUCKET, Prefix=prefix, **kwargs):
+            for obj in page.get("Contents", []):
+                if obj["Key"].endswith(SEGMENT_SUFFIX):
+                    yield obj["Key"]
+    else:
+        root = os.path.join(memory_store.MEMORY_DIR, prefix)
+        if not os.path.isdir(root):
+            return
+        for partition in sorted(os.listdir(root)):
+            for name in sorted(os.listdir(os.path.join(root, partition))):
+                key = f"{prefix}{partition}/{name}"
+                if name.endswith(SEGMENT_SUFFIX) and (start_after is None or key > start_after):
+                    yield key
+
+
+def read_segment(key: str) -> Iterator[Dict]:
+    """Entries of one segment, streamed line by line"""
+    if memory_store.USE_S3:
+        body = memory_store.s3_client.get_object(Bucket=memory_store.S3_BUCKET, Key=key)["Body"]
+        lines = body.iter_lines()
+    else:
+        lines = open(os.path.join(memory_store.MEMORY_DIR, key), "rb")
+    try:
+        for line in lines:
+            if line.strip():
+                yield json_codec.loads(line)
+    finally:
+        if hasattr(lines, "close"):
+            lines.close()
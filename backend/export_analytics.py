@@ -0,0 +1,346 @@
+"""
+Roll stored conversations and event streams up into columnar files for analytics.
+
+    uv run --with pyarrow export_analytics.py                              # ./analytics, Parquet
+    uv run --with pyarrow export_analytics.py --output s3://my-bucket/analytics/
+    uv run --with pyarrow export_analytics.py --format arrow               # Arrow IPC files
+    uv run --with pyarrow export_analytics.py --full                       # ignore the checkpoint
+
+Tables, partitioned Hive-style by day (<table>/date=YYYY-MM-DD/), with one
+new part file per run and day:
+
+    messages         session_id, persona, message_index, role, content, content_chars, timestamp
+    resume_requests  timestamp, name, email, ip, captcha_score, status, user_agent, trace_id
+    bot_attempts     timestamp, ip, user_agent, reason, details (JSON text), trace_id
+
+Runs are incremental. <output>/_checkpoint.json records the time up to
+which messages were exported and the last event segment read (see
+event_log.py), and only data older than --settle-seconds is taken, so a
+turn still being saved is picked up by the next run instead of being
+missed. Sessions are read one at a time and rows are written in batches of
+--batch-rows per day, so memory stays bounded however much is stored.
+
+    duckdb -c "SELECT role, count(*) FROM read_parquet('analytics/messages/*/*.parquet',
+               hive_partitioning = true) GROUP BY role"
+
+Uses the same USE_S3 / S3_BUCKET / MEMORY_DIR settings as the server.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+DEFAULT_OUTPUT = "./analytics"
+CHECKPOINT_NAME = "_checkpoint.json"
+DEFAULT_PERSONA = os.getenv("DEFAULT_PERSONA", "default")
+
+
+def parse_time(value) -> Optional[datetime]:
+    """Naive datetime from an ISO timestamp as the app writes them (local time, no offset)"""
+    if not isinstance(value, str) or not value:
+        return None
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        return None
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone().replace(tzinfo=None)
+    return parsed
+
+
+def schemas(pa) -> Dict:
+    timestamp = pa.timestamp("ms")
+    return {
+        "messages": pa.schema([
+            ("session_id", pa.string()),
+            ("persona", pa.string()),
+            ("message_index", pa.int32()),
+            ("role", pa.string()),
+            ("content", pa.string()),
+            ("content_chars", pa.int32()),
+            ("timestamp", timestamp),
+        ]),
+        "resume_requests": pa.schema([
+            ("timestamp", timestamp),
+            ("name", pa.string()),
+            ("email", pa.string()),
+            ("ip", pa.string()),
+            ("captcha_score", pa.float64()),
+            ("status", pa.string()),
+            ("user_agent", pa.string()),
+            ("trace_id", pa.string()),
+        ]),
+        "bot_attempts": pa.schema([
+            ("timestamp", timestamp),
+            ("ip", pa.string()),
+            ("user_agent", pa.string()),
+            ("reason", pa.string()),
+            ("details", pa.string()),
+            ("trace_id", pa.string()),
+        ]),
+    }
+
+
+# Output location
+
+class Output:
+    """A local directory or s3://bucket/prefix the tables and checkpoint are written to"""
+
+    def __init__(self, location: str):
+        self.location = location
+        self.s3_client = None
+        if location.startswith("s3://"):
+            import aws_clients
+
+            self.bucket, _, prefix = location[len("s3://"):].partition("/")
+            self.prefix = prefix.rstrip("/") + "/" if prefix else ""
+            self.s3_client = aws_clients.client("s3")
+
+    def path(self, relative: str) -> str:
+        if self.s3_client is not None:
+            return f"s3://{self.bucket}/{self.prefix}{relative}"
+        return os.path.join(self.location, relative)
+
+    def publish(self, local_path: str, relative: str):
+        """Move a finished file into place, so readers never see a partial one"""
+        if self.s3_client is not None:
+            self.s3_client.upload_file(local_path, self.bucket, f"{self.prefix}{relative}")
+            os.remove(local_path)
+        else:
+            final_path = os.path.join(self.location, relative)
+            os.makedirs(os.path.dirname(final_path), exist_ok=True)
+            os.replace(local_path, final_path)
+
+    def read_checkpoint(self) -> Dict:
+        import json_codec
+
+        try:
+            if self.s3_client is not None:
+                body = self.s3_client.get_object(Bucket=self.bucket, Key=f"{self.prefix}{CHECKPOINT_NAME}")["Body"].read()
+            else:
+                with open(os.path.join(self.location, CHECKPOINT_NAME), "rb") as f:
+                    body = f.read()
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            if getattr(e, "response", {}).get("Error", {}).get("Code") in ("NoSuchKey", "404"):
+                return {}
+            raise
+        return json_codec.loads(body)
+
+    def write_checkpoint(self, checkpoint: Dict):
+        import json_codec
+
+        body = json_codec.dumps(checkpoint, indent=True)
+        if self.s3_client is not None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=f"{self.prefix}{CHECKPOINT_NAME}", Body=body,
+                                      ContentType="application/json")
+        else:
+            os.makedirs(self.location, exist_ok=True)
+            tmp_path = os.path.join(self.location, f"{CHECKPOINT_NAME}.tmp")
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, os.path.join(self.location, CHECKPOINT_NAME))
+
+
+class PartitionedWriter:
+    """Streams rows of one table into a part file per day, batch_rows rows at a time"""
+
+    def __init__(self, pa, output: Output, table: str, schema, file_format: str, run_id: str, batch_rows: int):
+        self.pa = pa
+        self.output = output
+        self.table = table
+        self.schema = schema
+        self.file_format = file_format
+        self.run_id = run_id
+        self.batch_rows = batch_rows
+        self.staging_dir = tempfile.mkdtemp(prefix=f"export-{table}-")
+        # day -> (writer, staging path), and rows waiting for the next batch
+        self._writers: Dict[str, Tuple[object, str]] = {}
+        self._pending: Dict[str, List[Dict]] = {}
+        self.rows: Dict[str, int] = {}
+
+    def _open(self, day: str):
+        path = os.path.join(self.staging_dir, f"{day}.{self.file_format}")
+        if self.file_format == "parquet":
+            import pyarrow.parquet as pq
+
+            writer = pq.ParquetWriter(path, self.schema, compression="zstd")
+        else:
+            writer = self.pa.ipc.new_file(path, self.schema)
+        self._writers[day] = (writer, path)
+        return writer
+
+    def _write(self, day: str):
+        rows = self._pending.pop(day, [])
+        if not rows:
+            return
+        writer = self._writers[day][0] if day in self._writers else self._open(day)
+        writer.write_batch(self.pa.RecordBatch.from_pylist(rows, schema=self.schema))
+
+    def add(self, day: str, row: Dict):
+        pending = self._pending.setdefault(day, [])
+        pending.append(row)
+        self.rows[day] = self.rows.get(day, 0) + 1
+        if len(pending) >= self.batch_rows:
+            self._write(day)
+
+    def close(self) -> List[str]:
+        """Finish every part file and publish it; returns where they went"""
+        for day in list(self._pending):
+            self._write(day)
+        published = []
+        for day, (writer, path) in self._writers.items():
+            writer.close()
+            relative = f"{self.table}/date={day}/part-{self.run_id}.{self.file_format}"
+            self.output.publish(path, relative)
+            published.append(self.output.path(relative))
+        os.rmdir(self.staging_dir)
+        return published
+
+
+# Sources
+
+def export_messages(writer: PartitionedWriter, since: float, until: float) -> int:
+    """Messages written in (since, until], read only from sessions touched after since"""
+    import memory_store
+
+    sessions = 0
+    for entry in memory_store.iter_session_keys():
+        if entry["last_activity"] <= since:
+            continue
+        storage_id = entry["session_id"]
+        # "<persona_id>.<session_id>" (see personas.scoped_session_id); persona IDs have no "."
+        persona, scoped, session_id = storage_id.partition(".")
+        if not scoped:
+            persona, session_id = DEFAULT_PERSONA, storage_id
+        for index, msg in enumerate(memory_store.load_conversation(storage_id)):
+            timestamp = parse_time(msg.get("timestamp"))
+            written_at = timestamp.timestamp() if timestamp else entry["last_activity"]
+            if not since < written_at <= until:
+                continue
+            content = msg.get("content") or ""
+            writer.add((timestamp or datetime.fromtimestamp(written_at)).strftime("%Y-%m-%d"), {
+                "session_id": session_id,
+                "persona": persona,
+                "message_index": index,
+                "role": msg.get("role"),
+                "content": content,
+                "content_chars": len(content),
+                "timestamp": timestamp,
+            })
+        sessions += 1
+    return sessions
+
+
+def resume_request_row(entry: Dict) -> Dict:
+    score = entry.get("captcha_score")
+    return {
+        "timestamp": parse_time(entry.get("timestamp")),
+        "name": entry.get("name"),
+        "email": entry.get("email"),
+        "ip": entry.get("ip"),
+        "captcha_score": float(score) if isinstance(score, (int, float)) else None,
+        "status": entry.get("status"),
+        "user_agent": entry.get("user_agent"),
+        "trace_id": entry.get("trace_id"),
+    }
+
+
+def bot_attempt_row(entry: Dict) -> Dict:
+    import json_codec
+
+    return {
+        "timestamp": parse_time(entry.get("timestamp")),
+        "ip": entry.get("ip"),
+        "user_agent": entry.get("user_agent"),
+        "reason": entry.get("reason"),
+        "details": json_codec.dumps_str(entry.get("details") or {}),
+        "trace_id": entry.get("trace_id"),
+    }
+
+
+EVENT_TABLES: Dict[str, Callable[[Dict], Dict]] = {
+    "resume_requests": resume_request_row,
+    "bot_attempts": bot_attempt_row,
+}
+
+
+def export_events(writer: PartitionedWriter, stream: str, after_key: Optional[str], until: float) -> Optional[str]:
+    """Rows from the stream's segments after after_key written up to until; returns the last segment read"""
+    import event_log
+
+    to_row = EVENT_TABLES[stream]
+    last_key = after_key
+    for key in event_log.iter_segments(stream, after_key):
+        if event_log.segment_time(key) > until:
+            # Segments are listed in write order; the rest are newer still
+            break
+        segment_day = key.rsplit("/date=", 1)[-1].split("/", 1)[0]
+        for entry in event_log.read_segment(key):
+            row = to_row(entry)
+            writer.add(row["timestamp"].strftime("%Y-%m-%d") if row["timestamp"] else segment_day, row)
+        last_key = key
+    return last_key
+
+
+def run(output: Output, file_format: str, full: bool, settle_seconds: float, batch_rows: int) -> Dict:
+    import pyarrow as pa
+
+    checkpoint = {} if full else output.read_checkpoint()
+    until = time.time() - settle_seconds
+    run_id = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    tables = schemas(pa)
+    summary = {}
+
+    writer = PartitionedWriter(pa, output, "messages", tables["messages"], file_format, run_id, batch_rows)
+    since = checkpoint.get("messages", {}).get("until", 0.0)
+    sessions = export_messages(writer, since, until)
+    summary["messages"] = {"rows": sum(writer.rows.values()), "sessions_read": sessions, "files": writer.close()}
+    new_checkpoint = {"messages": {"until": until}}
+
+    for stream in EVENT_TABLES:
+        writer = PartitionedWriter(pa, output, stream, tables[stream], file_format, run_id, batch_rows)
+        last_key = export_events(writer, stream, checkpoint.get(stream, {}).get("after_key"), until)
+        summary[stream] = {"rows": sum(writer.rows.values()), "files": writer.close()}
+        new_checkpoint[stream] = {"after_key": last_key}
+
+    # Only after every file is in place, so a failed run is simply repeated
+    new_checkpoint["updated_at"] = datetime.now(timezone.utc).isoformat()
+    output.write_checkpoint(new_checkpoint)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export conversations and resume/bot events as Parquet or Arrow")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT, help="Directory or s3://bucket/prefix (default: ./analytics)")
+    parser.add_argument("--format", choices=["parquet", "arrow"], default="parquet", dest="file_format")
+    parser.add_argument("--full", action="store_true", help="Export everything, ignoring and replacing the checkpoint")
+    parser.add_argument("--settle-seconds", type=float, default=300,
+                        help="Leave data newer than this for the next run (default: 300)")
+    parser.add_argument("--batch-rows", type=int, default=10000, help="Rows buffered per day before writing a batch")
+    args = parser.parse_args()
+
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        print("❌ pyarrow is required: uv run --with pyarrow export_analytics.py")
+        return 1
+
+    output = Output(args.output)
+    print(f"Exporting to {args.output} as {args.file_format}{' (full)' if args.full else ''}...")
+    summary = run(output, args.file_format, args.full, args.settle_seconds, args.batch_rows)
+    for table, result in summary.items():
+        print(f"✓ {table}: {result['rows']} row(s) in {len(result['files'])} file(s)")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
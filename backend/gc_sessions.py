@@ -0,0 +1,55 @@
+"""
+Expire idle conversation sessions.
+
+    uv run gc_sessions.py                        # delete sessions idle > SESSION_TTL_DAYS
+    uv run gc_sessions.py --dry-run --ttl-days 7
+    uv run gc_sessions.py --interval 3600        # keep running as a scheduled job
+    uv run gc_sessions.py --configure-lifecycle  # S3: let a lifecycle rule expire sessions
+
+Uses the same USE_S3 / S3_BUCKET / MEMORY_DIR settings as the server.
+"""
+import argparse
+import time
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+import memory_store
+
+
+def run_once(ttl_days: int, dry_run: bool):
+    storage = f"s3://{memory_store.S3_BUCKET}" if memory_store.USE_S3 else memory_store.MEMORY_DIR
+    print(f"Expiring sessions idle for more than {ttl_days} days in {storage}{' (dry run)' if dry_run else ''}...")
+    result = memory_store.expire_sessions(ttl_days, dry_run=dry_run)
+    print(f"✓ Expired {result['expired']} session(s), kept {result['kept']}, "
+          f"removed {result['temp_files']} stale temp file(s)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Expire idle conversation sessions")
+    parser.add_argument("--ttl-days", type=int, default=memory_store.SESSION_TTL_DAYS,
+                        help="Idle days before a session expires (default: SESSION_TTL_DAYS)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would be deleted")
+    parser.add_argument("--interval", type=int, help="Repeat every N seconds instead of running once")
+    parser.add_argument("--configure-lifecycle", action="store_true",
+                        help="Install an S3 lifecycle rule on the sessions/ prefix instead of sweeping")
+    args = parser.parse_args()
+
+    if args.configure_lifecycle:
+        if not memory_store.USE_S3:
+            parser.error("--configure-lifecycle requires USE_S3=true")
+        rule = memory_store.configure_s3_lifecycle(args.ttl_days)
+        print(f"✓ Lifecycle rule '{rule['ID']}' expires {memory_store.SESSION_PREFIX}* after {args.ttl_days} days "
+              f"on s3://{memory_store.S3_BUCKET}")
+        return
+
+    while True:
+        run_once(args.ttl_days, args.dry_run)
+        if not args.interval:
+            break
+        time.sleep(args.interval)
+
+
+if __name__ == "__main__":
+    main()
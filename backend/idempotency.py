@@ -0,0 +1,429 @@
+"""
+Idempotency-Key support for POST /chat and the resume endpoint.
+
+Clients retry on timeouts. Without a key, a /chat retry repeats the full
+Bedrock call and saves the turn twice, and a resume retry sends the
+emails twice. A request that carries an Idempotency-Key header is handled
+as follows:
+
+- The first request runs. Its completed response is kept for
+  IDEMPOTENCY_TTL_SECONDS and replayed, with Idempotency-Replayed: true,
+  to any retry that sends the same key and body.
+- A retry that arrives while the first request is still running waits up
+  to IDEMPOTENCY_WAIT_SECONDS for its result. If the result isn't ready by
+  then, the retry gets a 409 with Retry-After.
+- Reusing a key with a different body is refused with 422.
+- A 5xx, 408, 409, 425 or 429 response isn't kept, so the next retry runs
+  again. Nor is one an endpoint marks with TRANSIENT_HEADERS, such as the
+  degraded /chat reply served while Bedrock's breaker is open; the marker
+  is stripped before the response goes out.
+- If the first request dies without finishing, another request can take
+  over its key after IDEMPOTENCY_LOCK_SECONDS.
+
+Keys are scoped to the persona and path.
+
+IDEMPOTENCY_BACKEND picks where keys live:
+
+    memory    per process; retries that reach another Lambda container or
+              pre-forked worker aren't caught
+    dynamodb  shared, in IDEMPOTENCY_TABLE (partition key "pk", TTL
+              attribute "expires_at")
+
+If the store fails, requests run as if they had no key.
+"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from starlette.concurrency import run_in_threadpool
+
+import aws_clients
+import json_codec
+import personas
+from lifecycle import register_after_fork
+
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_TABLE = os.getenv("IDEMPOTENCY_TABLE", "")
+IDEMPOTENCY_PATHS = [
+    path.strip() for path in os.getenv("IDEMPOTENCY_PATHS", "/chat,/send-resume-request-secure").split(",")
+    if path.strip()
+]
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_LOCK_SECONDS = int(os.getenv("IDEMPOTENCY_LOCK_SECONDS", "120"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_POLL_SECONDS = float(os.getenv("IDEMPOTENCY_POLL_SECONDS", "0.1"))
+# Keys the memory backend keeps before evicting the least recently used
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "10000"))
+
+HEADER = b"idempotency-key"
+REPLAYED_HEADER = b"idempotency-replayed"
+TRANSIENT_HEADER = b"idempotency-transient"
+# For endpoints to set on an outcome of a passing outage, which a retry should get a fresh go at
+TRANSIENT_HEADERS = {TRANSIENT_HEADER.decode(): "true"}
+MAX_KEY_LENGTH = 255
+
+IN_PROGRESS = "in_progress"
+COMPLETED = "completed"
+
+# Outcomes a retry should run again for instead of seeing replayed
+UNCACHEABLE_STATUSES = {408, 409, 425, 429}
+# Per-response headers that shouldn't be replayed
+SKIPPED_HEADERS = {b"content-length", b"date", b"server", b"x-trace-id", b"set-cookie"}
+
+
+def fingerprint(method: str, path: str, body: bytes) -> str:
+    return hashlib.sha256(method.encode() + b" " + path.encode() + b"\n" + body).hexdigest()
+
+
+class MemoryIdempotencyStore:
+    """Records per key in this process only"""
+
+    blocking = False
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._records: "OrderedDict[str, Dict]" = OrderedDict()
+
+    def _live(self, key: str, now: float) -> Optional[Dict]:
+        record = self._records.get(key)
+        if record is None:
+            return None
+        if record["expires_at"] <= now or (record["state"] == IN_PROGRESS and record["locked_until"] <= now):
+            del self._records[key]
+            return None
+        self._records.move_to_end(key)
+        return record
+
+    def claim(self, key: str, request_fingerprint: str, now: float) -> Optional[Dict]:
+        """Take the key for this request and return None, or return the record already holding it"""
+        with self._lock:
+            record = self._live(key, now)
+            if record is not None:
+                return dict(record)
+            self._records[key] = {
+                "state": IN_PROGRESS, "fingerprint": request_fingerprint,
+                "locked_until": now + IDEMPOTENCY_LOCK_SECONDS, "expires_at": now + IDEMPOTENCY_TTL_SECONDS,
+            }
+            while len(self._records) > self.max_entries:
+                self._records.popitem(last=False)
+            return None
+
+    def get(self, key: str, now: float) -> Optional[Dict]:
+        with self._lock:
+            record = self._live(key, now)
+            return dict(record) if record is not None else None
+
+    def complete(self, key: str, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, now: float):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None:
+                record.update(state=COMPLETED, status=status, headers=headers, body=body,
+                              expires_at=now + IDEMPOTENCY_TTL_SECONDS)
+
+    def release(self, key: str):
+        with self._lock:
+            record = self._records.get(key)
+            if record is not None and record["state"] == IN_PROGRESS:
+                del self._records[key]
+
+
+class DynamoIdempotencyStore:
+    """Records per key in a DynamoDB table, claimed with a conditional write"""
+
+    blocking = True
+
+    def __init__(self, table: str):
+        if not table:
+            raise ValueError("IDEMPOTENCY_TABLE must be set for the dynamodb backend")
+        self.table = table
+        self.client = aws_clients.client("dynamodb")
+
+    @staticmethod
+    def _record(item: Dict) -> Dict:
+        record = {
+            "state": item["state"]["S"],
+            "fingerprint": item["fingerprint"]["S"],
+            "locked_until": int(item["locked_until"]["N"]),
+            "expires_at": int(item["expires_at"]["N"]),
+        }
+        if record["state"] == COMPLETED:
+            record["status"] = int(item["status"]["N"])
+            record["headers"] = [
+                (name.encode("latin-1"), value.encode("latin-1"))
+                for name, value in json_codec.loads(item["headers"]["S"])
+            ]
+            record["body"] = item["body"]["B"]
+        return record
+
+    def claim(self, key: str, request_fingerprint: str, now: float) -> Optional[Dict]:
+        try:
+            self.client.put_item(
+                TableName=self.table,
+                Item={
+                    "pk": {"S": key},
+                    "state": {"S": IN_PROGRESS},
+                    "fingerprint": {"S": request_fingerprint},
+                    "locked_until": {"N": str(int(now + IDEMPOTENCY_LOCK_SECONDS))},
+                    "expires_at": {"N": str(int(now + IDEMPOTENCY_TTL_SECONDS))},
+                },
+                # New, expired (TTL deletes lag by hours) or abandoned by a request that died
+                ConditionExpression="attribute_not_exists(pk) OR expires_at <= :now "
+                                    "OR (#state = :in_progress AND locked_until <= :now)",
+                ExpressionAttributeNames={"#state": "state"},
+                ExpressionAttributeValues={":now": {"N": str(int(now))}, ":in_progress": {"S": IN_PROGRESS}},
+                ReturnValuesOnConditionCheckFailure="ALL_OLD",
+            )
+            return None
+        except self.client.exceptions.ConditionalCheckFailedException as e:
+            item = e.response.get("Item")
+            return self._record(item) if item else self.get(key, now)
+
+    def get(self, key: str, now: float) -> Optional[Dict]:
+        item = self.client.get_item(TableName=self.table, Key={"pk": {"S": key}}, ConsistentRead=True).get("Item")
+        if item is None:
+            return None
+        record = self._record(item)
+        if record["expires_at"] <= now or (record["state"] == IN_PROGRESS and record["locked_until"] <= now):
+            return None
+        return record
+
+    def complete(self, key: str, status: int, headers: List[Tuple[bytes, bytes]], body: bytes, now: float):
+        self.client.update_item(
+            TableName=self.table,
+            Key={"pk": {"S": key}},
+            UpdateExpression="SET #state = :completed, #status = :status, headers = :headers, body = :body, "
+                             "expires_at = :expires_at",
+            ExpressionAttributeNames={"#state": "state", "#status": "status"},
+            ExpressionAttributeValues={
+                ":completed": {"S": COMPLETED},
+                ":status": {"N": str(status)},
+                ":headers": {"S": json_codec.dumps_str(
+                    [(name.decode("latin-1"), value.decode("latin-1")) for name, value in headers]
+                )},
+                ":body": {"B": body},
+                ":expires_at": {"N": str(int(now + IDEMPOTENCY_TTL_SECONDS))},
+            },
+        )
+
+    def release(self, key: str):
+        self.client.delete_item(
+            TableName=self.table,
+            Key={"pk": {"S": key}},
+            ConditionExpression="#state = :in_progress",
+            ExpressionAttributeNames={"#state": "state"},
+            ExpressionAttributeValues={":in_progress": {"S": IN_PROGRESS}},
+        )
+
+
+def create_store():
+    if IDEMPOTENCY_BACKEND == "dynamodb":
+        return DynamoIdempotencyStore(IDEMPOTENCY_TABLE)
+    if IDEMPOTENCY_BACKEND != "memory":
+        raise ValueError(f"Unknown IDEMPOTENCY_BACKEND: {IDEMPOTENCY_BACKEND}")
+    return MemoryIdempotencyStore()
+
+
+store = create_store()
+
+_stats_lock = threading.Lock()
+_stats: Dict = {}
+
+OUTCOMES = ("executed", "stored", "transient", "replayed", "replayed_after_wait", "mismatched", "timed_out", "store_errors")
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.update(keyed=0, replayed_by_path={}, **dict.fromkeys(OUTCOMES, 0))
+
+
+def stats() -> Dict:
+    """Requests carrying a key and what became of them in this process, for /metrics"""
+    with _stats_lock:
+        return {"backend": IDEMPOTENCY_BACKEND, **_stats, "replayed_by_path": dict(_stats["replayed_by_path"])}
+
+
+def _count(name: str, path: Optional[str] = None):
+    with _stats_lock:
+        _stats[name] += 1
+        if path is not None:
+            _stats["replayed_by_path"][path] = _stats["replayed_by_path"].get(path, 0) + 1
+
+
+def _reset_after_fork():
+    reset_stats()
+    if isinstance(store, MemoryIdempotencyStore):
+        store.reset()
+
+
+reset_stats()
+register_after_fork(_reset_after_fork)
+
+
+async def _call(method, *args):
+    if store.blocking:
+        return await run_in_threadpool(method, *args)
+    return method(*args)
+
+
+class IdempotencyMiddleware:
+    """ASGI middleware replaying completed responses for POSTs that repeat an Idempotency-Key"""
+
+    def __init__(self, app, paths: Iterable[str] = IDEMPOTENCY_PATHS):
+        self.app = app
+        self.paths = set(paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http":
+            send = self._strip_transient(send)
+        if scope["type"] != "http" or scope["method"] != "POST" or scope["path"] not in self.paths:
+            await self.app(scope, receive, send)
+            return
+        key = dict(scope.get("headers", [])).get(HEADER)
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+        key = key.decode("latin-1").strip()
+        if not key or len(key) > MAX_KEY_LENGTH:
+            await self._respond(send, 400, {"detail": f"Idempotency-Key must be 1-{MAX_KEY_LENGTH} characters"})
+            return
+
+        _count("keyed")
+        body = await self._read_body(receive)
+        path = scope["path"]
+        scoped_key = f"{personas.current_persona()}:{path}:{key}"
+        request_fingerprint = fingerprint(scope["method"], path, body)
+
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+        while True:
+            try:
+                record = await _call(store.claim, scoped_key, request_fingerprint, time.time())
+            except Exception as e:
+                print(f"Idempotency store unavailable, running the request without it: {e}")
+                _count("store_errors")
+                await self.app(scope, self._replay_body(body, receive), send)
+                return
+            if record is None:
+                break
+            if record["fingerprint"] != request_fingerprint:
+                _count("mismatched")
+                await self._respond(send, 422, {"detail": "Idempotency-Key was already used for a different request"})
+                return
+            if record["state"] == COMPLETED:
+                _count("replayed_after_wait" if waited else "replayed", path)
+                await self._replay(send, record)
+                return
+            # The first request is still running; wait for its result, or for its claim to lapse
+            if time.monotonic() >= deadline:
+                _count("timed_out")
+                await self._respond(send, 409, {"detail": "A request with this Idempotency-Key is still in progress"},
+                                    [(b"retry-after", b"1")])
+                return
+            waited = True
+            await asyncio.sleep(IDEMPOTENCY_POLL_SECONDS)
+
+        _count("executed")
+        await self._run(scope, self._replay_body(body, receive), send, scoped_key)
+
+    async def _run(self, scope, receive, send, scoped_key: str):
+        response: Dict = {"body": []}
+
+        async def capture(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["transient"] = any(k.lower() == TRANSIENT_HEADER for k, _ in message.get("headers", []))
+                response["headers"] = [(k.lower(), v) for k, v in message.get("headers", [])
+                                       if k.lower() not in SKIPPED_HEADERS]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, capture)
+        except BaseException:
+            await self._release(scoped_key)
+            raise
+
+        status = response.get("status", 500)
+        if status >= 500 or status in UNCACHEABLE_STATUSES or response.get("transient"):
+            if response.get("transient"):
+                _count("transient")
+            await self._release(scoped_key)
+            return
+        try:
+            await _call(store.complete, scoped_key, status, response["headers"], b"".join(response["body"]), time.time())
+            _count("stored")
+        except Exception as e:
+            print(f"Idempotent response not stored: {e}")
+            _count("store_errors")
+
+    @staticmethod
+    async def _release(scoped_key: str):
+        try:
+            await _call(store.release, scoped_key)
+        except Exception as e:
+            # The claim lapses after IDEMPOTENCY_LOCK_SECONDS anyway
+            print(f"Idempotency key not released: {e}")
+            _count("store_errors")
+
+    @staticmethod
+    def _strip_transient(send):
+        async def stripped(message):
+            if message["type"] == "http.response.start":
+                headers = message.get("headers", [])
+                if any(k.lower() == TRANSIENT_HEADER for k, _ in headers):
+                    message = dict(message, headers=[(k, v) for k, v in headers if k.lower() != TRANSIENT_HEADER])
+            await send(message)
+
+        return stripped
+
+    @staticmethod
+    async def _read_body(receive) -> bytes:
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                break
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body", False):
+                break
+        return b"".join(chunks)
+
+    @staticmethod
+    def _replay_body(body: bytes, receive):
+        replayed = False
+
+        async def replay():
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        return replay
+
+    @staticmethod
+    async def _replay(send, record: Dict):
+        body = record["body"]
+        headers = list(record["headers"]) + [
+            (b"content-length", str(len(body)).encode()), (REPLAYED_HEADER, b"true"),
+        ]
+        await send({"type": "http.response.start", "status": record["status"], "headers": headers})
+        await send({"type": "http.response.body", "body": body})
+
+    @staticmethod
+    async def _respond(send, status: int, payload: Dict, extra_headers: Optional[List[Tuple[bytes, bytes]]] = None):
+        body = json_codec.dumps(payload)
+        await send({"type": "http.response.start", "status": status, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            *(extra_headers or []),
+        ]})
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,82 @@
+"""
+JSON encoding shared by the API, conversation storage and logging.
+
+Uses orjson when it is installed and the stdlib json module otherwise;
+both produce compact UTF-8 output. Values orjson rejects (non-string
+keys, integers over 64 bits) fall back to the stdlib encoder.
+JSON_BACKEND=json forces the stdlib path, e.g. to compare the two.
+"""
+import json
+import os
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Tuple
+
+from starlette.responses import JSONResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+HAVE_ORJSON = orjson is not None
+JSON_BACKEND = os.getenv("JSON_BACKEND", "orjson" if HAVE_ORJSON else "json").lower()
+
+
+def _default(value):
+    # orjson encodes these natively; match its output on the stdlib path
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _stdlib_dumps(obj: Any, indent: bool = False) -> bytes:
+    return json.dumps(
+        obj, ensure_ascii=False, default=_default,
+        indent=2 if indent else None, separators=None if indent else (",", ":"),
+    ).encode("utf-8")
+
+
+def _stdlib_loads(data):
+    return json.loads(data)
+
+
+def _orjson_dumps(obj: Any, indent: bool = False) -> bytes:
+    try:
+        return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+    except TypeError:
+        return _stdlib_dumps(obj, indent)
+
+
+def _orjson_loads(data):
+    return orjson.loads(data)
+
+
+BACKENDS: Dict[str, Tuple[Callable, Callable]] = {"json": (_stdlib_dumps, _stdlib_loads)}
+if HAVE_ORJSON:
+    BACKENDS["orjson"] = (_orjson_dumps, _orjson_loads)
+
+
+def use_backend(name: str) -> str:
+    """Switch the module-level dumps/loads; falls back to json if orjson is missing"""
+    global dumps, loads
+    if name not in BACKENDS:
+        if name != "orjson":
+            raise ValueError(f"Unknown JSON_BACKEND: {name}")
+        name = "json"
+    dumps, loads = BACKENDS[name]
+    return name
+
+
+JSON_BACKEND = use_backend(JSON_BACKEND)
+
+
+def dumps_str(obj: Any) -> str:
+    """dumps() as text, for log lines and WebSocket text frames"""
+    return dumps(obj).decode("utf-8")
+
+
+class FastJSONResponse(JSONResponse):
+    """Default response class for the app, rendered with json_codec.dumps"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,110 @@
+"""
+Knowledge bundles kept in S3 and refreshed in place.
+
+With KNOWLEDGE_S3_BUCKET set, each persona's files are read from
+s3://KNOWLEDGE_S3_BUCKET/KNOWLEDGE_S3_PREFIX<persona_id>/ instead of the
+package, so editing facts.json, summary.txt, style.txt or linkedin.pdf no
+longer needs a redeploy. Bundles are re-checked at most every
+KNOWLEDGE_REFRESH_SECONDS with conditional GETs (If-None-Match), so an
+unchanged bundle costs one 304 per file; personas.py runs the check in
+the background and swaps in the recompiled prompt when something changed.
+
+Publish a bundle with:
+
+    aws s3 sync ./data s3://$KNOWLEDGE_S3_BUCKET/knowledge/default/ --exclude "personas/*"
+"""
+import os
+import time
+from typing import Dict, Optional, Tuple
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+import context
+from resources import KNOWLEDGE_FILES, parse_knowledge
+
+KNOWLEDGE_S3_BUCKET = os.getenv("KNOWLEDGE_S3_BUCKET", "")
+KNOWLEDGE_S3_PREFIX = os.getenv("KNOWLEDGE_S3_PREFIX", "knowledge/")
+KNOWLEDGE_REFRESH_SECONDS = float(os.getenv("KNOWLEDGE_REFRESH_SECONDS", "60"))
+
+s3_client = None
+if KNOWLEDGE_S3_BUCKET:
+    s3_client = aws_clients.client("s3")
+
+
+class KnowledgeNotFound(LookupError):
+    """Raised when a persona has no bundle in the knowledge bucket"""
+
+
+class Bundle:
+    """A compiled knowledge bundle and the S3 ETags it was built from"""
+
+    __slots__ = ("persona_id", "parts", "files", "etags", "checked_at")
+
+    def __init__(self, persona_id: str, parts: Tuple[str, str], files: Dict[str, Optional[bytes]] = None,
+                 etags: Dict[str, Optional[str]] = None):
+        self.persona_id = persona_id
+        self.parts = parts
+        self.files = files or {}
+        self.etags = etags or {}
+        self.checked_at = time.monotonic()
+
+    def is_stale(self) -> bool:
+        return bool(self.etags) and time.monotonic() - self.checked_at >= KNOWLEDGE_REFRESH_SECONDS
+
+
+def enabled() -> bool:
+    return s3_client is not None
+
+
+def _key(persona_id: str, name: str) -> str:
+    return f"{KNOWLEDGE_S3_PREFIX}{persona_id}/{name}"
+
+
+def _get(persona_id: str, name: str, etag: Optional[str] = None):
+    """(body, etag) for one file; body None if unchanged since etag; (None, None) if missing"""
+    kwargs = {"IfNoneMatch": etag} if etag else {}
+    try:
+        response = s3_client.get_object(Bucket=KNOWLEDGE_S3_BUCKET, Key=_key(persona_id, name), **kwargs)
+    except ClientError as e:
+        if e.response.get("ResponseMetadata", {}).get("HTTPStatusCode") == 304:
+            return None, etag
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None, None
+        raise
+    return response["Body"].read(), response["ETag"]
+
+
+def exists(persona_id: str) -> bool:
+    try:
+        s3_client.head_object(Bucket=KNOWLEDGE_S3_BUCKET, Key=_key(persona_id, "facts.json"))
+        return True
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return False
+        raise
+
+
+def load_bundle(persona_id: str) -> Bundle:
+    """Fetch and compile a persona's bundle from S3"""
+    files, etags = {}, {}
+    for name in KNOWLEDGE_FILES:
+        files[name], etags[name] = _get(persona_id, name)
+    if files["facts.json"] is None:
+        raise KnowledgeNotFound(persona_id)
+    return Bundle(persona_id, context.compile_prompt(parse_knowledge(files)), files, etags)
+
+
+def refresh_bundle(bundle: Bundle) -> Optional[Bundle]:
+    """Conditionally re-fetch a bundle; returns a new Bundle if any file changed, else None"""
+    files, etags, changed = dict(bundle.files), dict(bundle.etags), False
+    for name in KNOWLEDGE_FILES:
+        body, etag = _get(bundle.persona_id, name, bundle.etags.get(name))
+        if etag != bundle.etags.get(name):
+            files[name], etags[name], changed = body, etag, True
+    bundle.checked_at = time.monotonic()
+    if not changed:
+        return None
+    if files["facts.json"] is None:
+        raise KnowledgeNotFound(bundle.persona_id)
+    return Bundle(bundle.persona_id, context.compile_prompt(parse_knowledge(files)), files, etags)
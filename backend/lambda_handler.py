@@ -1,5 +1,260 @@
+import base64
+import json
+import os
+import time
+import uuid
+from collections import OrderedDict
+
+_INIT_STARTED = time.perf_counter()
+
+from botocore.awsrequest import AWSPreparedRequest
+from botocore.exceptions import ClientError
+from fastapi import HTTPException
 from mangum import Mangum
+
+import aws_clients
+import bedrock_regions
+import event_log
+import memory_store
+import json_codec
+import personas
+import server
+import tracing
 from server import app
 
+try:
+    # Present on Lambda runtimes with SnapStart enabled
+    from snapshot_restore_py import register_before_snapshot, register_after_restore
+except ImportError:
+    register_before_snapshot = register_after_restore = None
+
+# Prime clients and connections during the init phase (only inside Lambda by default)
+LAMBDA_PRIME = os.getenv("LAMBDA_PRIME", "true" if os.getenv("AWS_LAMBDA_FUNCTION_NAME") else "false").lower() == "true"
+
+# API Gateway WebSocket: connections whose session state this container keeps in memory
+WS_SESSION_CACHE_SIZE = int(os.getenv("WS_SESSION_CACHE_SIZE", "256"))
+# Streamed text is posted to the connection in chunks of at least this many characters
+WS_FLUSH_CHARS = int(os.getenv("WS_FLUSH_CHARS", "48"))
+
 # Create the Lambda handler
-handler = Mangum(app)
\ No newline at end of file
+asgi_handler = Mangum(app)
+
+_ws_sessions: "OrderedDict[str, server.ChatSession]" = OrderedDict()
+
+_state = {"cold_start": True, "init_ms": None, "prime_ms": {}, "restored": False}
+
+
+def is_warmup_event(event) -> bool:
+    """Scheduled keep-warm pings: EventBridge schedules or an explicit {"warmup": true} payload"""
+    if not isinstance(event, dict):
+        return False
+    return bool(
+        event.get("warmup")
+        or event.get("source") in ("aws.events", "serverless-plugin-warmup")
+        or event.get("detail-type") == "Scheduled Event"
+    )
+
+
+def is_websocket_event(event) -> bool:
+    """API Gateway WebSocket route events ($connect, $disconnect and messages)"""
+    if not isinstance(event, dict):
+        return False
+    return event.get("requestContext", {}).get("eventType") in ("CONNECT", "MESSAGE", "DISCONNECT")
+
+
+def _management_client(request_context):
+    endpoint = f"https://{request_context['domainName']}/{request_context['stage']}"
+    return aws_clients.client("apigatewaymanagementapi", endpoint_url=endpoint)
+
+
+class ConnectionWriter:
+    """Post JSON frames back to a WebSocket connection, batching streamed text"""
+
+    def __init__(self, client, connection_id: str):
+        self.client = client
+        self.connection_id = connection_id
+        self.pending = []
+        self.pending_chars = 0
+        self.gone = False
+
+    def send(self, frame: dict):
+        if self.gone:
+            return
+        try:
+            self.client.post_to_connection(ConnectionId=self.connection_id, Data=json_codec.dumps(frame))
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "GoneException":
+                raise
+            # Visitor left mid-turn; keep going so the turn is still saved
+            self.gone = True
+
+    def delta(self, text: str):
+        self.pending.append(text)
+        self.pending_chars += len(text)
+        if self.pending_chars >= WS_FLUSH_CHARS:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.send({"type": "token", "text": "".join(self.pending)})
+            self.pending, self.pending_chars = [], 0
+
+
+def _connection_session(connection_id: str, session_id=None, persona_id=None):
+    """The connection's cached ChatSession, replaced if the client names another session or persona"""
+    session = _ws_sessions.get(connection_id)
+    persona_id = persona_id or (session.persona_id if session is not None else personas.DEFAULT_PERSONA)
+    if session is None or session.persona_id != persona_id or (session_id and session.session_id != session_id):
+        session = server.ChatSession(session_id or str(uuid.uuid4()), persona_id)
+        _ws_sessions[connection_id] = session
+    _ws_sessions.move_to_end(connection_id)
+    while len(_ws_sessions) > WS_SESSION_CACHE_SIZE:
+        _ws_sessions.popitem(last=False)
+    return session
+
+
+def handle_websocket_event(event) -> dict:
+    """
+    Same protocol as /ws/chat, over API Gateway WebSocket routes.
+
+    Messages on one connection may reach different containers, so every
+    frame can carry session_id (and persona); a container that has served the connection
+    before reuses its in-memory history.
+    """
+    request_context = event["requestContext"]
+    connection_id = request_context["connectionId"]
+    event_type = request_context["eventType"]
+
+    if event_type == "CONNECT":
+        headers = {k.lower(): v for k, v in (event.get("headers") or {}).items()}
+        if headers.get("origin") is not None and headers["origin"] not in server.origins:
+            return {"statusCode": 403}
+        params = event.get("queryStringParameters") or {}
+        if params.get("persona") and not personas.is_known(params["persona"]):
+            return {"statusCode": 404}
+        if params.get("session_id") or params.get("persona"):
+            _connection_session(connection_id, params.get("session_id"), params.get("persona"))
+        return {"statusCode": 200}
+
+    if event_type == "DISCONNECT":
+        _ws_sessions.pop(connection_id, None)
+        return {"statusCode": 200}
+
+    writer = ConnectionWriter(_management_client(request_context), connection_id)
+    body = event.get("body") or ""
+    if event.get("isBase64Encoded"):
+        body = base64.b64decode(body).decode("utf-8")
+    try:
+        frame = json_codec.loads(body)
+        message = frame.get("message") if isinstance(frame, dict) else None
+    except ValueError:
+        frame, message = {}, None
+    if not isinstance(message, str) or not message.strip():
+        writer.send({"type": "error", "status": 400, "detail": 'Expected {"message": "..."}'})
+        return {"statusCode": 200}
+
+    persona_id = frame.get("persona")
+    if persona_id is not None and not personas.is_known(persona_id):
+        writer.send({"type": "error", "status": 404, "detail": "Unknown persona"})
+        return {"statusCode": 200}
+
+    known = connection_id in _ws_sessions
+    session = _connection_session(connection_id, frame.get("session_id"), persona_id)
+    session.client_ip = request_context.get("identity", {}).get("sourceIp")
+    with tracing.start_span("WEBSOCKET MESSAGE", tracing.KIND_SERVER, **{"session.cached": known}):
+        try:
+            if session.conversation is None:
+                session.load()
+                writer.send({"type": "session", "session_id": session.session_id,
+                             "messages": len(session.conversation)})
+            response = session.run_turn(message, writer.delta)
+            writer.flush()
+            writer.send({"type": "done", "session_id": session.session_id, "response": response})
+        except HTTPException as e:
+            writer.send({"type": "error", "status": e.status_code, "detail": e.detail})
+        except Exception as e:
+            print(f"Error in websocket message: {str(e)} {json_codec.dumps_str(tracing.log_context())}")
+            writer.send({"type": "error", "status": 500, "detail": "Internal server error"})
+    return {"statusCode": 200}
+
+
+def _open_connection(client):
+    """Complete DNS and the TLS handshake to a client's endpoint so the pool holds a live connection"""
+    request = AWSPreparedRequest(
+        method="HEAD", url=client.meta.endpoint_url, headers={}, body=None, stream_output=False
+    )
+    # Unsigned, so the service answers 4xx, but the connection stays in the pool
+    client._endpoint.http_session.send(request)
+
+
+def _timed(name: str, work):
+    started = time.perf_counter()
+    try:
+        work()
+    except Exception as e:
+        print(f"Priming step {name} failed: {e}")
+    _state["prime_ms"][name] = round((time.perf_counter() - started) * 1000, 2)
+
+
+def prime(connections: bool = True):
+    """Eager init-phase work so the first real request doesn't pay for it"""
+    # The current persona's prompt; with KNOWLEDGE_S3_BUCKET this also fetches the bundle
+    _timed("prompt", personas.prompt)
+    if not connections:
+        return
+    _timed("bedrock_connection", lambda: _open_connection(server.bedrock_client))
+    for region in bedrock_regions.BEDROCK_REGIONS if server.bedrock_router else []:
+        client = aws_clients.client("bedrock-runtime", region_name=region)
+        _timed(f"bedrock_connection_{region}", lambda: _open_connection(client))
+    if memory_store.USE_S3:
+        _timed("s3_connection", lambda: memory_store.s3_client.head_bucket(Bucket=memory_store.S3_BUCKET))
+
+
+def _before_snapshot():
+    # Sockets don't survive a snapshot restore, so snapshot only the warm Python state
+    prime(connections=False)
+    aws_clients.close_connections()
+
+
+def _after_restore():
+    _state["restored"] = True
+    _state["prime_ms"] = {}
+    prime()
+
+
+if LAMBDA_PRIME:
+    prime()
+if register_before_snapshot is not None:
+    register_before_snapshot(_before_snapshot)
+    register_after_restore(_after_restore)
+
+_state["init_ms"] = round((time.perf_counter() - _INIT_STARTED) * 1000, 2)
+
+
+def handler(event, context):
+    started = time.perf_counter()
+    cold_start = _state["cold_start"]
+    _state["cold_start"] = False
+
+    if is_warmup_event(event):
+        response = {"warmed": True, "cold_start": cold_start}
+    elif is_websocket_event(event):
+        response = handle_websocket_event(event)
+        tracing.flush()
+        event_log.flush()
+    else:
+        response = asgi_handler(event, context)
+        # The sandbox may freeze after returning, so don't leave spans buffered
+        tracing.flush()
+        event_log.flush()
+
+    if cold_start:
+        print(json.dumps({
+            "type": "lambda_timing",
+            "init_ms": _state["init_ms"],
+            "prime_ms": _state["prime_ms"],
+            "restored_from_snapshot": _state["restored"],
+            "first_invoke_ms": round((time.perf_counter() - started) * 1000, 2),
+            "first_event": "warmup" if is_warmup_event(event) else "websocket" if is_websocket_event(event) else "request",
+        }))
+    return response
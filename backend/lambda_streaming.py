@@ -0,0 +1,312 @@
+"""
+Lambda response streaming for function URLs (invoke mode RESPONSE_STREAM).
+
+Mangum turns an invocation into one buffered response, so a streaming
+route such as /chat/stream would still reach the browser all at once.
+The managed Python runtime can't stream responses, so this module is its
+own runtime client: lambda_streaming_bootstrap (set as
+AWS_LAMBDA_EXEC_WRAPPER) starts `python -m lambda_streaming` in place of
+the managed one, and serve() polls the Lambda Runtime API itself.
+
+    function URL, LAMBDA_STREAMING_PATHS   the app runs as ASGI and each
+                                           body chunk is written to the
+                                           response stream as it's sent
+    function URL, any other path           lambda_handler.handler (Mangum),
+                                           written to the stream in one go
+    everything else (API Gateway,          lambda_handler.handler, answered
+    WebSocket, warm-up pings)              as a normal buffered response
+
+Streamed responses use the function URL HTTP integration format: a JSON
+prelude with statusCode, headers and cookies, eight NUL bytes, then the
+body. SnapStart hooks only run under the managed runtime client, so don't
+combine the two.
+
+simulate_streaming.py runs this loop locally against a simulated Runtime
+API and function URL.
+"""
+import asyncio
+import base64
+import http.client
+import os
+import sys
+import time
+import traceback
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import unquote
+
+import json_codec
+
+LAMBDA_STREAMING_PATHS = [
+    path.strip() for path in os.getenv("LAMBDA_STREAMING_PATHS", "/chat/stream").split(",") if path.strip()
+]
+
+RUNTIME_API_VERSION = "2018-06-01"
+HTTP_INTEGRATION_CONTENT_TYPE = "application/vnd.awslambda.http-integration-response"
+PRELUDE_DELIMITER = b"\0" * 8
+
+Writer = Callable[[bytes], None]
+
+
+def is_function_url_event(event) -> bool:
+    """Invocations through a Lambda function URL (payload format 2.0 on a *.lambda-url.* domain)"""
+    if not isinstance(event, dict):
+        return False
+    request_context = event.get("requestContext") or {}
+    return "http" in request_context and ".lambda-url." in request_context.get("domainName", "")
+
+
+def is_streaming_route(event) -> bool:
+    import personas
+
+    # Match the route the app will see, after any /personas/<id> prefix
+    _, path = personas.resolve(event.get("rawPath", "/"), "")
+    return path in LAMBDA_STREAMING_PATHS
+
+
+def prelude(status: int, headers: Iterable[Tuple[str, str]]) -> bytes:
+    """Status, headers and cookies of a streamed function URL response, up to and including the delimiter"""
+    folded: Dict[str, str] = {}
+    cookies: List[str] = []
+    for name, value in headers:
+        name = name.lower()
+        if name == "set-cookie":
+            cookies.append(value)
+        else:
+            folded[name] = f"{folded[name]}, {value}" if name in folded else value
+    return json_codec.dumps({"statusCode": status, "headers": folded, "cookies": cookies}) + PRELUDE_DELIMITER
+
+
+def asgi_scope(event: Dict, context) -> Dict:
+    http = event["requestContext"]["http"]
+    event_headers = event.get("headers") or {}
+    headers = [(name.lower().encode("latin-1"), value.encode("utf-8")) for name, value in event_headers.items()]
+    if event.get("cookies"):
+        headers.append((b"cookie", "; ".join(event["cookies"]).encode("utf-8")))
+    raw_path = event.get("rawPath", "/")
+    return {
+        "type": "http",
+        "asgi": {"version": "3.0", "spec_version": "2.3"},
+        "http_version": "1.1",
+        "method": http["method"],
+        "scheme": "https",
+        "path": unquote(raw_path),
+        "raw_path": raw_path.encode("utf-8"),
+        "root_path": "",
+        "query_string": event.get("rawQueryString", "").encode("utf-8"),
+        "headers": headers,
+        "client": (http.get("sourceIp", ""), 0),
+        "server": (event_headers.get("host", event["requestContext"]["domainName"]), 443),
+        "aws.event": event,
+        "aws.context": context,
+    }
+
+
+def request_body(event: Dict) -> bytes:
+    body = event.get("body") or ""
+    return base64.b64decode(body) if event.get("isBase64Encoded") else body.encode("utf-8")
+
+
+async def stream_asgi(app, event: Dict, context, write: Writer):
+    """Run one function URL request through the ASGI app, writing each body chunk as the app sends it"""
+    body = request_body(event)
+    finished = asyncio.Event()
+    request_sent = False
+    started: Dict = {}
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        # Streaming responses watch for a disconnect; there is none until the response is over
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            started["status"] = message["status"]
+            started["headers"] = [
+                (name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])
+            ]
+        elif message["type"] == "http.response.body":
+            if not started.get("sent"):
+                write(prelude(started["status"], started["headers"]))
+                started["sent"] = True
+            chunk = message.get("body", b"")
+            if chunk:
+                write(chunk)
+            if not message.get("more_body", False):
+                finished.set()
+
+    try:
+        await app(asgi_scope(event, context), receive, send)
+    finally:
+        finished.set()
+    if not started.get("sent"):
+        write(prelude(started.get("status", 500), started.get("headers", [])))
+
+
+def write_buffered(response: Dict, write: Writer):
+    """Write a Mangum (payload format 2.0) response to the stream in one go"""
+    headers = list((response.get("headers") or {}).items())
+    headers += [("set-cookie", cookie) for cookie in response.get("cookies") or []]
+    write(prelude(response.get("statusCode", 200), headers))
+    body = response.get("body") or ""
+    if body:
+        write(base64.b64decode(body) if response.get("isBase64Encoded") else body.encode("utf-8"))
+
+
+def handle_function_url(event: Dict, context, write: Writer):
+    import lambda_handler
+
+    if is_streaming_route(event):
+        asyncio.get_event_loop().run_until_complete(stream_asgi(lambda_handler.app, event, context, write))
+    else:
+        write_buffered(lambda_handler.handler(event, context), write)
+
+
+class LambdaContext:
+    """The parts of the managed runtime's context object handlers use"""
+
+    def __init__(self, request_id: str, deadline_ms: int, invoked_function_arn: str):
+        self.aws_request_id = request_id
+        self.invoked_function_arn = invoked_function_arn
+        self.function_name = os.getenv("AWS_LAMBDA_FUNCTION_NAME", "")
+        self.function_version = os.getenv("AWS_LAMBDA_FUNCTION_VERSION", "$LATEST")
+        self.memory_limit_in_mb = os.getenv("AWS_LAMBDA_FUNCTION_MEMORY_SIZE", "")
+        self.log_group_name = os.getenv("AWS_LAMBDA_LOG_GROUP_NAME", "")
+        self.log_stream_name = os.getenv("AWS_LAMBDA_LOG_STREAM_NAME", "")
+        self._deadline_ms = deadline_ms
+
+    def get_remaining_time_in_millis(self) -> int:
+        return max(0, self._deadline_ms - int(time.time() * 1000))
+
+
+def error_payload(e: BaseException) -> Dict:
+    return {
+        "errorMessage": str(e),
+        "errorType": type(e).__name__,
+        "stackTrace": traceback.format_exception(type(e), e, e.__traceback__),
+    }
+
+
+class ResponseStream:
+    """A streamed invocation response: a chunked POST to the Runtime API, written as the app produces it"""
+
+    def __init__(self, connection: http.client.HTTPConnection, path: str):
+        self.connection = connection
+        connection.putrequest("POST", path, skip_accept_encoding=True)
+        connection.putheader("Lambda-Runtime-Function-Response-Mode", "streaming")
+        connection.putheader("Content-Type", HTTP_INTEGRATION_CONTENT_TYPE)
+        connection.putheader("Transfer-Encoding", "chunked")
+        connection.putheader("Trailer", "Lambda-Runtime-Function-Error-Type, Lambda-Runtime-Function-Error-Body")
+        connection.endheaders()
+
+    def write(self, data: bytes):
+        if data:
+            self.connection.send(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+
+    def close(self, error: Optional[BaseException] = None):
+        trailers = b""
+        if error is not None:
+            # Headers are long gone, so a failure mid-stream is reported in the trailers
+            payload = base64.b64encode(json_codec.dumps(error_payload(error))).decode("ascii")
+            trailers = (f"Lambda-Runtime-Function-Error-Type: {type(error).__name__}\r\n"
+                        f"Lambda-Runtime-Function-Error-Body: {payload}\r\n").encode("ascii")
+        self.connection.send(b"0\r\n" + trailers + b"\r\n")
+        self.connection.getresponse().read()
+
+
+class RuntimeClient:
+    """Minimal client for the Lambda Runtime API at AWS_LAMBDA_RUNTIME_API"""
+
+    def __init__(self, address: str):
+        self.address = address
+        self.reconnect()
+
+    def reconnect(self):
+        self.connection = http.client.HTTPConnection(self.address, timeout=None)
+
+    def _post(self, path: str, body: bytes, headers: Optional[Dict[str, str]] = None):
+        self.connection.request("POST", f"/{RUNTIME_API_VERSION}/runtime/{path}", body=body, headers=headers or {})
+        self.connection.getresponse().read()
+
+    def next(self) -> Tuple[str, Dict, LambdaContext]:
+        """Block until the next invocation; returns (request id, event, context)"""
+        self.connection.request("GET", f"/{RUNTIME_API_VERSION}/runtime/invocation/next")
+        response = self.connection.getresponse()
+        event = json_codec.loads(response.read())
+        request_id = response.getheader("Lambda-Runtime-Aws-Request-Id")
+        trace_id = response.getheader("Lambda-Runtime-Trace-Id")
+        if trace_id:
+            os.environ["_X_AMZN_TRACE_ID"] = trace_id
+        else:
+            os.environ.pop("_X_AMZN_TRACE_ID", None)
+        context = LambdaContext(
+            request_id,
+            int(response.getheader("Lambda-Runtime-Deadline-Ms") or 0),
+            response.getheader("Lambda-Runtime-Invoked-Function-Arn") or "",
+        )
+        return request_id, event, context
+
+    def respond(self, request_id: str, result):
+        self._post(f"invocation/{request_id}/response", json_codec.dumps(result))
+
+    def stream(self, request_id: str) -> ResponseStream:
+        return ResponseStream(self.connection, f"/{RUNTIME_API_VERSION}/runtime/invocation/{request_id}/response")
+
+    def error(self, request_id: str, e: BaseException):
+        self._post(f"invocation/{request_id}/error", json_codec.dumps(error_payload(e)),
+                   {"Lambda-Runtime-Function-Error-Type": type(e).__name__})
+
+    def init_error(self, e: BaseException):
+        self._post("init/error", json_codec.dumps(error_payload(e)),
+                   {"Lambda-Runtime-Function-Error-Type": type(e).__name__})
+
+
+def serve(address: Optional[str] = None):
+    """Process invocations forever, streaming function URL responses"""
+    runtime = RuntimeClient(address or os.environ["AWS_LAMBDA_RUNTIME_API"])
+    # One loop for every invocation, shared with Mangum, which runs on the thread's current loop
+    asyncio.set_event_loop(asyncio.new_event_loop())
+    try:
+        import event_log
+        import lambda_handler
+        import tracing
+    except Exception as e:
+        runtime.init_error(e)
+        raise
+
+    while True:
+        request_id, event, context = runtime.next()
+        if not is_function_url_event(event):
+            try:
+                result = lambda_handler.handler(event, context)
+            except Exception as e:
+                traceback.print_exc()
+                runtime.error(request_id, e)
+            else:
+                runtime.respond(request_id, result)
+            continue
+
+        stream = runtime.stream(request_id)
+        error = None
+        try:
+            handle_function_url(event, context, stream.write)
+        except Exception as e:
+            traceback.print_exc()
+            error = e
+        try:
+            stream.close(error)
+        except OSError as e:
+            print(f"Response stream for {request_id} broke: {e}")
+            runtime.reconnect()
+        # After the response is complete, so the visitor doesn't wait on it; the sandbox
+        # may freeze before the next invocation, so nothing can stay buffered
+        tracing.flush()
+        event_log.flush()
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    serve()
@@ -0,0 +1,29 @@
+"""
+Process lifecycle hooks shared by the API, the pre-fork server and Lambda.
+
+Modules holding per-process state register a reset with register_after_fork
+so every worker starts clean, and anything that buffers work registers a
+flush with register_shutdown_hook so it runs during graceful shutdown.
+"""
+import os
+from typing import Callable, List
+
+_shutdown_hooks: List[Callable[[], None]] = []
+
+
+def register_after_fork(hook: Callable[[], None]):
+    """Run hook in every child process created with os.fork"""
+    os.register_at_fork(after_in_child=hook)
+
+
+def register_shutdown_hook(hook: Callable[[], None]):
+    """Run hook when the app shuts down, after in-flight requests have drained"""
+    _shutdown_hooks.append(hook)
+
+
+def run_shutdown_hooks():
+    for hook in reversed(_shutdown_hooks):
+        try:
+            hook()
+        except Exception as e:
+            print(f"Shutdown hook {getattr(hook, '__name__', hook)} failed: {e}")
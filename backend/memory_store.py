@@ -0,0 +1,420 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+from lifecycle import register_after_fork
+from conversation_codec import (
+    encode_conversation,
+    decode_conversation,
+    is_compact,
+    COMPACT_CONTENT_TYPE,
+    LEGACY_CONTENT_TYPE,
+)
+
+# Memory storage configuration
+USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+MEMORY_DIR = os.getenv("MEMORY_DIR", "../memory")
+# "sharded" spreads sessions over sessions/ab/cd/ prefixes; "flat" is the original layout
+MEMORY_LAYOUT = os.getenv("MEMORY_LAYOUT", "sharded").lower()
+SESSION_TTL_DAYS = int(os.getenv("SESSION_TTL_DAYS", "30"))
+
+# Initialize S3 client if needed
+s3_client = None
+if USE_S3:
+    s3_client = aws_clients.client("s3")
+
+SESSION_PREFIX = "sessions/"
+SESSION_SUFFIX = ".json"
+# S3 user metadata holding the epoch second of the last write
+LAST_ACTIVITY_METADATA = "last-activity"
+
+# Per-session locks for this process: session_id -> [lock, waiters]
+_session_locks: Dict[str, list] = {}
+_session_locks_guard = threading.Lock()
+# Used instead of file locks where fcntl is unavailable
+_fallback_write_lock = threading.Lock()
+
+
+# Memory management functions
+def get_legacy_memory_path(session_id: str) -> str:
+    """Flat key used before sessions were sharded"""
+    return f"{session_id}{SESSION_SUFFIX}"
+
+
+def get_memory_path(session_id: str) -> str:
+    if MEMORY_LAYOUT == "flat":
+        return get_legacy_memory_path(session_id)
+    digest = hashlib.sha256(session_id.encode("utf-8")).hexdigest()
+    return f"{SESSION_PREFIX}{digest[:2]}/{digest[2:4]}/{session_id}{SESSION_SUFFIX}"
+
+
+class ConversationConflict(Exception):
+    """Raised when a conditional save finds the session changed since it was loaded"""
+
+
+# Sentinel for save_conversation: write unconditionally
+ANY_VERSION = object()
+
+
+def _local_version(stat: os.stat_result) -> str:
+    # Every write renames a fresh file into place, so the inode changes too
+    return f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+
+@contextmanager
+def _local_write_lock(file_path: str):
+    """Cross-process lock for a shard directory, held while checking and replacing a file"""
+    directory = os.path.dirname(file_path)
+    os.makedirs(directory, exist_ok=True)
+    if fcntl is None:
+        with _fallback_write_lock:
+            yield
+        return
+    with open(os.path.join(directory, ".lock"), "a") as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _read_key(key: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """Stored bytes and their version, or (None, None) if the key doesn't exist"""
+    if USE_S3:
+        try:
+            response = s3_client.get_object(Bucket=S3_BUCKET, Key=key)
+            return response["Body"].read(), response["ETag"].strip('"')
+        except ClientError as e:
+            if e.response["Error"]["Code"] == "NoSuchKey":
+                return None, None
+            raise
+    else:
+        # Local file storage
+        try:
+            with open(os.path.join(MEMORY_DIR, key), "rb") as f:
+                return f.read(), _local_version(os.fstat(f.fileno()))
+        except FileNotFoundError:
+            return None, None
+
+
+def _write_key(key: str, body: bytes, content_type: str, expected_version=ANY_VERSION) -> str:
+    """
+    Store bytes under key and return the new version.
+
+    expected_version makes the write conditional: None means the key must
+    not exist yet, a version string means it must still be at that version.
+    ConversationConflict is raised otherwise.
+    """
+    if USE_S3:
+        conditions = {}
+        if expected_version is None:
+            conditions["IfNoneMatch"] = "*"
+        elif expected_version is not ANY_VERSION:
+            conditions["IfMatch"] = f'"{expected_version}"'
+        try:
+            response = s3_client.put_object(
+                Bucket=S3_BUCKET,
+                Key=key,
+                Body=body,
+                ContentType=content_type,
+                Metadata={LAST_ACTIVITY_METADATA: str(int(time.time()))},
+                **conditions,
+            )
+        except ClientError as e:
+            # 412: the object changed; 409: a concurrent conditional write won the race
+            if e.response["Error"]["Code"] in ("PreconditionFailed", "ConditionalRequestConflict"):
+                raise ConversationConflict(key) from e
+            raise
+        return response["ETag"].strip('"')
+    else:
+        # Local file storage, replaced atomically so readers never see a partial write.
+        # The file's mtime doubles as the session's last-activity timestamp.
+        file_path = os.path.join(MEMORY_DIR, key)
+        with _local_write_lock(file_path):
+            if expected_version is not ANY_VERSION:
+                try:
+                    current_version = _local_version(os.stat(file_path))
+                except FileNotFoundError:
+                    current_version = None
+                if current_version != expected_version:
+                    raise ConversationConflict(key)
+            tmp_path = f"{file_path}.{uuid.uuid4().hex}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(body)
+            os.replace(tmp_path, file_path)
+            return _local_version(os.stat(file_path))
+
+
+def _delete_key(key: str):
+    if USE_S3:
+        s3_client.delete_object(Bucket=S3_BUCKET, Key=key)
+    else:
+        try:
+            os.remove(os.path.join(MEMORY_DIR, key))
+        except FileNotFoundError:
+            pass
+
+
+def read_session_versioned(session_id: str) -> Tuple[Optional[bytes], Optional[str]]:
+    """Raw stored bytes for a session and their version, or (None, None) if it doesn't exist"""
+    key = get_memory_path(session_id)
+    data, version = _read_key(key)
+    legacy_key = get_legacy_memory_path(session_id)
+    if data is not None or key == legacy_key:
+        return data, version
+
+    # Migrate sessions written under the flat layout the first time they are read
+    data, _ = _read_key(legacy_key)
+    if data is not None:
+        try:
+            version = _write_key(key, data, content_type_for(data), expected_version=None)
+        except ConversationConflict:
+            # Another request migrated it first
+            return _read_key(key)
+        _delete_key(legacy_key)
+    return data, version
+
+
+def read_session_bytes(session_id: str) -> Optional[bytes]:
+    """Raw stored bytes for a session, or None if it doesn't exist"""
+    return read_session_versioned(session_id)[0]
+
+
+def write_session_bytes(session_id: str, body: bytes, content_type: str, expected_version=ANY_VERSION) -> str:
+    """Store raw bytes for a session and return the new version"""
+    return _write_key(get_memory_path(session_id), body, content_type, expected_version)
+
+
+def content_type_for(data: bytes) -> str:
+    return COMPACT_CONTENT_TYPE if is_compact(data) else LEGACY_CONTENT_TYPE
+
+
+# Memory functions
+def load_conversation_versioned(session_id: str) -> Tuple[List[Dict], Optional[str]]:
+    """Load conversation history and the version it was read at (None if new)"""
+    data, version = read_session_versioned(session_id)
+    if data is None:
+        return [], None
+    return decode_conversation(data), version
+
+
+def load_conversation(session_id: str) -> List[Dict]:
+    """Load conversation history from storage"""
+    return load_conversation_versioned(session_id)[0]
+
+
+def save_conversation(session_id: str, messages: List[Dict], expected_version=ANY_VERSION) -> str:
+    """
+    Save conversation history to storage and return the new version.
+
+    Pass the version from load_conversation_versioned (None for a new
+    session) to raise ConversationConflict instead of overwriting a
+    concurrent update.
+    """
+    body, content_type = encode_conversation(messages)
+    return write_session_bytes(session_id, body, content_type, expected_version)
+
+
+def append_conversation(session_id: str, conversation: List[Dict], new_messages: List[Dict],
+                        version: Optional[str], max_attempts: int = 5) -> Tuple[List[Dict], str]:
+    """
+    Append new_messages to a conversation loaded at version.
+
+    If another request saved the session in the meantime, its turns are
+    kept and ours are appended after them, instead of overwriting them.
+    Returns the conversation as saved and its new version.
+    """
+    for _ in range(max_attempts):
+        try:
+            saved = conversation + new_messages
+            return saved, save_conversation(session_id, saved, expected_version=version)
+        except ConversationConflict:
+            print(f"Conversation {session_id} changed concurrently, merging turns")
+            conversation, version = load_conversation_versioned(session_id)
+    raise ConversationConflict(f"Gave up saving {session_id} after {max_attempts} conflicting writes")
+
+
+@contextmanager
+def session_lock(session_id: str):
+    """
+    Serialize turns for one session within this process.
+
+    Concurrent requests for the same session (double submits, several tabs)
+    then queue up here instead of racing to a storage conflict.
+    """
+    with _session_locks_guard:
+        entry = _session_locks.get(session_id)
+        if entry is None:
+            entry = _session_locks[session_id] = [threading.Lock(), 0]
+        entry[1] += 1
+    try:
+        with entry[0]:
+            yield
+    finally:
+        with _session_locks_guard:
+            entry[1] -= 1
+            if entry[1] == 0:
+                del _session_locks[session_id]
+
+
+def _reset_session_locks():
+    global _session_locks_guard, _fallback_write_lock
+    _session_locks.clear()
+    _session_locks_guard = threading.Lock()
+    _fallback_write_lock = threading.Lock()
+
+
+register_after_fork(_reset_session_locks)
+
+
+def _stat_key(key: str) -> Optional[Dict]:
+    """Version and last-activity time of a stored key, or None if it doesn't exist"""
+    if USE_S3:
+        try:
+            response = s3_client.head_object(Bucket=S3_BUCKET, Key=key)
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+        last_activity = response.get("Metadata", {}).get(LAST_ACTIVITY_METADATA)
+        return {
+            "version": response["ETag"].strip('"'),
+            "last_activity": float(last_activity) if last_activity else response["LastModified"].timestamp(),
+        }
+    else:
+        try:
+            stat = os.stat(os.path.join(MEMORY_DIR, key))
+        except FileNotFoundError:
+            return None
+        return {"version": _local_version(stat), "last_activity": stat.st_mtime}
+
+
+def _stat_session(session_id: str) -> Optional[Dict]:
+    key = get_memory_path(session_id)
+    info = _stat_key(key)
+    if info is None and key != get_legacy_memory_path(session_id):
+        info = _stat_key(get_legacy_memory_path(session_id))
+    return info
+
+
+def get_conversation_version(session_id: str) -> Optional[str]:
+    """Cheap version token for a stored conversation, or None if it doesn't exist"""
+    info = _stat_session(session_id)
+    return info["version"] if info else None
+
+
+def get_last_activity(session_id: str) -> Optional[float]:
+    """Epoch seconds of the last write to a session, or None if it doesn't exist"""
+    info = _stat_session(session_id)
+    return info["last_activity"] if info else None
+
+
+def iter_session_keys() -> Iterator[Dict]:
+    """
+    Yield {"session_id", "key", "last_activity"} for every stored session,
+    in both the sharded and the legacy flat layout.
+    """
+    if USE_S3:
+        paginator = s3_client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=S3_BUCKET):
+            for obj in page.get("Contents", []):
+                key = obj["Key"]
+                if not key.endswith(SESSION_SUFFIX):
+                    continue
+                if "/" in key and not key.startswith(SESSION_PREFIX):
+                    continue
+                yield {
+                    "session_id": key.rsplit("/", 1)[-1][:-len(SESSION_SUFFIX)],
+                    "key": key,
+                    "last_activity": obj["LastModified"].timestamp(),
+                }
+    else:
+        if not os.path.isdir(MEMORY_DIR):
+            return
+        for root, dirs, files in os.walk(MEMORY_DIR):
+            rel_root = os.path.relpath(root, MEMORY_DIR)
+            if rel_root == ".":
+                # Only descend into the sharded tree from the top level
+                dirs[:] = [d for d in dirs if d == SESSION_PREFIX.rstrip("/")]
+            for name in files:
+                if not name.endswith(SESSION_SUFFIX):
+                    continue
+                key = name if rel_root == "." else f"{rel_root.replace(os.sep, '/')}/{name}"
+                try:
+                    last_activity = os.stat(os.path.join(root, name)).st_mtime
+                except FileNotFoundError:
+                    continue
+                yield {"session_id": name[:-len(SESSION_SUFFIX)], "key": key, "last_activity": last_activity}
+
+
+def iter_session_ids() -> Iterator[str]:
+    """Yield the id of every stored session"""
+    for entry in iter_session_keys():
+        yield entry["session_id"]
+
+
+def expire_sessions(ttl_days: int = SESSION_TTL_DAYS, dry_run: bool = False) -> Dict:
+    """Delete sessions idle for longer than ttl_days and stale temp files"""
+    cutoff = time.time() - ttl_days * 86400
+    expired = kept = 0
+    for entry in iter_session_keys():
+        if entry["last_activity"] >= cutoff:
+            kept += 1
+            continue
+        if not dry_run:
+            _delete_key(entry["key"])
+        expired += 1
+
+    temp_files = 0
+    if not USE_S3 and os.path.isdir(MEMORY_DIR):
+        # Leftovers from writers that died between write and rename
+        for root, _, files in os.walk(MEMORY_DIR):
+            for name in files:
+                if not name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime >= time.time() - 3600:
+                        continue
+                    if not dry_run:
+                        os.remove(path)
+                except FileNotFoundError:
+                    continue
+                temp_files += 1
+
+    return {"expired": expired, "kept": kept, "temp_files": temp_files}
+
+
+def configure_s3_lifecycle(ttl_days: int = SESSION_TTL_DAYS) -> Dict:
+    """Expire idle session objects with an S3 lifecycle rule on the sessions/ prefix"""
+    rule = {
+        "ID": "expire-idle-sessions",
+        "Filter": {"Prefix": SESSION_PREFIX},
+        "Status": "Enabled",
+        "Expiration": {"Days": ttl_days},
+        "AbortIncompleteMultipartUpload": {"DaysAfterInitiation": 1},
+    }
+    try:
+        rules = s3_client.get_bucket_lifecycle_configuration(Bucket=S3_BUCKET)["Rules"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchLifecycleConfiguration":
+            raise
+        rules = []
+
+    # Replace our rule and keep any others on the bucket
+    rules = [r for r in rules if r.get("ID") != rule["ID"]] + [rule]
+    s3_client.put_bucket_lifecycle_configuration(Bucket=S3_BUCKET, LifecycleConfiguration={"Rules": rules})
+    return rule
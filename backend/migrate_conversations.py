@@ -0,0 +1,87 @@
+"""
+Rewrite stored conversations in the compact (or legacy) at-rest format.
+
+    uv run migrate_conversations.py                  # legacy -> compact
+    uv run migrate_conversations.py --dry-run        # report sizes only
+    uv run migrate_conversations.py --to legacy      # roll back
+
+Uses the same USE_S3 / S3_BUCKET / MEMORY_DIR settings as the server.
+"""
+import argparse
+
+from dotenv import load_dotenv
+
+load_dotenv(override=True)
+
+import memory_store
+from conversation_codec import decode_conversation, encode_conversation, is_compact
+from memory_store import ConversationConflict
+
+# Re-reads of a session that keeps changing under us before it's left for the next run
+MAX_ATTEMPTS = 5
+
+
+def migrate_session(session_id: str, to: str, recompress: bool, dry_run: bool):
+    """
+    Rewrite one session, returning (outcome, bytes before, bytes after).
+
+    The write is conditional on the version read, so a chat turn saved
+    while we re-encode isn't lost; the session is read again and retried.
+    """
+    for _ in range(MAX_ATTEMPTS):
+        data, version = memory_store.read_session_versioned(session_id)
+        if data is None:
+            return "missing", 0, 0
+        if is_compact(data) == (to == "compact") and not recompress:
+            return "skipped", 0, 0
+        body, content_type = encode_conversation(decode_conversation(data), to)
+        if dry_run:
+            return "migrated", len(data), len(body)
+        try:
+            memory_store.write_session_bytes(session_id, body, content_type, expected_version=version)
+        except ConversationConflict:
+            print(f"↻ {session_id} changed during migration, retrying")
+            continue
+        return "migrated", len(data), len(body)
+    return "conflicted", 0, 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate stored conversations between formats")
+    parser.add_argument("--to", choices=["compact", "legacy"], default="compact", help="Target format")
+    parser.add_argument("--compression", choices=["none", "gzip", "zstd"],
+                        help="Compression for the compact format (default: CONVERSATION_COMPRESSION)")
+    parser.add_argument("--dry-run", action="store_true", help="Report what would change without writing")
+    args = parser.parse_args()
+
+    if args.compression:
+        import conversation_codec
+        conversation_codec.CONVERSATION_COMPRESSION = args.compression
+
+    storage = f"s3://{memory_store.S3_BUCKET}" if memory_store.USE_S3 else memory_store.MEMORY_DIR
+    print(f"Migrating conversations in {storage} to {args.to} format{' (dry run)' if args.dry_run else ''}...")
+
+    counts = dict.fromkeys(("migrated", "skipped", "failed", "conflicted", "missing"), 0)
+    bytes_before = bytes_after = 0
+    for session_id in memory_store.iter_session_ids():
+        try:
+            outcome, before, after = migrate_session(session_id, args.to, bool(args.compression), args.dry_run)
+        except Exception as e:
+            print(f"❌ {session_id}: {e}")
+            outcome, before, after = "failed", 0, 0
+        if outcome == "conflicted":
+            print(f"⚠️ {session_id}: still changing after {MAX_ATTEMPTS} attempts, left for the next run")
+        counts[outcome] += 1
+        bytes_before += before
+        bytes_after += after
+
+    migrated = counts["migrated"]
+    print(f"✓ Migrated {migrated} session(s), skipped {counts['skipped']} already in {args.to} format, "
+          f"{counts['failed']} failed, {counts['conflicted']} still changing")
+    if migrated:
+        saved = (1 - bytes_after / bytes_before) * 100 if bytes_before else 0.0
+        print(f"  {bytes_before / 1024:.1f} KB -> {bytes_after / 1024:.1f} KB ({saved:.1f}% smaller)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Host several digital twins from one deployment.
+
+The default persona is the bundle in ./data, compiled at import as before.
+Other personas live in PERSONAS_DIR/<persona_id>/ with the same files
+(facts.json, summary.txt, style.txt, linkedin.pdf) and are compiled on
+first use into a bounded LRU of prompts, so warm workers serve every
+persona without each one paying for all of them.
+
+A request's persona comes from a /personas/<persona_id>/ path prefix
+(stripped before routing) or from its Host header via PERSONA_HOSTS:
+
+    PERSONA_HOSTS=twin.example.com=default,ada.example.com=ada
+
+With KNOWLEDGE_S3_BUCKET set, bundles (the default one included) come from
+S3 instead (see knowledge.py). Requests keep using the compiled prompt they
+find while a background thread checks for changes and swaps in the new one.
+"""
+import contextvars
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Dict, List, Optional, Tuple
+
+import context
+import json_codec
+import knowledge
+from knowledge import Bundle, KnowledgeNotFound
+from lifecycle import register_after_fork
+from resources import load_knowledge
+
+DEFAULT_PERSONA = os.getenv("DEFAULT_PERSONA", "default")
+PERSONAS_DIR = os.getenv("PERSONAS_DIR", "./data/personas")
+# Compiled prompts kept in memory, not counting the default persona
+PERSONA_CACHE_SIZE = int(os.getenv("PERSONA_CACHE_SIZE", "16"))
+# Knowledge bucket lookups remembered, hits and misses, least recently used evicted first
+PERSONA_LOOKUP_CACHE_SIZE = int(os.getenv("PERSONA_LOOKUP_CACHE_SIZE", "1024"))
+PERSONA_HOSTS: Dict[str, str] = dict(
+    pair.strip().lower().split("=", 1) for pair in os.getenv("PERSONA_HOSTS", "").split(",") if "=" in pair
+)
+PATH_PREFIX = "/personas/"
+
+_PERSONA_ID = re.compile(r"^[a-z0-9][a-z0-9_-]{0,62}$")
+
+_current_persona: contextvars.ContextVar = contextvars.ContextVar("persona", default=DEFAULT_PERSONA)
+
+# persona_id -> compiled Bundle, least recently used first; the default persona is never evicted
+_compiled: "OrderedDict[str, Bundle]" = OrderedDict()
+_compiled_lock = threading.Lock()
+_load_lock = threading.Lock()
+# Personas with a background refresh in flight
+_refreshing = set()
+# persona_id -> (exists in the knowledge bucket, monotonic time checked), bounded since the IDs
+# come from requests
+_s3_known: "OrderedDict[str, Tuple[bool, float]]" = OrderedDict()
+_s3_known_lock = threading.Lock()
+_reload_hooks: List[Callable[[str], None]] = []
+
+
+class UnknownPersona(LookupError):
+    """Raised for a persona ID with no knowledge bundle"""
+
+
+def persona_dir(persona_id: str) -> Optional[str]:
+    """Directory holding a persona's bundle, or None if there isn't one"""
+    if persona_id == DEFAULT_PERSONA:
+        return "./data"
+    if not _PERSONA_ID.match(persona_id):
+        return None
+    path = os.path.join(PERSONAS_DIR, persona_id)
+    return path if os.path.isfile(os.path.join(path, "facts.json")) else None
+
+
+def is_known(persona_id: str) -> bool:
+    if persona_dir(persona_id) is not None or persona_id in _compiled:
+        return True
+    if not knowledge.enabled() or not _PERSONA_ID.match(persona_id):
+        return False
+    # Cache bucket lookups so unknown IDs can't turn every request into an S3 call
+    with _s3_known_lock:
+        known, checked_at = _s3_known.get(persona_id, (False, float("-inf")))
+        if persona_id in _s3_known:
+            _s3_known.move_to_end(persona_id)
+    if time.monotonic() - checked_at >= knowledge.KNOWLEDGE_REFRESH_SECONDS:
+        try:
+            known = knowledge.exists(persona_id)
+        except Exception as e:
+            print(f"Knowledge lookup for persona {persona_id} failed: {e}")
+        with _s3_known_lock:
+            _s3_known[persona_id] = (known, time.monotonic())
+            _s3_known.move_to_end(persona_id)
+            while len(_s3_known) > PERSONA_LOOKUP_CACHE_SIZE:
+                _s3_known.popitem(last=False)
+    return known
+
+
+def current_persona() -> str:
+    return _current_persona.get()
+
+
+def use_persona(persona_id: str):
+    """Make persona_id current for this context; returns a token for reset_persona"""
+    return _current_persona.set(persona_id)
+
+
+def reset_persona(token):
+    _current_persona.reset(token)
+
+
+def scoped_session_id(session_id: str, persona_id: Optional[str] = None) -> str:
+    """
+    Storage ID for a session, so personas never read each other's conversations.
+
+    Default persona sessions keep their unprefixed IDs, unless the ID has a
+    "." in it and could pass for another persona's "<persona_id>.<session_id>".
+    """
+    persona_id = persona_id or current_persona()
+    if persona_id == DEFAULT_PERSONA and "." not in session_id:
+        return session_id
+    return f"{persona_id}.{session_id}"
+
+
+def register_reload_hook(hook: Callable[[str], None]):
+    """Call hook(persona_id) after a persona's knowledge changed, to drop caches built from it"""
+    _reload_hooks.append(hook)
+
+
+def _load_bundle(persona_id: str) -> Bundle:
+    if knowledge.enabled():
+        try:
+            bundle = knowledge.load_bundle(persona_id)
+            print(f"Compiled persona {persona_id} from the knowledge bucket")
+            return bundle
+        except KnowledgeNotFound:
+            pass
+    path = persona_dir(persona_id)
+    if path is None:
+        raise UnknownPersona(persona_id)
+    if persona_id == DEFAULT_PERSONA:
+        return Bundle(persona_id, (context._PROMPT_HEAD, context._PROMPT_TAIL))
+    print(f"Compiled persona {persona_id} from {path}")
+    return Bundle(persona_id, context.compile_prompt(load_knowledge(path)))
+
+
+def _store(bundle: Bundle, replacing: Optional[Bundle] = None) -> bool:
+    with _compiled_lock:
+        if replacing is not None and _compiled.get(bundle.persona_id) is not replacing:
+            return False
+        _compiled[bundle.persona_id] = bundle
+        _compiled.move_to_end(bundle.persona_id)
+        evictable = [p for p in _compiled if p != DEFAULT_PERSONA]
+        for persona_id in evictable[:max(0, len(evictable) - PERSONA_CACHE_SIZE)]:
+            del _compiled[persona_id]
+    return True
+
+
+def _refresh(bundle: Bundle):
+    try:
+        updated = knowledge.refresh_bundle(bundle)
+        # Swap only if nothing replaced or evicted the bundle meanwhile
+        if updated is not None and _store(updated, replacing=bundle):
+            print(f"Reloaded knowledge for persona {bundle.persona_id}")
+            for hook in _reload_hooks:
+                hook(bundle.persona_id)
+    except Exception as e:
+        print(f"Knowledge refresh for persona {bundle.persona_id} failed, keeping the loaded bundle: {e}")
+    finally:
+        bundle.checked_at = time.monotonic()
+        with _compiled_lock:
+            _refreshing.discard(bundle.persona_id)
+
+
+def _schedule_refresh(bundle: Bundle):
+    with _compiled_lock:
+        if bundle.persona_id in _refreshing:
+            return
+        _refreshing.add(bundle.persona_id)
+    threading.Thread(target=_refresh, args=(bundle,), name=f"knowledge-{bundle.persona_id}", daemon=True).start()
+
+
+def compiled_prompt(persona_id: str) -> Tuple[str, str]:
+    """The persona's prompt head and tail, compiling its bundle on first use"""
+    if persona_id == DEFAULT_PERSONA and not knowledge.enabled():
+        return context._PROMPT_HEAD, context._PROMPT_TAIL
+
+    with _compiled_lock:
+        bundle = _compiled.get(persona_id)
+        if bundle is not None:
+            _compiled.move_to_end(persona_id)
+    if bundle is not None:
+        if bundle.is_stale():
+            _schedule_refresh(bundle)
+        return bundle.parts
+
+    # Parsing the PDF is slow; one loader at a time, and only once per persona
+    with _load_lock:
+        with _compiled_lock:
+            bundle = _compiled.get(persona_id)
+        if bundle is None:
+            bundle = _load_bundle(persona_id)
+            _store(bundle)
+    return bundle.parts
+
+
+def prompt(persona_id: Optional[str] = None) -> str:
+    """System prompt for the given (or current) persona"""
+    persona_id = persona_id or current_persona()
+    if persona_id == DEFAULT_PERSONA and not knowledge.enabled():
+        return context.prompt()
+    head, tail = compiled_prompt(persona_id)
+    return f"{head}{datetime.now().strftime('%Y-%m-%d %H:%M:%S')}{tail}"
+
+
+def cache_info() -> Dict:
+    with _compiled_lock:
+        return {
+            "default": DEFAULT_PERSONA,
+            "cached": list(_compiled),
+            "capacity": PERSONA_CACHE_SIZE,
+            "knowledge_source": "s3" if knowledge.enabled() else "package",
+        }
+
+
+def invalidate(persona_id: Optional[str] = None):
+    """Drop compiled prompts so the next request recompiles them"""
+    with _compiled_lock:
+        if persona_id is None:
+            _compiled.clear()
+        else:
+            _compiled.pop(persona_id, None)
+
+
+def _reset_after_fork():
+    # Refresh threads don't survive a fork
+    _refreshing.clear()
+
+
+register_after_fork(_reset_after_fork)
+
+
+def resolve(path: str, host: str) -> Tuple[Optional[str], str]:
+    """(persona_id or None if the path names an unknown one, path to route)"""
+    if path.startswith(PATH_PREFIX):
+        persona_id, _, rest = path[len(PATH_PREFIX):].partition("/")
+        return (persona_id if is_known(persona_id) else None), "/" + rest
+    return PERSONA_HOSTS.get(host.split(":", 1)[0].lower(), DEFAULT_PERSONA), path
+
+
+class PersonaMiddleware:
+    """ASGI middleware that selects the persona for HTTP and WebSocket requests"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        host = next((v.decode("latin-1") for k, v in scope.get("headers", []) if k == b"host"), "")
+        persona_id, path = resolve(scope["path"], host)
+        if persona_id is None:
+            if scope["type"] == "websocket":
+                await send({"type": "websocket.close", "code": 1008})
+                return
+            body = json_codec.dumps({"detail": "Unknown persona"})
+            await send({"type": "http.response.start", "status": 404, "headers": [
+                (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            ]})
+            await send({"type": "http.response.body", "body": body})
+            return
+
+        if path != scope["path"]:
+            scope = dict(scope, path=path, raw_path=path.encode("utf-8"))
+        token = use_persona(persona_id)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            reset_persona(token)
@@ -1,23 +1,51 @@
 from pypdf import PdfReader
+import io
 import json
+import os
+from typing import Dict, Optional
 
-# Read LinkedIn PDF
-try:
-    reader = PdfReader("./data/linkedin.pdf")
-    linkedin = ""
-    for page in reader.pages:
-        text = page.extract_text()
-        if text:
-            linkedin += text
-except FileNotFoundError:
+# Files making up a knowledge bundle; linkedin.pdf is optional
+KNOWLEDGE_FILES = ["facts.json", "summary.txt", "style.txt", "linkedin.pdf"]
+
+
+def parse_knowledge(files: Dict[str, Optional[bytes]]) -> Dict:
+    """Build a knowledge bundle from raw file contents (None for a missing file)"""
+    # Read LinkedIn PDF
     linkedin = "LinkedIn profile not available"
+    if files.get("linkedin.pdf") is not None:
+        reader = PdfReader(io.BytesIO(files["linkedin.pdf"]))
+        linkedin = ""
+        for page in reader.pages:
+            text = page.extract_text()
+            if text:
+                linkedin += text
+
+    # Read other data files
+    return {
+        "linkedin": linkedin,
+        "summary": files["summary.txt"].decode("utf-8"),
+        "style": files["style.txt"].decode("utf-8"),
+        "facts": json.loads(files["facts.json"]),
+    }
+
 
-# Read other data files
-with open("./data/summary.txt", "r", encoding="utf-8") as f:
-    summary = f.read()
+def load_knowledge(data_dir: str = "./data") -> Dict:
+    """Read one persona's knowledge bundle: LinkedIn PDF, summary, style notes and facts"""
+    files = {}
+    for name in KNOWLEDGE_FILES:
+        try:
+            with open(os.path.join(data_dir, name), "rb") as f:
+                files[name] = f.read()
+        except FileNotFoundError:
+            if name != "linkedin.pdf":
+                raise
+            files[name] = None
+    return parse_knowledge(files)
 
-with open("./data/style.txt", "r", encoding="utf-8") as f:
-    style = f.read()
 
-with open("./data/facts.json", "r", encoding="utf-8") as f:
-    facts = json.load(f)
\ No newline at end of file
+# The default persona, loaded at import
+_default = load_knowledge("./data")
+linkedin = _default["linkedin"]
+summary = _default["summary"]
+style = _default["style"]
+facts = _default["facts"]
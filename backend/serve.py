@@ -0,0 +1,129 @@
+"""
+Production server: one listening socket shared by pre-forked uvicorn workers.
+
+    WEB_CONCURRENCY=4 uv run serve.py
+    uv run serve.py --workers 4 --port 8000
+
+The app, its knowledge data and the rendered system prompt are imported in
+the master before forking, so workers share those pages copy-on-write.
+SIGTERM/SIGINT drain every worker gracefully (in-flight requests finish and
+shutdown hooks flush pending writes); workers that die are replaced.
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+
+WEB_CONCURRENCY = int(os.getenv("WEB_CONCURRENCY", "1"))
+HOST = os.getenv("HOST", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8000"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    sock = socket.socket(socket.AF_INET6 if ":" in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def run_worker(app, sock: socket.socket, worker_id: int):
+    """Serve on the shared socket until told to stop, then exit the child"""
+    import uvicorn
+
+    config = uvicorn.Config(app, lifespan="on", timeout_graceful_shutdown=GRACEFUL_TIMEOUT, log_level="info")
+    server = uvicorn.Server(config)
+    print(f"Worker {worker_id} started (pid {os.getpid()})")
+    try:
+        server.run(sockets=[sock])
+    finally:
+        sys.stdout.flush()
+        os._exit(0)
+
+
+def main(app=None):
+    parser = argparse.ArgumentParser(description="Run the Digital Twin API")
+    parser.add_argument("--workers", type=int, default=WEB_CONCURRENCY,
+                        help="Worker processes (default: WEB_CONCURRENCY)")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    args = parser.parse_args()
+
+    # Load the app, knowledge data and static prompt once, before forking
+    if app is None:
+        from server import app
+    import context
+    context.prompt()
+
+    if args.workers <= 1:
+        import uvicorn
+        uvicorn.run(app, host=args.host, port=args.port)
+        return
+
+    sock = bind_socket(args.host, args.port)
+    # Move everything loaded so far out of the collector's reach so workers
+    # don't dirty the shared pages by touching refcounts during collection
+    gc.freeze()
+
+    workers = {}
+    stopping = False
+
+    def spawn(worker_id: int):
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_worker(app, sock, worker_id)
+        workers[pid] = worker_id
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    print(f"Starting {args.workers} workers on http://{args.host}:{args.port} (master pid {os.getpid()})")
+    for worker_id in range(args.workers):
+        spawn(worker_id)
+
+    deadline = None
+    while workers:
+        if stopping and deadline is None:
+            deadline = time.monotonic() + GRACEFUL_TIMEOUT + 5
+        if deadline is not None and time.monotonic() > deadline:
+            for pid in list(workers):
+                print(f"Worker {workers[pid]} did not stop in time, killing it")
+                os.kill(pid, signal.SIGKILL)
+            deadline = float("inf")
+
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            break
+        if pid == 0:
+            time.sleep(0.2)
+            continue
+
+        worker_id = workers.pop(pid, None)
+        if worker_id is not None and not stopping:
+            print(f"Worker {worker_id} exited with status {os.waitstatus_to_exitcode(status)}, restarting")
+            time.sleep(1)  # Avoid a tight crash loop
+            spawn(worker_id)
+
+    sock.close()
+    print("All workers stopped")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
 
-from fastapi import FastAPI, HTTPException, Request
+from dotenv import load_dotenv
+
+# Load environment variables before importing modules that read their configuration
+load_dotenv(override=True)
+
+from fastapi import FastAPI, HTTPException, Request, Query, Response, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
+from fastapi.concurrency import run_in_threadpool
+from contextlib import asynccontextmanager
 from pydantic import BaseModel, EmailStr
 import os
-from dotenv import load_dotenv
-from typing import Optional, List, Dict
-import json
+from typing import Optional, List, Dict, Callable, Tuple
+import asyncio
+import threading
 import uuid
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
 from email_services import (
@@ -17,37 +26,111 @@ from email_services import (
     send_admin_notification,
     send_resume_to_user,
     log_request,
-    check_honeypot
+    check_honeypot,
+    recaptcha_breaker,
+    brevo_breaker,
+    ResumePrevalidationMiddleware,
 )
+from email_services import prevalidation
 
-import boto3
-from botocore.config import Config
 from botocore.exceptions import ClientError
-from context import prompt
+import aws_clients
+import bedrock_regions
+import personas
+from personas import PersonaMiddleware
+from bedrock_transport import create_transport
+from http_cache import make_etag, etag_matches, compress_body
+from lifecycle import run_shutdown_hooks
+import tracing
+import json_codec
+import circuit_breaker
+from circuit_breaker import CircuitOpen
+from admission import chat_admission, Overloaded
+import idempotency
+from idempotency import IdempotencyMiddleware
+import token_budget
+from token_budget import BudgetExceeded
+import prefilter
+from prefilter import Blocked
+from json_codec import FastJSONResponse
+from memory_store import (
+    USE_S3,
+    S3_BUCKET,
+    s3_client,
+    load_conversation,
+    load_conversation_versioned,
+    append_conversation,
+    session_lock,
+    get_conversation_version,
+)
 
-# Load environment variables
-load_dotenv(override=True)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    yield
+    # In-flight requests have drained by now; flush anything still buffered
+    run_shutdown_hooks()
+
+
+app = FastAPI(lifespan=lifespan, default_response_class=FastJSONResponse)
+
+# reCAPTCHA and Brevo calls go through requests; record them as child spans
+tracing.instrument_requests()
+
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """Root SERVER span per request, continuing an incoming W3C traceparent"""
+    if not tracing.TRACING_ENABLED:
+        return await call_next(request)
+    with tracing.start_span(
+        f"{request.method} {request.url.path}",
+        tracing.KIND_SERVER,
+        traceparent=request.headers.get("traceparent"),
+        **{"http.method": request.method, "http.target": request.url.path},
+    ) as server_span:
+        response = await call_next(request)
+        # Name by route template so /conversation/{session_id} groups as one span name
+        route = request.scope.get("route")
+        if route is not None:
+            server_span.name = f"{request.method} {route.path}"
+        server_span.set_attribute("http.status_code", response.status_code)
+        if response.status_code >= 500:
+            server_span.status = tracing.STATUS_ERROR
+        response.headers["X-Trace-Id"] = server_span.trace_id
+    return response
 
 
 # Configure CORS
 origins = os.getenv("CORS_ORIGINS", "http://localhost:3001").split(",")
 MIN_CAPTCHA_SCORE = os.getenv("MIN_CAPTCHA_SCORE")
 
+# Replays responses to retried POSTs; inside prevalidation, so bots never reach the store
+app.add_middleware(IdempotencyMiddleware)
+
+# Inside CORS, so browsers can read its rejections
+app.add_middleware(ResumePrevalidationMiddleware, allowed_origins=origins)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=False,
     allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Trace-Id", "Retry-After", "Idempotency-Replayed"],
 )
 
-# Initialize Bedrock client
-bedrock_client = boto3.client(
-    service_name="bedrock-runtime", 
-    region_name=os.getenv("DEFAULT_AWS_REGION", "us-east-2")
-)
+# Outermost, so routing, tracing and CORS all see the path without the /personas/<id> prefix
+app.add_middleware(PersonaMiddleware)
+
+# Initialize Bedrock client (pool, timeouts and retries from aws_clients.py)
+bedrock_client = aws_clients.client("bedrock-runtime")
+
+# Spreads calls over BEDROCK_REGIONS by observed latency, if more than one is set (see bedrock_regions.py)
+bedrock_router = bedrock_regions.create_router()
+
+# Live, recording or replaying transport (see bedrock_transport.py)
+bedrock_transport = create_transport(bedrock_client, live=bedrock_router)
 
 # Bedrock model selection
 # Available models:
@@ -56,18 +139,31 @@ bedrock_client = boto3.client(
 # - amazon.nova-pro-v1:0    (most capable, higher cost)
 # Remember the Heads up: you might need to add us. or eu. prefix to the below model id
 BEDROCK_MODEL_ID=os.getenv("BEDROCK_MODEL_ID", "global.amazon.nova-2-lite-v1:0")
+BEDROCK_INFERENCE_CONFIG = {
+    "maxTokens": 256,
+    "temperature": 0.7,
+    "topP": 0.9
+}
 
 
-# Memory storage configuration
-USE_S3 = os.getenv("USE_S3", "false").lower() == "true"
-S3_BUCKET = os.getenv("S3_BUCKET", "")
-MEMORY_DIR = os.getenv("MEMORY_DIR", "../memory")
-RESUME_NAME=os.getenv("RESUME_NAME")
+# Fail fast while Bedrock is erroring or throttling (see circuit_breaker.py)
+bedrock_breaker = circuit_breaker.breaker("bedrock")
 
-# Initialize S3 client if needed
-if USE_S3:
-    s3_client = boto3.client("s3", region_name='us-east-2',
-    config=Config(signature_version="s3v4", s3={"addressing_style": "virtual"}))
+# Served when the breaker is open and there's no cached answer to the question
+DEGRADED_REPLY = os.getenv(
+    "DEGRADED_REPLY",
+    "I'm having trouble reaching my language model right now, so I can't answer properly. "
+    "Please try again in a minute or two."
+)
+# Recent answers to opening questions, reused while Bedrock is unavailable
+DEGRADED_CACHE_SIZE = int(os.getenv("DEGRADED_CACHE_SIZE", "256"))
+OVERLOADED_DETAIL = "The assistant is busy right now. Please try again in a moment."
+# /chat/stream frames, one JSON object per line
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+
+
+RESUME_NAME=os.getenv("RESUME_NAME")
+CONVERSATION_CACHE_CONTROL = os.getenv("CONVERSATION_CACHE_CONTROL", "no-cache")
 
 # Request/Response models
 class ChatRequest(BaseModel):
@@ -78,6 +174,9 @@ class ChatRequest(BaseModel):
 class ChatResponse(BaseModel):
     response: str
     session_id: str
+    degraded: bool = False
+    # Refused by the local prefilter without calling Bedrock
+    blocked: bool = False
     
 
 class Message(BaseModel):
@@ -97,57 +196,19 @@ class EmailResponse(BaseModel):
     message: str
     message_id: Optional[str] = None
 
-# Memory management functions
-def get_memory_path(session_id: str) -> str:
-    return f"{session_id}.json"
 
+def build_bedrock_messages(conversation: List[Dict], user_message: str) -> List[Dict]:
+    """Build the Bedrock converse message list from conversation history"""
 
-# Memory functions
-def load_conversation(session_id: str) -> List[Dict]:
-    """Load conversation history from storage"""
-    if USE_S3:
-        try:
-            response = s3_client.get_object(Bucket=S3_BUCKET, Key=get_memory_path(session_id))
-            return json.loads(response["Body"].read().decode("utf-8"))
-        except ClientError as e:
-            if e.response["Error"]["Code"] == "NoSuchKey":
-                return []
-            raise
-    else:
-        # Local file storage
-        file_path = os.path.join(MEMORY_DIR, get_memory_path(session_id))
-        if os.path.exists(file_path):
-            with open(file_path, "r") as f:
-                return json.load(f)
-        return []
-
-
-def save_conversation(session_id: str, messages: List[Dict]):
-    """Save conversation history to storage"""
-    if USE_S3:
-        s3_client.put_object(
-            Bucket=S3_BUCKET,
-            Key=get_memory_path(session_id),
-            Body=json.dumps(messages, indent=2),
-            ContentType="application/json",
-        )
-    else:
-        # Local file storage
-        os.makedirs(MEMORY_DIR, exist_ok=True)
-        file_path = os.path.join(MEMORY_DIR, get_memory_path(session_id))
-        with open(file_path, "w") as f:
-            json.dump(messages, f, indent=2)
-
-def call_bedrock(conversation: List[Dict], user_message: str) -> str:
-    """Call AWS Bedrock with conversation history"""
-    
     # Build messages in Bedrock format
     messages = []
     
     # Add system prompt as first user message (Bedrock convention)
+    with tracing.span("prompt"):
+        system_prompt = personas.prompt()
     messages.append({
         "role": "user", 
-        "content": [{"text": prompt()}]
+        "content": [{"text": system_prompt}]
     })
     
     # Add conversation history (limit to last 10 exchanges to manage context)
@@ -162,38 +223,145 @@ def call_bedrock(conversation: List[Dict], user_message: str) -> str:
         "role": "user",
         "content": [{"text": user_message}]
     })
-    
+
+    return messages
+
+
+def converse_bedrock(conversation: List[Dict], user_message: str, model_id: Optional[str] = None,
+                     inference_config: Optional[Dict] = None) -> Dict:
+    """Call AWS Bedrock with conversation history and return the full converse response"""
+    messages = build_bedrock_messages(conversation, user_message)
+    model_id = model_id or BEDROCK_MODEL_ID
+
     try:
         # Call Bedrock using the converse API
-        response = bedrock_client.converse(
-            modelId=BEDROCK_MODEL_ID,
-            messages=messages,
-            inferenceConfig={
-                "maxTokens": 256,
-                "temperature": 0.7,
-                "topP": 0.9
-            }
-        )
-        
-        # Extract the response text
-        return response["output"]["message"]["content"][0]["text"]
+        with tracing.span("bedrock.converse", **{"gen_ai.request.model": model_id}) as converse_span:
+            response = bedrock_transport.converse(
+                modelId=model_id,
+                messages=messages,
+                inferenceConfig=inference_config or BEDROCK_INFERENCE_CONFIG
+            )
+            usage = response.get("usage", {})
+            converse_span.set_attribute("gen_ai.usage.input_tokens", usage.get("inputTokens"))
+            converse_span.set_attribute("gen_ai.usage.output_tokens", usage.get("outputTokens"))
+        return response
         
     except ClientError as e:
-        error_code = e.response['Error']['Code']
-        if error_code == 'ValidationException':
-            # Handle message format issues
-            print(f"Bedrock validation error: {e}")
-            raise HTTPException(status_code=400, detail="Invalid message format for Bedrock")
-        elif error_code == 'AccessDeniedException':
-            print(f"Bedrock access denied: {e}")
-            raise HTTPException(status_code=403, detail="Access denied to Bedrock model")
-        elif error_code == 'ThrottlingExcepton':
-            print(f'Bedrock throttling exception: {e}')
-            raise HTTPException(status_code=429, detail="Modal quota reached for today. Please retry after the daily reset")
-        else:
-            print(f"Bedrock error: {e}")
-            raise HTTPException(status_code=500, detail=f"Bedrock error: {str(e)}")
-    
+        raise bedrock_http_error(e)
+
+
+def bedrock_http_error(e: ClientError) -> HTTPException:
+    """Map a Bedrock ClientError to the HTTPException returned to the client"""
+    error_code = e.response['Error']['Code']
+    if error_code == 'ValidationException':
+        # Handle message format issues
+        print(f"Bedrock validation error: {e}")
+        return HTTPException(status_code=400, detail="Invalid message format for Bedrock")
+    elif error_code == 'AccessDeniedException':
+        print(f"Bedrock access denied: {e}")
+        return HTTPException(status_code=403, detail="Access denied to Bedrock model")
+    elif error_code == 'ThrottlingException':
+        print(f'Bedrock throttling exception: {e}')
+        return HTTPException(status_code=429, detail="Modal quota reached for today. Please retry after the daily reset")
+    else:
+        print(f"Bedrock error: {e}")
+        return HTTPException(status_code=500, detail=f"Bedrock error: {str(e)}")
+
+
+def is_bedrock_outage(e: BaseException) -> bool:
+    """Whether a failed call counts against Bedrock; rejected requests (400/403) don't"""
+    return not (isinstance(e, HTTPException) and e.status_code in (400, 403))
+
+
+def call_bedrock(conversation: List[Dict], user_message: str,
+                 on_usage: Optional[Callable[[Dict], None]] = None) -> str:
+    """Call AWS Bedrock with conversation history; on_usage receives the reported token usage"""
+    with bedrock_breaker.guard(is_bedrock_outage):
+        response = converse_bedrock(conversation, user_message)
+    if on_usage is not None:
+        on_usage(response.get("usage", {}))
+
+    # Extract the response text
+    return response["output"]["message"]["content"][0]["text"]
+
+
+def stream_bedrock(conversation: List[Dict], user_message: str, on_delta: Callable[[str], None],
+                   on_usage: Optional[Callable[[Dict], None]] = None) -> str:
+    """Stream a Bedrock reply, passing each text delta to on_delta, and return the full text"""
+    messages = build_bedrock_messages(conversation, user_message)
+    parts = []
+    with bedrock_breaker.guard(is_bedrock_outage):
+        try:
+            with tracing.span("bedrock.converse_stream", **{"gen_ai.request.model": BEDROCK_MODEL_ID}) as converse_span:
+                for event in bedrock_transport.converse_stream(
+                    modelId=BEDROCK_MODEL_ID,
+                    messages=messages,
+                    inferenceConfig=BEDROCK_INFERENCE_CONFIG
+                ):
+                    if "contentBlockDelta" in event:
+                        text = event["contentBlockDelta"]["delta"].get("text", "")
+                        if text:
+                            parts.append(text)
+                            on_delta(text)
+                    elif "metadata" in event:
+                        usage = event["metadata"].get("usage", {})
+                        converse_span.set_attribute("gen_ai.usage.input_tokens", usage.get("inputTokens"))
+                        converse_span.set_attribute("gen_ai.usage.output_tokens", usage.get("outputTokens"))
+                        if on_usage is not None:
+                            on_usage(usage)
+        except ClientError as e:
+            raise bedrock_http_error(e)
+    return "".join(parts)
+
+
+def check_token_budget(session_id: str, client_ip: Optional[str]):
+    """Refuse the turn with a 429, before Bedrock is called, once its session or IP is over budget"""
+    try:
+        token_budget.check(session_id, client_ip)
+    except BudgetExceeded as e:
+        print(f"Token budget exceeded: {e}")
+        raise HTTPException(
+            status_code=429,
+            detail=f"Usage limit reached for this {'conversation' if e.scope == 'session' else 'network'}. "
+                   f"Please try again in {max(1, round(e.retry_after / 60))} minutes.",
+            headers={"Retry-After": str(e.retry_after)}
+        )
+
+
+_recent_replies: "OrderedDict[tuple, str]" = OrderedDict()
+_recent_replies_lock = threading.Lock()
+
+
+def _reply_key(user_message: str) -> tuple:
+    return personas.current_persona(), " ".join(user_message.lower().split())
+
+
+def remember_reply(conversation: List[Dict], user_message: str, reply: str):
+    """Keep answers to opening questions; follow-ups depend on history another visitor won't share"""
+    if conversation or not reply:
+        return
+    with _recent_replies_lock:
+        key = _reply_key(user_message)
+        _recent_replies[key] = reply
+        _recent_replies.move_to_end(key)
+        while len(_recent_replies) > DEGRADED_CACHE_SIZE:
+            _recent_replies.popitem(last=False)
+
+
+def degraded_reply(user_message: str) -> str:
+    """Answer without Bedrock: a recent reply to the same opening question, else DEGRADED_REPLY"""
+    with _recent_replies_lock:
+        return _recent_replies.get(_reply_key(user_message), DEGRADED_REPLY)
+
+
+def _forget_replies(persona_id: str):
+    # Answers built from the old knowledge bundle may be wrong now
+    with _recent_replies_lock:
+        for key in [k for k in _recent_replies if k[0] == persona_id]:
+            del _recent_replies[key]
+
+
+personas.register_reload_hook(_forget_replies)
 
 
 
@@ -254,16 +422,20 @@ async def root():
         "message": "AI Digital Twin API",
         "memory_enabled": True,
         "storage": "S3" if USE_S3 else "local",
-        "ai_model": BEDROCK_MODEL_ID
+        "ai_model": BEDROCK_MODEL_ID,
+        "persona": personas.current_persona()
     }
 
 
 @app.get("/health")
 async def health_check():
+      circuits = circuit_breaker.states()
       return {
-        "status": "healthy",
+        "status": "degraded" if any(c["state"] != circuit_breaker.CLOSED for c in circuits.values()) else "healthy",
         "use_s3": USE_S3,
-        "bedrock_model": BEDROCK_MODEL_ID
+        "bedrock_model": BEDROCK_MODEL_ID,
+        "personas": personas.cache_info(),
+        "circuits": circuits
     }
 
 
@@ -273,58 +445,373 @@ async def metrics():
     return {
         "status": "ok",
         "storage": "S3" if USE_S3 else "local",
-        "model": BEDROCK_MODEL_ID
+        "model": BEDROCK_MODEL_ID,
+        "bedrock_regions": bedrock_router.stats() if bedrock_router else None,
+        "chat_admission": chat_admission.stats(),
+        "prefilter": prefilter.stats(),
+        "idempotency": idempotency.stats(),
+        "resume_prevalidation": prevalidation.stats()
     }
 
 
-@app.post("/chat", response_model=ChatResponse)
-async def chat(request: ChatRequest):
-    try:
-        # Generate session ID if not provided
-        session_id = request.session_id or str(uuid.uuid4())
+def run_chat_turn(session_id: str, user_message: str, client_ip: Optional[str] = None) -> str:
+    """Load the session, ask Bedrock, and append both turns to the stored history"""
+    # Raises Blocked for jailbreak attempts, spam and floods, before any budget or Bedrock is spent
+    prefilter.screen(session_id, user_message)
+    check_token_budget(session_id, client_ip)
 
-        # Load conversation history
-        conversation = load_conversation(session_id)
+    lock_span = tracing.span("session_lock.wait")
+    with session_lock(session_id):
+        lock_span.end()
 
-       # Call Bedrock for response
-        assistant_response = call_bedrock(conversation, request.message)
+        # Load conversation history
+        with tracing.span("load_conversation") as load_span:
+            conversation, version = load_conversation_versioned(session_id)
+            load_span.set_attribute("conversation.messages", len(conversation))
 
-      # Update conversation history
-        conversation.append(
-            {"role": "user", "content": request.message, "timestamp": datetime.now().isoformat()}
+        # Call Bedrock for response; raises CircuitOpen, before anything is saved, while Bedrock is down
+        assistant_response = call_bedrock(
+            conversation, user_message, on_usage=lambda usage: token_budget.charge(session_id, client_ip, usage)
         )
-        conversation.append(
+        remember_reply(conversation, user_message, assistant_response)
+
+        # Update conversation history, merging with any turn saved concurrently by another worker
+        new_messages = [
+            {"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()},
             {
                 "role": "assistant",
                 "content": assistant_response,
                 "timestamp": datetime.now().isoformat(),
-            }
-        )
+            },
+        ]
+        with tracing.span("save_conversation"):
+            append_conversation(session_id, conversation, new_messages, version)
+
+    return assistant_response
 
-        # Save conversation
-        save_conversation(session_id, conversation)
+
+class ChatSession:
+    """
+    Conversation state kept in memory for the lifetime of a chat connection.
+
+    History is loaded once; each turn is streamed and then saved against the
+    version we last wrote, so only a concurrent writer forces a reload.
+    """
+
+    def __init__(self, session_id: str, persona_id: Optional[str] = None, client_ip: Optional[str] = None):
+        self.session_id = session_id
+        # Charged alongside the session for token budgets; updated per message where it can change
+        self.client_ip = client_ip
+        self.persona_id = persona_id or personas.current_persona()
+        # Key the conversation is stored under, scoped to the persona
+        self.storage_id = personas.scoped_session_id(session_id, self.persona_id)
+        self.conversation: Optional[List[Dict]] = None
+        self.version: Optional[str] = None
+
+    def load(self):
+        with tracing.span("load_conversation"):
+            self.conversation, self.version = load_conversation_versioned(self.storage_id)
+
+    def run_turn(self, user_message: str, on_delta: Callable[[str], None]) -> str:
+        """Stream one reply through on_delta and persist both turns; returns the reply"""
+        persona_token = personas.use_persona(self.persona_id)
+        try:
+            return self._run_turn(user_message, on_delta)
+        except CircuitOpen:
+            # Bedrock is down; answer from the degraded path and leave the history untouched
+            reply = degraded_reply(user_message)
+            on_delta(reply)
+            return reply
+        except Blocked:
+            # Refused locally; the attempt isn't worth keeping in the history either
+            on_delta(prefilter.PREFILTER_REFUSAL)
+            return prefilter.PREFILTER_REFUSAL
+        finally:
+            personas.reset_persona(persona_token)
+
+    def _run_turn(self, user_message: str, on_delta: Callable[[str], None]) -> str:
+        prefilter.screen(self.storage_id, user_message)
+        check_token_budget(self.storage_id, self.client_ip)
+
+        with session_lock(self.storage_id):
+            if self.conversation is None:
+                self.load()
+
+            user_turn = {"role": "user", "content": user_message, "timestamp": datetime.now().isoformat()}
+            assistant_response = stream_bedrock(
+                self.conversation, user_message, on_delta,
+                on_usage=lambda usage: token_budget.charge(self.storage_id, self.client_ip, usage)
+            )
+            remember_reply(self.conversation, user_message, assistant_response)
+            new_messages = [
+                user_turn,
+                {"role": "assistant", "content": assistant_response, "timestamp": datetime.now().isoformat()},
+            ]
+
+            # Written elsewhere in the meantime (another tab, worker or /chat)? Those turns are kept first
+            with tracing.span("save_conversation"):
+                self.conversation, self.version = append_conversation(
+                    self.storage_id, self.conversation, new_messages, self.version
+                )
+
+        return assistant_response
+
+
+@app.post("/chat", response_model=ChatResponse)
+async def chat(request: ChatRequest, req: Request):
+    try:
+        # Generate session ID if not provided
+        session_id = request.session_id or str(uuid.uuid4())
+
+        # Storage and Bedrock calls block, so run the turn off the event loop
+        async with chat_admission.slot():
+            assistant_response = await run_in_threadpool(
+                run_chat_turn, personas.scoped_session_id(session_id), request.message, get_client_ip(req)
+            )
 
         return ChatResponse(response=assistant_response, session_id=session_id)
 
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=OVERLOADED_DETAIL, headers={"Retry-After": str(e.retry_after)})
+    except CircuitOpen:
+        # Not saved, and not kept for an Idempotency-Key either, so a retry after recovery gets a real answer
+        degraded = ChatResponse(response=degraded_reply(request.message), session_id=session_id, degraded=True)
+        return FastJSONResponse(degraded.model_dump(), headers=idempotency.TRANSIENT_HEADERS)
+    except Blocked:
+        return ChatResponse(response=prefilter.PREFILTER_REFUSAL, session_id=session_id, blocked=True)
     except HTTPException:
         raise
     except Exception as e:
-        print(f"Error in chat endpoint: {str(e)}")
+        print(f"Error in chat endpoint: {str(e)} {json_codec.dumps_str(tracing.log_context())}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+def start_streamed_turn(session: ChatSession, message: str) -> Tuple[asyncio.Future, asyncio.Queue]:
+    """Run a turn in a worker thread; its text deltas hop back to the event loop through the queue, then None"""
+    loop = asyncio.get_running_loop()
+    deltas: asyncio.Queue = asyncio.Queue()
+    turn = asyncio.ensure_future(run_in_threadpool(
+        session.run_turn, message, lambda text: loop.call_soon_threadsafe(deltas.put_nowait, text)
+    ))
+    turn.add_done_callback(lambda _: deltas.put_nowait(None))
+    return turn, deltas
+
+
+def turn_error_frame(e: Exception) -> Dict:
+    if isinstance(e, HTTPException):
+        return {"type": "error", "status": e.status_code, "detail": e.detail}
+    print(f"Error in streamed chat turn: {str(e)} {json_codec.dumps_str(tracing.log_context())}")
+    return {"type": "error", "status": 500, "detail": "Internal server error"}
+
+
+class StreamSlot:
+    """
+    The admission slot of one streamed turn, released exactly once.
+
+    That's after the response has closed, however it ended, and after the
+    turn's worker thread has finished, which can be later if the client
+    went away mid-turn.
+    """
+
+    def __init__(self):
+        self.turn: Optional[asyncio.Future] = None
+        self._released = False
+
+    def close(self):
+        if self.turn is not None and not self.turn.done():
+            self.turn.add_done_callback(lambda _: self._release())
+        else:
+            self._release()
+
+    def _release(self):
+        if not self._released:
+            self._released = True
+            chat_admission.release()
+
+
+class SlotStreamingResponse(StreamingResponse):
+    """A StreamingResponse that closes its StreamSlot even if the body never starts or sending fails"""
+
+    def __init__(self, content, slot: StreamSlot, **kwargs):
+        super().__init__(content, **kwargs)
+        self.slot = slot
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.slot.close()
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest, req: Request):
+    """
+    Streaming chat over plain HTTP, for clients and Lambda function URLs without WebSockets.
+
+    The body is newline-delimited JSON carrying the same frames as /ws/chat:
+    {"type": "session"}, a run of {"type": "token"}, then {"type": "done"}
+    or {"type": "error"}.
+    """
+    session = ChatSession(request.session_id or str(uuid.uuid4()), client_ip=get_client_ip(req))
+    # Taken before the response starts, so a shed request still gets a real 503
+    try:
+        await chat_admission.acquire()
+    except Overloaded as e:
+        raise HTTPException(status_code=503, detail=OVERLOADED_DETAIL, headers={"Retry-After": str(e.retry_after)})
+    slot = StreamSlot()
+
+    async def frames():
+        try:
+            await run_in_threadpool(session.load)
+        except Exception as e:
+            yield json_codec.dumps(turn_error_frame(e)) + b"\n"
+            return
+        yield json_codec.dumps({
+            "type": "session", "session_id": session.session_id, "messages": len(session.conversation)
+        }) + b"\n"
+
+        turn, deltas = start_streamed_turn(session, request.message)
+        slot.turn = turn
+        while (text := await deltas.get()) is not None:
+            yield json_codec.dumps({"type": "token", "text": text}) + b"\n"
+        try:
+            response = turn.result()
+        except Exception as e:
+            yield json_codec.dumps(turn_error_frame(e)) + b"\n"
+            return
+        yield json_codec.dumps({"type": "done", "session_id": session.session_id, "response": response}) + b"\n"
+
+    # no-transform keeps proxies and CloudFront from buffering or compressing the stream
+    return SlotStreamingResponse(
+        frames(), slot, media_type=NDJSON_MEDIA_TYPE, headers={"Cache-Control": "no-cache, no-transform"}
+    )
+
+
+async def send_frame(websocket: WebSocket, frame: Dict):
+    await websocket.send_text(json_codec.dumps_str(frame))
+
+
+@app.websocket("/ws/chat")
+async def chat_websocket(websocket: WebSocket, session_id: Optional[str] = None):
+    """
+    Streaming chat over one connection.
+
+    Client frames: {"message": "..."}. Server frames: {"type": "session"},
+    then per turn a run of {"type": "token"} frames and a {"type": "done"}
+    frame, or {"type": "error"}.
+    """
+    # Browsers don't apply CORS to WebSockets, so check the Origin ourselves
+    origin = websocket.headers.get("origin")
+    if origin is not None and origin not in origins:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+    session_id = session_id or str(uuid.uuid4())
+    session = ChatSession(session_id, client_ip=get_client_ip(websocket))
+    try:
+        await run_in_threadpool(session.load)
+        await send_frame(websocket, {
+            "type": "session", "session_id": session.session_id, "messages": len(session.conversation)
+        })
+
+        while True:
+            try:
+                frame = json_codec.loads(await websocket.receive_text())
+                message = frame.get("message") if isinstance(frame, dict) else None
+            except ValueError:
+                message = None
+            if not isinstance(message, str) or not message.strip():
+                await send_frame(websocket, {"type": "error", "status": 400, "detail": "Expected {\"message\": \"...\"}"})
+                continue
+
+            try:
+                async with chat_admission.slot():
+                    turn, deltas = start_streamed_turn(session, message)
+                    while (text := await deltas.get()) is not None:
+                        await send_frame(websocket, {"type": "token", "text": text})
+            except Overloaded as e:
+                await send_frame(websocket, {"type": "error", "status": 503, "detail": OVERLOADED_DETAIL,
+                                             "retry_after": e.retry_after})
+                continue
+
+            try:
+                response = turn.result()
+            except Exception as e:
+                await send_frame(websocket, turn_error_frame(e))
+                continue
+            await send_frame(websocket, {"type": "done", "session_id": session.session_id, "response": response})
+
+    except WebSocketDisconnect:
+        pass
+
+
+def paginate_conversation(conversation: List[Dict], limit: Optional[int],
+                          before: Optional[int], after: Optional[int]) -> Dict:
+    """
+    Slice a conversation by message index cursors.
+
+    Timestamps can't serve as cursors: a turn's two messages share nearly
+    the same one, and a concurrent turn can be saved ahead of an older one.
+    Conversations only ever grow at the end, so indexes stay put. Without
+    'after' the newest messages before index 'before' are returned and the
+    cursor pages backwards; with only 'after' the page starts right after
+    that index and the cursor pages forwards.
+    """
+    start = 0 if after is None else after + 1
+    end = len(conversation) if before is None else min(before, len(conversation))
+    if limit is None or end - start <= limit:
+        return {"messages": conversation[start:end], "has_more": False, "next_cursor": None}
+
+    if after is not None and before is None:
+        return {"messages": conversation[start:start + limit], "has_more": True,
+                "next_cursor": {"after": start + limit - 1}}
+
+    return {"messages": conversation[end - limit:end], "has_more": True, "next_cursor": {"before": end - limit}}
+
+
 @app.get("/conversation/{session_id}")
-async def get_conversation(session_id: str):
-    """Retrieve conversation history"""
+async def get_conversation(
+    session_id: str,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=1000),
+    before: Optional[int] = Query(None, ge=0),
+    after: Optional[int] = Query(None, ge=0),
+):
+    """Retrieve conversation history, paginated and cacheable via ETag"""
     try:
-        conversation = load_conversation(session_id)
-        return {"session_id": session_id, "messages": conversation}
+        # Answer revalidations from the storage version alone, without loading the session
+        storage_id = personas.scoped_session_id(session_id)
+        version = await run_in_threadpool(get_conversation_version, storage_id)
+        etag = make_etag(storage_id, version, limit, before, after)
+        cache_headers = {"ETag": etag, "Cache-Control": CONVERSATION_CACHE_CONTROL, "Vary": "Accept-Encoding"}
+        if version is not None and etag_matches(request.headers.get("If-None-Match"), etag):
+            return Response(status_code=304, headers=cache_headers)
+
+        conversation = await run_in_threadpool(load_conversation, storage_id)
+        page = paginate_conversation(conversation, limit, before, after)
+        body = json_codec.dumps({"session_id": session_id, **page})
+
+        body, encoding = compress_body(body, request.headers.get("Accept-Encoding"))
+        if encoding:
+            cache_headers["Content-Encoding"] = encoding
+        return Response(content=body, media_type="application/json", headers=cache_headers)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 
+def resume_unavailable(retry_after: float) -> HTTPException:
+    return HTTPException(
+        status_code=503,
+        detail="Resume requests are temporarily unavailable. Please try again in a few minutes.",
+        headers={"Retry-After": str(max(1, round(retry_after)))}
+    )
+
+
 @app.post("/send-resume-request-secure")
 async def send_resume_request_secure(request: SecureResumeRequest, req: Request):
     """
@@ -334,9 +821,15 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
         # Get client info
         client_ip = get_client_ip(req)
         user_agent = req.headers.get("User-Agent", "Unknown")
+
+        # Turn requests away up front rather than after a CAPTCHA check that can't lead anywhere
+        for unavailable in (recaptcha_breaker, brevo_breaker):
+            if unavailable.is_open():
+                raise resume_unavailable(unavailable.retry_after())
         
        #1. Check honeypot FIRST (fastest check, blocks obvious bots)
-        honeypot_valid, honeypot_msg = check_honeypot(request, client_ip, user_agent)
+        with tracing.span("check_honeypot"):
+            honeypot_valid, honeypot_msg = check_honeypot(request, client_ip, user_agent)
         if not honeypot_valid:
             print(f"❌ Honeypot failed: {honeypot_msg}")
             log_request({
@@ -357,10 +850,17 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
              print(f"✅ Honeypot passed!")
         
         # 2. Verify CAPTCHA
-        captcha_valid, captcha_score = verify_recaptcha(
-            request.captcha_token, 
-            client_ip
-        )
+        with tracing.span("verify_recaptcha") as captcha_span:
+            try:
+                captcha_valid, captcha_score = await run_in_threadpool(
+                    verify_recaptcha,
+                    request.captcha_token,
+                    client_ip
+                )
+            except CircuitOpen as e:
+                # The breaker opened since the check above; reCAPTCHA is down, not the visitor a bot
+                raise resume_unavailable(e.retry_after)
+            captcha_span.set_attribute("recaptcha.score", captcha_score)
         
         if not captcha_valid or captcha_score < float(MIN_CAPTCHA_SCORE):
             log_request({
@@ -392,7 +892,8 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
             )
         
         # 2. Check rate limit
-        rate_limit_ok, rate_limit_msg = check_rate_limit(request.email, client_ip)
+        with tracing.span("check_rate_limit"):
+            rate_limit_ok, rate_limit_msg = check_rate_limit(request.email, client_ip)
         if not rate_limit_ok:
             log_request({
                 "name": request.name,
@@ -405,10 +906,14 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
             raise HTTPException(status_code=429, detail=rate_limit_msg)
 
         # generate preassigned url
-        pre_assigned_url = generate_resume_presigned_url()
+        with tracing.span("generate_presigned_url"):
+            pre_assigned_url = await run_in_threadpool(generate_resume_presigned_url)
         
         # 3. Send resume to user
-        resume_sent = send_resume_to_user(name=request.name, email=request.email, pre_assigned_url=pre_assigned_url)
+        with tracing.span("send_resume_to_user"):
+            resume_sent = await run_in_threadpool(
+                send_resume_to_user, name=request.name, email=request.email, pre_assigned_url=pre_assigned_url
+            )
         
         if not resume_sent:
             raise HTTPException(
@@ -417,16 +922,17 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
             )
         
         # 4. Send notification to admin (you)
-        send_admin_notification({
-            "name": request.name,
-            "email": request.email,
-            "message": request.message,
-            "ip": client_ip,
-            "user_agent": user_agent,
-            "captcha_score": captcha_score,
-            "form_time": request.form_time,
-            "honeypot_passed": True
-        })
+        with tracing.span("send_admin_notification"):
+            await run_in_threadpool(send_admin_notification, {
+                "name": request.name,
+                "email": request.email,
+                "message": request.message,
+                "ip": client_ip,
+                "user_agent": user_agent,
+                "captcha_score": captcha_score,
+                "form_time": request.form_time,
+                "honeypot_passed": True
+            })
         
         # 5. Log the successful request
         log_request({
@@ -451,5 +957,6 @@ async def send_resume_request_secure(request: SecureResumeRequest, req: Request)
         raise HTTPException(status_code=500, detail="Internal server error")
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
+    # WEB_CONCURRENCY > 1 runs the pre-fork production server (see serve.py)
+    from serve import main
+    main(app)
@@ -0,0 +1,284 @@
+"""
+Run the Lambda response streaming path locally, behind a simulated function URL.
+
+    uv run simulate_streaming.py                        # http://127.0.0.1:8001
+    curl -N localhost:8001/chat/stream -H 'Content-Type: application/json' -d '{"message": "Hi"}'
+
+Starts a stand-in for the Lambda Runtime API, runs `python -m
+lambda_streaming` against it in a child process (as
+lambda_streaming_bootstrap does on Lambda), and answers HTTP requests by
+turning each into a function URL event and relaying the response chunk by
+chunk as the runtime posts it. Like one Lambda execution environment, the
+runtime handles one invocation at a time; a runtime that exits is started
+again, as Lambda would re-initialise it.
+
+RuntimeAPI.invoke() can also be used on its own to check how (and when)
+chunks of a response arrive.
+"""
+import argparse
+import base64
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator
+
+import json_codec
+from lambda_streaming import PRELUDE_DELIMITER, RUNTIME_API_VERSION
+
+FUNCTION_ARN = "arn:aws:lambda:local:000000000000:function:simulated"
+FUNCTION_URL_DOMAIN = "simulated.lambda-url.local.on.aws"
+
+
+class InvocationError(Exception):
+    """The function reported an error for an invocation, or didn't finish in time"""
+
+
+class RuntimeAPIHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: "RuntimeAPI"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _accepted(self):
+        self.send_response(202)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", "2")
+        self.end_headers()
+        self.wfile.write(b"{}")
+
+    def do_GET(self):
+        if self.path != f"/{RUNTIME_API_VERSION}/runtime/invocation/next":
+            self.send_error(404)
+            return
+        request_id, body = self.server.pending.get()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Lambda-Runtime-Aws-Request-Id", request_id)
+        self.send_header("Lambda-Runtime-Deadline-Ms", str(int((time.time() + self.server.invocation_timeout) * 1000)))
+        self.send_header("Lambda-Runtime-Invoked-Function-Arn", FUNCTION_ARN)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _read_chunked(self, results: queue.Queue):
+        while True:
+            size = int(self.rfile.readline().split(b";", 1)[0].strip(), 16)
+            if size == 0:
+                break
+            results.put(self.rfile.read(size))
+            self.rfile.readline()
+        trailers = {}
+        while (line := self.rfile.readline().strip()):
+            name, _, value = line.decode("latin-1").partition(":")
+            trailers[name.strip().lower()] = value.strip()
+        if "lambda-runtime-function-error-type" in trailers:
+            body = trailers.get("lambda-runtime-function-error-body")
+            message = json_codec.loads(base64.b64decode(body)).get("errorMessage", "") if body else ""
+            results.put(InvocationError(f"{trailers['lambda-runtime-function-error-type']} mid-stream: {message}"))
+
+    def do_POST(self):
+        prefix = f"/{RUNTIME_API_VERSION}/runtime/"
+        path = self.path[len(prefix):] if self.path.startswith(prefix) else ""
+        if path == "init/error":
+            body = json_codec.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            print(f"Runtime failed to initialise: {body.get('errorType')}: {body.get('errorMessage')}")
+            self._accepted()
+            return
+        kind, _, rest = path.partition("/")
+        request_id, _, outcome = rest.partition("/")
+        results = self.server.results.get(request_id)
+        if kind != "invocation" or results is None or outcome not in ("response", "error"):
+            self.send_error(404)
+            return
+
+        if outcome == "error":
+            body = json_codec.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            results.put(InvocationError(f"{body.get('errorType')}: {body.get('errorMessage')}"))
+        elif self.headers.get("Transfer-Encoding", "").lower() == "chunked":
+            self._read_chunked(results)
+        else:
+            results.put(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        results.put(None)
+        self._accepted()
+
+
+class RuntimeAPI(ThreadingHTTPServer):
+    """The Runtime API endpoints a runtime client uses, fed by invoke()"""
+
+    daemon_threads = True
+
+    def __init__(self, address=("127.0.0.1", 0), invocation_timeout: float = 30):
+        super().__init__(address, RuntimeAPIHandler)
+        self.invocation_timeout = invocation_timeout
+        self.pending: queue.Queue = queue.Queue()
+        self.results: Dict[str, queue.Queue] = {}
+
+    @property
+    def address(self) -> str:
+        host, port = self.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self) -> "RuntimeAPI":
+        threading.Thread(target=self.serve_forever, name="runtime-api", daemon=True).start()
+        return self
+
+    def invoke(self, event: Dict) -> Iterator[bytes]:
+        """Queue an invocation and yield its response body as the runtime posts each chunk"""
+        request_id = str(uuid.uuid4())
+        results: queue.Queue = queue.Queue()
+        self.results[request_id] = results
+        self.pending.put((request_id, json_codec.dumps(event)))
+        deadline = time.monotonic() + self.invocation_timeout
+        try:
+            while True:
+                try:
+                    item = results.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    raise InvocationError(f"Task timed out after {self.invocation_timeout:g} seconds")
+                if item is None:
+                    return
+                if isinstance(item, InvocationError):
+                    raise item
+                yield item
+        finally:
+            self.results.pop(request_id, None)
+
+
+def function_url_event(method: str, target: str, headers, body: bytes, source_ip: str) -> Dict:
+    """The payload format 2.0 event a function URL sends for one HTTP request"""
+    path, _, query = target.partition("?")
+    folded: Dict[str, str] = {}
+    for name, value in headers.items():
+        name = name.lower()
+        folded[name] = f"{folded[name]},{value}" if name in folded else value
+    cookies = [c.strip() for c in folded.pop("cookie", "").split(";") if c.strip()]
+    now = time.time()
+    return {
+        "version": "2.0",
+        "routeKey": "$default",
+        "rawPath": path,
+        "rawQueryString": query,
+        "cookies": cookies,
+        "headers": folded,
+        "requestContext": {
+            "accountId": "anonymous",
+            "apiId": "simulated",
+            "domainName": FUNCTION_URL_DOMAIN,
+            "domainPrefix": "simulated",
+            "http": {
+                "method": method,
+                "path": path,
+                "protocol": "HTTP/1.1",
+                "sourceIp": source_ip,
+                "userAgent": folded.get("user-agent", ""),
+            },
+            "requestId": str(uuid.uuid4()),
+            "routeKey": "$default",
+            "stage": "$default",
+            "time": time.strftime("%d/%b/%Y:%H:%M:%S +0000", time.gmtime(now)),
+            "timeEpoch": int(now * 1000),
+        },
+        "body": base64.b64encode(body).decode("ascii"),
+        "isBase64Encoded": True,
+    }
+
+
+class FunctionURLHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        print(f"{self.address_string()} {format % args}")
+
+    def _write_chunk(self, data: bytes):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _relay(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        event = function_url_event(self.command, self.path, self.headers, body, self.client_address[0])
+        chunks = self.server.runtime.invoke(event)
+
+        # Everything up to the delimiter is the prelude: status, headers and cookies
+        buffered = b""
+        try:
+            while PRELUDE_DELIMITER not in buffered:
+                buffered += next(chunks)
+        except (StopIteration, InvocationError) as e:
+            print(f"Invocation failed before responding: {e or 'no response'}")
+            self.send_error(502, "Bad Gateway")
+            return
+        head, _, rest = buffered.partition(PRELUDE_DELIMITER)
+        prelude = json_codec.loads(head)
+
+        self.send_response(prelude.get("statusCode", 200))
+        for name, value in (prelude.get("headers") or {}).items():
+            if name.lower() not in ("content-length", "transfer-encoding", "connection"):
+                self.send_header(name, value)
+        for cookie in prelude.get("cookies") or []:
+            self.send_header("Set-Cookie", cookie)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        try:
+            if rest:
+                self._write_chunk(rest)
+            for chunk in chunks:
+                self._write_chunk(chunk)
+        except InvocationError as e:
+            # Too late for a status code; cut the response short like a function URL does
+            print(f"Invocation failed mid-stream: {e}")
+            self.close_connection = True
+            return
+        self.wfile.write(b"0\r\n\r\n")
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = do_OPTIONS = do_HEAD = _relay
+
+
+def run_runtime(address: str, stop: threading.Event):
+    """Keep a lambda_streaming runtime process polling the simulated Runtime API"""
+    env = dict(os.environ, AWS_LAMBDA_RUNTIME_API=address)
+    backend_dir = os.path.dirname(os.path.abspath(__file__))
+    while not stop.is_set():
+        process = subprocess.Popen([sys.executable, "-m", "lambda_streaming"], env=env, cwd=backend_dir)
+        while process.poll() is None:
+            if stop.wait(0.5):
+                process.terminate()
+                process.wait()
+                return
+        print(f"Runtime exited with {process.returncode}; starting a new one")
+        time.sleep(1)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the app through a simulated streaming function URL")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--timeout", type=float, default=float(os.getenv("LAMBDA_TIMEOUT", "60")),
+                        help="seconds an invocation may take, like the function's timeout")
+    args = parser.parse_args()
+
+    runtime = RuntimeAPI(invocation_timeout=args.timeout).start()
+    stop = threading.Event()
+    threading.Thread(target=run_runtime, args=(runtime.address, stop), name="runtime", daemon=True).start()
+
+    front = ThreadingHTTPServer((args.host, args.port), FunctionURLHandler)
+    front.daemon_threads = True
+    front.runtime = runtime
+    print(f"Simulated function URL on http://{args.host}:{args.port} (Runtime API on {runtime.address})")
+    try:
+        front.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        stop.set()
+        front.server_close()
+        runtime.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""
+Rolling Bedrock token budgets per chat session and per client IP.
+
+Every turn is charged the input + output tokens Bedrock reports for it.
+Usage is counted in TOKEN_BUDGET_BUCKETS time buckets spanning
+TOKEN_BUDGET_WINDOW_SECONDS, so the budget rolls forward one bucket at a
+time. A turn is refused with BudgetExceeded before Bedrock is called once
+its session has used TOKEN_BUDGET_PER_SESSION tokens in the window, or its
+IP TOKEN_BUDGET_PER_IP (0 disables either limit).
+
+TOKEN_BUDGET_BACKEND picks where usage lives:
+
+    memory    per process; fine for one server, but every Lambda container
+              and pre-forked worker keeps its own count
+    dynamodb  shared across processes, in TOKEN_BUDGET_TABLE (partition
+              key "pk", TTL attribute "expires_at")
+"""
+import math
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterable, List, Optional
+
+import aws_clients
+from lifecycle import register_after_fork
+
+TOKEN_BUDGET_BACKEND = os.getenv("TOKEN_BUDGET_BACKEND", "memory").lower()
+TOKEN_BUDGET_TABLE = os.getenv("TOKEN_BUDGET_TABLE", "")
+TOKEN_BUDGET_WINDOW_SECONDS = int(os.getenv("TOKEN_BUDGET_WINDOW_SECONDS", "3600"))
+TOKEN_BUDGET_BUCKETS = int(os.getenv("TOKEN_BUDGET_BUCKETS", "6"))
+TOKEN_BUDGET_PER_SESSION = int(os.getenv("TOKEN_BUDGET_PER_SESSION", "50000"))
+TOKEN_BUDGET_PER_IP = int(os.getenv("TOKEN_BUDGET_PER_IP", "150000"))
+
+BUCKET_SECONDS = max(1, TOKEN_BUDGET_WINDOW_SECONDS // TOKEN_BUDGET_BUCKETS)
+
+
+class BudgetExceeded(Exception):
+    """Raised before a Bedrock call when a session or IP has spent its token budget"""
+
+    def __init__(self, scope: str, used: int, limit: int, retry_after: int):
+        super().__init__(f"{scope} token budget exhausted ({used}/{limit})")
+        self.scope = scope
+        self.used = used
+        self.limit = limit
+        self.retry_after = retry_after
+
+
+def current_bucket(now: Optional[float] = None) -> int:
+    return int((time.time() if now is None else now) // BUCKET_SECONDS)
+
+
+def window_buckets(now: Optional[float] = None) -> List[int]:
+    newest = current_bucket(now)
+    return list(range(newest - TOKEN_BUDGET_BUCKETS + 1, newest + 1))
+
+
+class MemoryUsageStore:
+    """Token counts per key and bucket, in this process only"""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._lock = threading.Lock()
+        self._usage: Dict[str, Dict[int, int]] = defaultdict(dict)
+        self._swept_bucket = current_bucket()
+
+    def _sweep(self, oldest: int):
+        # Drop buckets (and keys) that have left the window, at most once per bucket
+        if self._swept_bucket >= oldest:
+            return
+        self._swept_bucket = oldest
+        for key in list(self._usage):
+            buckets = self._usage[key]
+            for bucket in [b for b in buckets if b < oldest]:
+                del buckets[bucket]
+            if not buckets:
+                del self._usage[key]
+
+    def add(self, keys: Iterable[str], bucket: int, tokens: int):
+        with self._lock:
+            self._sweep(bucket - TOKEN_BUDGET_BUCKETS + 1)
+            for key in keys:
+                buckets = self._usage[key]
+                buckets[bucket] = buckets.get(bucket, 0) + tokens
+
+    def usage(self, keys: Iterable[str], buckets: List[int]) -> Dict[str, Dict[int, int]]:
+        with self._lock:
+            return {
+                key: {b: self._usage[key][b] for b in buckets if b in self._usage.get(key, {})}
+                for key in keys
+            }
+
+
+class DynamoUsageStore:
+    """Token counts per key and bucket in a DynamoDB table, one item per (key, bucket)"""
+
+    def __init__(self, table: str):
+        if not table:
+            raise ValueError("TOKEN_BUDGET_TABLE must be set for the dynamodb backend")
+        self.table = table
+        self.client = aws_clients.client("dynamodb")
+
+    @staticmethod
+    def _pk(key: str, bucket: int) -> str:
+        return f"{key}#{bucket}"
+
+    def add(self, keys: Iterable[str], bucket: int, tokens: int):
+        expires_at = (bucket + TOKEN_BUDGET_BUCKETS + 1) * BUCKET_SECONDS
+        for key in keys:
+            self.client.update_item(
+                TableName=self.table,
+                Key={"pk": {"S": self._pk(key, bucket)}},
+                UpdateExpression="ADD tokens :n SET expires_at = :e",
+                ExpressionAttributeValues={":n": {"N": str(tokens)}, ":e": {"N": str(expires_at)}},
+            )
+
+    def usage(self, keys: Iterable[str], buckets: List[int]) -> Dict[str, Dict[int, int]]:
+        keys = list(keys)
+        result: Dict[str, Dict[int, int]] = {key: {} for key in keys}
+        owners = {self._pk(key, b): (key, b) for key in keys for b in buckets}
+        request = {self.table: {
+            "Keys": [{"pk": {"S": pk}} for pk in owners],
+            "ProjectionExpression": "pk, tokens",
+        }}
+        # Unprocessed keys come back under throttling; retry them a couple of times
+        for _ in range(3):
+            response = self.client.batch_get_item(RequestItems=request)
+            for item in response["Responses"].get(self.table, []):
+                key, bucket = owners[item["pk"]["S"]]
+                result[key][bucket] = int(item["tokens"]["N"])
+            request = response.get("UnprocessedKeys") or {}
+            if not request:
+                break
+        return result
+
+
+def create_store():
+    if TOKEN_BUDGET_BACKEND == "dynamodb":
+        return DynamoUsageStore(TOKEN_BUDGET_TABLE)
+    if TOKEN_BUDGET_BACKEND != "memory":
+        raise ValueError(f"Unknown TOKEN_BUDGET_BACKEND: {TOKEN_BUDGET_BACKEND}")
+    return MemoryUsageStore()
+
+
+store = create_store()
+
+if isinstance(store, MemoryUsageStore):
+    register_after_fork(store.reset)
+
+
+def budget_keys(session_id: str, client_ip: Optional[str]) -> Dict[str, int]:
+    """Usage keys a turn is charged to, with their limits; limits of 0 are skipped"""
+    keys = {}
+    if TOKEN_BUDGET_PER_SESSION > 0:
+        keys[f"session:{session_id}"] = TOKEN_BUDGET_PER_SESSION
+    if client_ip and TOKEN_BUDGET_PER_IP > 0:
+        keys[f"ip:{client_ip}"] = TOKEN_BUDGET_PER_IP
+    return keys
+
+
+def check(session_id: str, client_ip: Optional[str]):
+    """Raise BudgetExceeded if the session or IP has no budget left in the window"""
+    keys = budget_keys(session_id, client_ip)
+    if not keys:
+        return
+    now = time.time()
+    try:
+        usage = store.usage(keys, window_buckets(now))
+    except Exception as e:
+        # An unreachable usage store shouldn't take chat down with it
+        print(f"Token budget check failed, allowing the turn: {e}")
+        return
+    for key, limit in keys.items():
+        buckets = usage.get(key, {})
+        used = sum(buckets.values())
+        if used >= limit:
+            # The budget frees up as the oldest charged bucket leaves the window
+            oldest = min(buckets)
+            retry_after = max(1, math.ceil((oldest + TOKEN_BUDGET_BUCKETS) * BUCKET_SECONDS - now))
+            raise BudgetExceeded(key.split(":", 1)[0], used, limit, retry_after)
+
+
+def charge(session_id: str, client_ip: Optional[str], usage: Dict):
+    """Charge a turn's Bedrock usage ({"inputTokens", "outputTokens"}) to its session and IP"""
+    tokens = int(usage.get("inputTokens") or 0) + int(usage.get("outputTokens") or 0)
+    keys = budget_keys(session_id, client_ip)
+    if tokens <= 0 or not keys:
+        return
+    try:
+        store.add(keys, current_bucket(), tokens)
+    except Exception as e:
+        # The reply is already generated; losing one charge beats failing the turn
+        print(f"Token budget charge failed: {e}")
@@ -0,0 +1,433 @@
+"""
+Request tracing with OpenTelemetry-compatible spans.
+
+Spans carry W3C trace/span IDs and are exported as OTLP/JSON, either
+appended to a local JSONL file (one ExportTraceServiceRequest per line)
+or POSTed to an OTLP/HTTP collector. boto3 clients and the requests
+library are instrumented so AWS, reCAPTCHA and Brevo calls show up as
+child spans, and log_context() puts the active trace ID into log lines.
+
+    TRACING_ENABLED=true
+    TRACING_SAMPLE_RATIO=0.1               # fraction of new traces recorded
+    TRACING_EXPORTER=file|otlp|console|none
+    TRACING_FILE=./traces/spans.jsonl
+    TRACING_OTLP_ENDPOINT=http://localhost:4318/v1/traces
+
+On Lambda the package directory is read-only, so use otlp or console there.
+
+Inspect a trace file offline with:
+
+    uv run tracing.py ./traces/spans.jsonl --slowest 5
+"""
+import argparse
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+import urllib.request
+from collections import defaultdict
+from typing import Dict, List, Optional
+from urllib.parse import urlsplit
+
+from lifecycle import register_after_fork, register_shutdown_hook
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", "1.0"))
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file").lower()
+TRACING_FILE = os.getenv("TRACING_FILE", "./traces/spans.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "digital-twin-api")
+# Finished spans are buffered and exported in batches of this size, from a background
+# thread, so a request never waits on the collector
+TRACING_BATCH_SIZE = int(os.getenv("TRACING_BATCH_SIZE", "64"))
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+STATUS_UNSET, STATUS_OK, STATUS_ERROR = 0, 1, 2
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+_buffer: List[Dict] = []
+_buffer_lock = threading.Lock()
+_flushing = threading.Event()
+
+
+class Span:
+    """A single timed operation; recorded only when its trace is sampled"""
+
+    __slots__ = ("name", "trace_id", "span_id", "parent_id", "kind", "sampled",
+                 "attributes", "start_ns", "end_ns", "status", "status_message", "_token")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str], sampled: bool,
+                 kind: int = KIND_INTERNAL, attributes: Optional[Dict] = None):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.kind = kind
+        self.sampled = sampled
+        self.attributes = dict(attributes or {})
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.status = STATUS_UNSET
+        self.status_message = ""
+        self._token = None
+
+    def set_attribute(self, key: str, value):
+        if value is not None:
+            self.attributes[key] = value
+
+    def record_error(self, error: BaseException):
+        self.status = STATUS_ERROR
+        self.status_message = f"{type(error).__name__}: {error}"
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+    def end(self):
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.sampled:
+            _export(self)
+
+    def __enter__(self):
+        self._token = _current_span.set(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc is not None and self.status == STATUS_UNSET:
+            self.record_error(exc)
+        _current_span.reset(self._token)
+        self.end()
+        return False
+
+
+class _NoopSpan:
+    """Returned while tracing is disabled so instrumented code pays almost nothing"""
+
+    trace_id = span_id = None
+    sampled = False
+
+    def set_attribute(self, key, value):
+        pass
+
+    def record_error(self, error):
+        pass
+
+    def end(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+def parse_traceparent(header: Optional[str]):
+    """Return (trace_id, parent_span_id, sampled) from a W3C traceparent header, or None"""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) < 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16), int(parts[3], 16)
+    except ValueError:
+        return None
+    if parts[1] == "0" * 32 or parts[2] == "0" * 16:
+        return None
+    return parts[1], parts[2], bool(int(parts[3], 16) & 1)
+
+
+def _sample(trace_id: str) -> bool:
+    # Trace-ID ratio sampling: the same trace is sampled the same way everywhere
+    return int(trace_id[16:], 16) < TRACING_SAMPLE_RATIO * (1 << 64)
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, traceparent: Optional[str] = None, **attributes):
+    """
+    Create a span under the current one (or under an incoming traceparent).
+
+    Use it as a context manager to make it current, or call end() yourself.
+    """
+    if not TRACING_ENABLED:
+        return NOOP_SPAN
+    parent = _current_span.get()
+    incoming = parse_traceparent(traceparent) if parent is None else None
+    if parent is not None:
+        return Span(name, parent.trace_id, parent.span_id, parent.sampled, kind, attributes)
+    if incoming is not None:
+        trace_id, parent_id, sampled = incoming
+        return Span(name, trace_id, parent_id, sampled, kind, attributes)
+    trace_id = f"{random.getrandbits(128):032x}"
+    return Span(name, trace_id, None, _sample(trace_id), kind, attributes)
+
+
+def span(name: str, **attributes):
+    """Context manager for an internal span: `with tracing.span("load_conversation"):`"""
+    return start_span(name, KIND_INTERNAL, **attributes)
+
+
+def current_span():
+    return _current_span.get() or NOOP_SPAN
+
+
+def log_context() -> Dict:
+    """Trace and span IDs of the active span, for structured log lines"""
+    active = _current_span.get()
+    if active is None:
+        return {}
+    return {"trace_id": active.trace_id, "span_id": active.span_id}
+
+
+# Export
+
+def _otlp_value(value) -> Dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_span(finished: Span) -> Dict:
+    record = {
+        "traceId": finished.trace_id,
+        "spanId": finished.span_id,
+        "name": finished.name,
+        "kind": finished.kind,
+        "startTimeUnixNano": str(finished.start_ns),
+        "endTimeUnixNano": str(finished.end_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in finished.attributes.items()],
+        "status": {"code": finished.status},
+    }
+    if finished.parent_id:
+        record["parentSpanId"] = finished.parent_id
+    if finished.status_message:
+        record["status"]["message"] = finished.status_message
+    return record
+
+
+def to_otlp(spans: List[Dict]) -> Dict:
+    """Wrap OTLP span records in an ExportTraceServiceRequest"""
+    return {"resourceSpans": [{
+        "resource": {"attributes": [
+            {"key": "service.name", "value": {"stringValue": TRACING_SERVICE_NAME}},
+            {"key": "process.pid", "value": {"intValue": str(os.getpid())}},
+        ]},
+        "scopeSpans": [{"scope": {"name": "tracing"}, "spans": spans}],
+    }]}
+
+
+def _export(finished: Span):
+    with _buffer_lock:
+        _buffer.append(_otlp_span(finished))
+        due = len(_buffer) >= TRACING_BATCH_SIZE
+    if due and not _flushing.is_set():
+        _flushing.set()
+        threading.Thread(target=_background_flush, name="tracing-flush", daemon=True).start()
+
+
+def _background_flush():
+    try:
+        flush()
+    finally:
+        _flushing.clear()
+
+
+def _write_batch(batch: List[Dict]):
+    if not batch or TRACING_EXPORTER == "none":
+        return
+    payload = json.dumps(to_otlp(batch), separators=(",", ":"))
+    try:
+        if TRACING_EXPORTER == "file":
+            os.makedirs(os.path.dirname(TRACING_FILE) or ".", exist_ok=True)
+            # One line per batch, written in a single append so workers don't interleave
+            with open(TRACING_FILE, "a", encoding="utf-8") as f:
+                f.write(payload + "\n")
+        elif TRACING_EXPORTER == "otlp":
+            # urllib rather than requests, so exporting isn't itself traced
+            request = urllib.request.Request(
+                TRACING_OTLP_ENDPOINT, data=payload.encode("utf-8"),
+                headers={"Content-Type": "application/json"}, method="POST",
+            )
+            urllib.request.urlopen(request, timeout=5).close()
+        elif TRACING_EXPORTER == "console":
+            print(payload)
+        else:
+            print(f"Unknown TRACING_EXPORTER: {TRACING_EXPORTER}")
+    except Exception as e:
+        print(f"Trace export failed ({len(batch)} spans dropped): {e}")
+
+
+def flush():
+    """Export any buffered spans now (end of a Lambda invocation, shutdown)"""
+    with _buffer_lock:
+        batch = _buffer[:]
+        _buffer.clear()
+    _write_batch(batch)
+
+
+def _reset_after_fork():
+    # Spans buffered by the parent belong to the parent
+    with _buffer_lock:
+        _buffer.clear()
+    _flushing.clear()
+
+
+register_after_fork(_reset_after_fork)
+register_shutdown_hook(flush)
+
+
+# Instrumentation
+
+def _before_botocore_call(model, context, **kwargs):
+    service = model.service_model.service_name
+    context["tracing_span"] = start_span(
+        f"{service}.{model.name}", KIND_CLIENT,
+        **{"rpc.system": "aws-api", "rpc.service": service, "rpc.method": model.name},
+    )
+
+
+def _after_botocore_call(http_response, parsed, model, context, **kwargs):
+    client_span = context.pop("tracing_span", None)
+    if client_span is None:
+        return
+    client_span.set_attribute("http.status_code", getattr(http_response, "status_code", None))
+    metadata = (parsed or {}).get("ResponseMetadata", {})
+    client_span.set_attribute("aws.request_id", metadata.get("RequestId"))
+    client_span.set_attribute("aws.retry_attempts", metadata.get("RetryAttempts"))
+    error = (parsed or {}).get("Error", {}).get("Code")
+    if error:
+        client_span.status = STATUS_ERROR
+        client_span.status_message = error
+    client_span.end()
+
+
+def _after_botocore_error(exception, context, **kwargs):
+    client_span = context.pop("tracing_span", None)
+    if client_span is not None:
+        client_span.record_error(exception)
+        client_span.end()
+
+
+def instrument_client(client):
+    """Record a CLIENT span for every API call made through a boto3 client"""
+    if client is None or not TRACING_ENABLED:
+        return client
+    events = client.meta.events
+    events.register("before-call.*.*", _before_botocore_call, unique_id="tracing-before-call")
+    events.register("after-call.*.*", _after_botocore_call, unique_id="tracing-after-call")
+    events.register("after-call-error.*.*", _after_botocore_error, unique_id="tracing-after-call-error")
+    return client
+
+
+def instrument_requests():
+    """Record a CLIENT span for every HTTP request sent with the requests library"""
+    import requests
+
+    if not TRACING_ENABLED or getattr(requests.Session.send, "_traced", False):
+        return
+    original_send = requests.Session.send
+
+    def send(self, request, **kwargs):
+        url = urlsplit(request.url)
+        with start_span(f"HTTP {request.method} {url.hostname}", KIND_CLIENT, **{
+            "http.method": request.method,
+            "http.url": f"{url.scheme}://{url.netloc}{url.path}",
+        }) as client_span:
+            response = original_send(self, request, **kwargs)
+            client_span.set_attribute("http.status_code", response.status_code)
+            if response.status_code >= 500:
+                client_span.status = STATUS_ERROR
+            return response
+
+    send._traced = True
+    requests.Session.send = send
+
+
+# Offline inspection
+
+def load_spans(path: str) -> List[Dict]:
+    spans = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            for resource in json.loads(line).get("resourceSpans", []):
+                for scope in resource.get("scopeSpans", []):
+                    spans.extend(scope.get("spans", []))
+    return spans
+
+
+def _duration_ms(record: Dict) -> float:
+    return (int(record["endTimeUnixNano"]) - int(record["startTimeUnixNano"])) / 1e6
+
+
+def print_trace(spans: List[Dict]):
+    """Print one trace as an indented tree with durations"""
+    children = defaultdict(list)
+    ids = {s["spanId"] for s in spans}
+    roots = []
+    for record in sorted(spans, key=lambda s: int(s["startTimeUnixNano"])):
+        parent = record.get("parentSpanId")
+        if parent in ids:
+            children[parent].append(record)
+        else:
+            roots.append(record)
+
+    def walk(record, depth):
+        error = " ERROR" if record.get("status", {}).get("code") == STATUS_ERROR else ""
+        print(f"  {'  ' * depth}{record['name']:<{48 - 2 * depth}} {_duration_ms(record):9.2f} ms{error}")
+        for child in children[record["spanId"]]:
+            walk(child, depth + 1)
+
+    for root in roots:
+        walk(root, 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Summarize an OTLP/JSON trace file")
+    parser.add_argument("path", nargs="?", default=TRACING_FILE, help="Trace file written by the file exporter")
+    parser.add_argument("--slowest", type=int, default=5, help="Print the N slowest traces as trees")
+    parser.add_argument("--trace-id", help="Print only this trace")
+    args = parser.parse_args()
+
+    traces = defaultdict(list)
+    for record in load_spans(args.path):
+        traces[record["traceId"]].append(record)
+    print(f"{len(traces)} trace(s) in {args.path}")
+
+    if args.trace_id:
+        selected = [args.trace_id] if args.trace_id in traces else []
+    else:
+        def total(trace_id):
+            records = traces[trace_id]
+            return max(int(s["endTimeUnixNano"]) for s in records) - min(int(s["startTimeUnixNano"]) for s in records)
+        selected = sorted(traces, key=total, reverse=True)[:args.slowest]
+
+    for trace_id in selected:
+        print(f"\ntrace {trace_id}")
+        print_trace(traces[trace_id])
+
+    # Per-span-name totals show which stage dominates across all traces
+    by_name = defaultdict(list)
+    for records in traces.values():
+        for record in records:
+            by_name[record["name"]].append(_duration_ms(record))
+    print(f"\n{'span':<48} {'count':>6} {'mean ms':>9} {'max ms':>9}")
+    for name, durations in sorted(by_name.items(), key=lambda item: -sum(item[1])):
+        print(f"{name:<48} {len(durations):>6} {sum(durations) / len(durations):9.2f} {max(durations):9.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -40,6 +40,28 @@ resource "aws_s3_bucket_ownership_controls" "memory" {
   }
 }
 
+# Expire idle conversation sessions (every write refreshes an object's age)
+resource "aws_s3_bucket_lifecycle_configuration" "memory" {
+  bucket = aws_s3_bucket.memory.id
+
+  rule {
+    id     = "expire-idle-sessions"
+    status = "Enabled"
+
+    filter {
+      prefix = "sessions/"
+    }
+
+    expiration {
+      days = var.session_ttl_days
+    }
+
+    abort_incomplete_multipart_upload {
+      days_after_initiation = 1
+    }
+  }
+}
+
 # Upload resume.pdf into the memory bucket
 resource "aws_s3_object" "resume" {
   bucket = aws_s3_bucket.memory.id
@@ -146,7 +168,7 @@ resource "aws_lambda_function" "api" {
   tags             = local.common_tags
 
   environment {
-    variables = {
+    variables = merge({
       CORS_ORIGINS          = var.use_custom_domain ? "https://${var.root_domain},https://www.${var.root_domain}" : "https://${aws_cloudfront_distribution.main.domain_name}"
       S3_BUCKET             = aws_s3_bucket.memory.id
       USE_S3                = "true"
@@ -161,8 +183,21 @@ resource "aws_lambda_function" "api" {
       RECAPTCHA_SECRET_KEY  = var.recaptcha_secret_key
       RECAPTCHA_VERIFY_URL  = var.recaptcha_verify_url
       RESUME_NAME           = var.resume_name
-
-    }
+      SESSION_TTL_DAYS      = var.session_ttl_days
+      KNOWLEDGE_S3_BUCKET   = var.knowledge_from_s3 ? aws_s3_bucket.memory.id : ""
+      TOKEN_BUDGET_BACKEND  = var.enable_token_budget_table ? "dynamodb" : "memory"
+      TOKEN_BUDGET_TABLE    = var.enable_token_budget_table ? aws_dynamodb_table.token_budget[0].name : ""
+      IDEMPOTENCY_BACKEND   = var.enable_idempotency_table ? "dynamodb" : "memory"
+      IDEMPOTENCY_TABLE     = var.enable_idempotency_table ? aws_dynamodb_table.idempotency[0].name : ""
+    }, var.enable_response_streaming ? {
+      # Swaps the managed runtime client for lambda_streaming.py's, which can stream responses
+      AWS_LAMBDA_EXEC_WRAPPER = "/var/task/lambda_streaming_bootstrap"
+    } : {}, length(var.bedrock_regions) > 1 ? {
+      BEDROCK_REGIONS          = join(",", var.bedrock_regions)
+      BEDROCK_REGION_MODEL_IDS = join(",", [for region, model_id in var.bedrock_region_model_ids : "${region}=${model_id}"])
+      # Fail over to the next region at once instead of retrying a throttled one
+      AWS_MAX_ATTEMPTS_BEDROCK_RUNTIME = "1"
+    } : {})
   }
 
   # Ensure Lambda waits for the distribution to exist
@@ -227,6 +262,13 @@ resource "aws_apigatewayv2_route" "get_health" {
   target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
 }
 
+# Every route again under /personas/<persona_id>/ for multi-persona hosting
+resource "aws_apigatewayv2_route" "personas" {
+  api_id    = aws_apigatewayv2_api.main.id
+  route_key = "ANY /personas/{proxy+}"
+  target    = "integrations/${aws_apigatewayv2_integration.lambda.id}"
+}
+
 # Lambda permission for API Gateway
 resource "aws_lambda_permission" "api_gw" {
   statement_id  = "AllowExecutionFromAPIGateway"
@@ -236,6 +278,182 @@ resource "aws_lambda_permission" "api_gw" {
   source_arn    = "${aws_apigatewayv2_api.main.execution_arn}/*/*"
 }
 
+# Optional function URL that streams responses (API Gateway HTTP APIs buffer them)
+resource "aws_lambda_function_url" "streaming" {
+  count              = var.enable_response_streaming ? 1 : 0
+  function_name      = aws_lambda_function.api.function_name
+  authorization_type = "NONE"
+  invoke_mode        = "RESPONSE_STREAM"
+}
+
+resource "aws_lambda_permission" "function_url" {
+  count                  = var.enable_response_streaming ? 1 : 0
+  statement_id           = "AllowPublicFunctionUrl"
+  action                 = "lambda:InvokeFunctionUrl"
+  function_name          = aws_lambda_function.api.function_name
+  principal              = "*"
+  function_url_auth_type = "NONE"
+}
+
+# Optional API Gateway WebSocket API for streaming chat; lambda_handler routes these events itself
+resource "aws_apigatewayv2_api" "websocket" {
+  count                      = var.enable_websocket_api ? 1 : 0
+  name                       = "${local.name_prefix}-websocket"
+  protocol_type              = "WEBSOCKET"
+  route_selection_expression = "$request.body.action"
+  tags                       = local.common_tags
+}
+
+resource "aws_apigatewayv2_integration" "websocket" {
+  count            = var.enable_websocket_api ? 1 : 0
+  api_id           = aws_apigatewayv2_api.websocket[0].id
+  integration_type = "AWS_PROXY"
+  integration_uri  = aws_lambda_function.api.invoke_arn
+}
+
+resource "aws_apigatewayv2_route" "websocket" {
+  for_each  = var.enable_websocket_api ? toset(["$connect", "$disconnect", "$default"]) : toset([])
+  api_id    = aws_apigatewayv2_api.websocket[0].id
+  route_key = each.value
+  target    = "integrations/${aws_apigatewayv2_integration.websocket[0].id}"
+}
+
+resource "aws_apigatewayv2_stage" "websocket" {
+  count       = var.enable_websocket_api ? 1 : 0
+  api_id      = aws_apigatewayv2_api.websocket[0].id
+  name        = var.environment
+  auto_deploy = true
+  tags        = local.common_tags
+
+  default_route_settings {
+    throttling_burst_limit = var.api_throttle_burst_limit
+    throttling_rate_limit  = var.api_throttle_rate_limit
+  }
+}
+
+resource "aws_lambda_permission" "websocket" {
+  count         = var.enable_websocket_api ? 1 : 0
+  statement_id  = "AllowExecutionFromWebSocketAPI"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.api.function_name
+  principal     = "apigateway.amazonaws.com"
+  source_arn    = "${aws_apigatewayv2_api.websocket[0].execution_arn}/*/*"
+}
+
+# Lets the handler push streamed tokens back to connected clients
+resource "aws_iam_role_policy" "lambda_websocket" {
+  count = var.enable_websocket_api ? 1 : 0
+  name  = "${local.name_prefix}-websocket-manage-connections"
+  role  = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = "execute-api:ManageConnections"
+        Resource = "${aws_apigatewayv2_api.websocket[0].execution_arn}/*"
+      },
+    ]
+  })
+}
+
+# Chat token usage shared by every Lambda container (see backend/token_budget.py)
+resource "aws_dynamodb_table" "token_budget" {
+  count        = var.enable_token_budget_table ? 1 : 0
+  name         = "${local.name_prefix}-token-budget"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+  tags         = local.common_tags
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_token_budget" {
+  count = var.enable_token_budget_table ? 1 : 0
+  name  = "${local.name_prefix}-token-budget"
+  role  = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["dynamodb:UpdateItem", "dynamodb:BatchGetItem"]
+        Resource = aws_dynamodb_table.token_budget[0].arn
+      },
+    ]
+  })
+}
+
+# Idempotency-Key records shared by every Lambda container (see backend/idempotency.py)
+resource "aws_dynamodb_table" "idempotency" {
+  count        = var.enable_idempotency_table ? 1 : 0
+  name         = "${local.name_prefix}-idempotency"
+  billing_mode = "PAY_PER_REQUEST"
+  hash_key     = "pk"
+  tags         = local.common_tags
+
+  attribute {
+    name = "pk"
+    type = "S"
+  }
+
+  ttl {
+    attribute_name = "expires_at"
+    enabled        = true
+  }
+}
+
+resource "aws_iam_role_policy" "lambda_idempotency" {
+  count = var.enable_idempotency_table ? 1 : 0
+  name  = "${local.name_prefix}-idempotency"
+  role  = aws_iam_role.lambda_role.id
+
+  policy = jsonencode({
+    Version = "2012-10-17"
+    Statement = [
+      {
+        Effect   = "Allow"
+        Action   = ["dynamodb:PutItem", "dynamodb:GetItem", "dynamodb:UpdateItem", "dynamodb:DeleteItem"]
+        Resource = aws_dynamodb_table.idempotency[0].arn
+      },
+    ]
+  })
+}
+
+# Optional keep-warm pings; the handler answers them without routing through FastAPI
+resource "aws_cloudwatch_event_rule" "warmup" {
+  count               = var.warmup_schedule_expression != "" ? 1 : 0
+  name                = "${local.name_prefix}-warmup"
+  schedule_expression = var.warmup_schedule_expression
+  tags                = local.common_tags
+}
+
+resource "aws_cloudwatch_event_target" "warmup" {
+  count = var.warmup_schedule_expression != "" ? 1 : 0
+  rule  = aws_cloudwatch_event_rule.warmup[0].name
+  arn   = aws_lambda_function.api.arn
+  input = jsonencode({ warmup = true })
+}
+
+resource "aws_lambda_permission" "warmup" {
+  count         = var.warmup_schedule_expression != "" ? 1 : 0
+  statement_id  = "AllowExecutionFromEventBridgeWarmup"
+  action        = "lambda:InvokeFunction"
+  function_name = aws_lambda_function.api.function_name
+  principal     = "events.amazonaws.com"
+  source_arn    = aws_cloudwatch_event_rule.warmup[0].arn
+}
+
 # CloudFront distribution
 resource "aws_cloudfront_distribution" "main" {
   aliases = local.aliases
@@ -26,4 +26,14 @@ output "lambda_function_name" {
 output "custom_domain_url" {
   description = "Root URL of the production site"
   value       = var.use_custom_domain ? "https://${var.root_domain}" : ""
-}
\ No newline at end of file
+}
+
+output "websocket_url" {
+  description = "WebSocket URL for streaming chat (empty unless enable_websocket_api)"
+  value       = var.enable_websocket_api ? aws_apigatewayv2_stage.websocket[0].invoke_url : ""
+}
+
+output "streaming_url" {
+  description = "Function URL for streamed chat, e.g. <url>chat/stream (empty unless enable_response_streaming)"
+  value       = var.enable_response_streaming ? aws_lambda_function_url.streaming[0].function_url : ""
+}
@@ -116,3 +116,57 @@ variable "resume_name" {
 
 
 
+
+variable "session_ttl_days" {
+  description = "Days of inactivity before a conversation session expires"
+  type        = number
+  default     = 30
+}
+
+variable "warmup_schedule_expression" {
+  description = "EventBridge schedule for Lambda keep-warm pings, e.g. rate(5 minutes); empty disables them"
+  type        = string
+  default     = ""
+}
+
+variable "enable_websocket_api" {
+  description = "Create an API Gateway WebSocket API for streaming chat"
+  type        = bool
+  default     = false
+}
+
+variable "knowledge_from_s3" {
+  description = "Read knowledge bundles from s3://<memory bucket>/knowledge/ and hot-reload them instead of using the packaged data/"
+  type        = bool
+  default     = false
+}
+
+variable "enable_token_budget_table" {
+  description = "Keep chat token budgets in a DynamoDB table shared by all Lambda containers instead of per container"
+  type        = bool
+  default     = false
+}
+
+variable "enable_response_streaming" {
+  description = "Add a Lambda function URL in RESPONSE_STREAM mode, served by lambda_streaming.py, so /chat/stream reaches the browser token by token"
+  type        = bool
+  default     = false
+}
+
+variable "enable_idempotency_table" {
+  description = "Keep Idempotency-Key records in a DynamoDB table shared by all Lambda containers instead of per container"
+  type        = bool
+  default     = false
+}
+
+variable "bedrock_regions" {
+  description = "Regions to spread Bedrock calls over by observed latency (bedrock_regions.py); fewer than two keeps the single Lambda-region client"
+  type        = list(string)
+  default     = []
+}
+
+variable "bedrock_region_model_ids" {
+  description = "Model or inference profile ID per region for routed calls, e.g. { \"eu-west-1\" = \"eu.amazon.nova-lite-v1:0\" }; other regions use bedrock_model_id"
+  type        = map(string)
+  default     = {}
+}